@@ -10,6 +10,7 @@ checkret () {
 if [ ! -f build_lock ]; then
     pip install --upgrade cffi
     checkret
+    # --bench needs pyglet 1.4 or newer for headless rendering.
     pip install --upgrade hg+https://pyglet.googlecode.com/hg/
     checkret
     pip install --upgrade pytest
@@ -1,11 +1,12 @@
 from __future__ import (print_function, division, absolute_import)
 
 
-import importlib
-import pkgutil
+import json
 import sys
 
-from interface import Interface, OVRInterface
+# Only light modules up here: pyglet, GL and the rest are imported once a
+# game is actually launched, so --help and --list-games start fast.
+import registry
 
 
 USE_OVR = False
@@ -13,8 +14,6 @@ USE_OVR = False
 
 def main():
     global USE_OVR
-    game_names = [name[6:] for _, name, _ in pkgutil.walk_packages(['larch'])
-                     if name.startswith('games.')]
 
     from argparse import ArgumentParser
     parser = ArgumentParser()
@@ -24,27 +23,86 @@ def main():
     parser.add_argument(
             '--game',
             action='store',
-            help='Specify the game to run. List of games: {}'.format(
-                game_names))
+            help='Specify the game to run. Built in games: {}. See '
+                 '--list-games for plugins too.'.format(
+                     registry.builtin_games()))
+    parser.add_argument(
+            '--list-games', action='store_true',
+            help='List built in and plugin games')
+    parser.add_argument(
+            '--bench', action='store', type=int, metavar='N',
+            help='Render N frames offscreen without a window and print '
+                 'frame times as JSON. Needs pyglet 1.4 or newer')
+    parser.add_argument(
+            '--profile', action='store', metavar='PATH',
+            help='Time every frame and write the times to PATH on exit, '
+                 'as JSON if it ends in .json and as CSV otherwise')
+    parser.add_argument(
+            '--trace-gl', action='store', type=int, metavar='FRAMES',
+            help='Count GL calls and redundant state changes, print a '
+                 'summary every FRAMES frames')
+    parser.add_argument(
+            '--debug', action='store_true', help='Write debug log messages')
 
     parsed_args = parser.parse_args(sys.argv[1:])
 
+    if parsed_args.list_games:
+        for name in registry.all_games():
+            print(name)
+        return
+
     USE_OVR = parsed_args.ovr
+    if parsed_args.bench is not None and USE_OVR:
+        parser.error('--bench does not support --ovr')
+
+    new_game = registry.find_game(parsed_args.game)
+    if new_game is None:
+        parser.print_help()
+        return
+
+    import logger
+    if parsed_args.debug:
+        logger.set_level(logger.DEBUG)
+
+    import pyglet
+    if parsed_args.bench is not None:
+        # pyglet 1.4 and up create an EGL context without a display. Older
+        # ones don't know the option and would silently open an X window,
+        # or fail without a display. Set it before pyglet.window is loaded.
+        if 'headless' not in pyglet.options:
+            parser.error('--bench needs pyglet 1.4 or newer for headless '
+                         'rendering, found {}'.format(pyglet.version))
+        pyglet.options['headless'] = True
+    from interface import Interface, OVRInterface, HeadlessInterface
+    import timing
+
     InterfaceClass = Interface
     if USE_OVR:
         InterfaceClass = OVRInterface
+    if parsed_args.bench is not None:
+        InterfaceClass = HeadlessInterface
+
+    Game = new_game(InterfaceClass)
 
-    # See if --game flag matches a module in the games package.
-    Game = None
-    if parsed_args.game in game_names:
-        module = importlib.import_module('games.{}'.format(parsed_args.game))
-        Game = module.new(InterfaceClass)
+    if parsed_args.bench is not None:
+        result = timing.bench(Game, parsed_args.bench)
+        result['game'] = parsed_args.game
+        print(json.dumps(result, indent=2, sort_keys=True))
+        return
 
-    if Game:
-        with Game() as game:
+    with Game() as game:
+        profiler = None
+        if parsed_args.profile:
+            profiler = timing.FrameProfiler()
+            profiler.attach(game)
+        if parsed_args.trace_gl:
+            import gltrace
+            gltrace.GLTracer(parsed_args.trace_gl).attach(game)
+        try:
             game.run()
-    else:
-        parser.print_help()
+        finally:
+            if profiler is not None:
+                profiler.dump(parsed_args.profile)
 
 
 if __name__ == '__main__':
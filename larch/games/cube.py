@@ -15,14 +15,8 @@ class HappyCube(primitive.Cube):
         self.rot_vel = 0.1
         self.rotation = ((0.9, 0.7, -0.3), 0.0)
         self.translation = (0, 0, -3)
-        self.cumtime = 0
-
-
-    def tick(self, dt):
-        self.cumtime += dt
-        self.rotation = (
-                self.rotation[0],
-                self.rotation[1] + self.rot_vel*2*3.14*dt)
+        # Primitive.tick (or a TransformStore) does the spinning.
+        self.angular_velocity = self.rot_vel*2*3.14
 
 
 class HappyUniverse(primitive.PrimitiveUniverse):
@@ -40,7 +34,7 @@ def new(interface_class):
     class SimpleGame(interface_class):
         def begin(self):
             super(SimpleGame, self).begin()
-            self.universe = HappyUniverse(self.hmdinfo)
+            self.universe = HappyUniverse(self.hmdinfo, interpolate=True)
             self.universe.attach_primitive(HappyCube())
 
     return SimpleGame
@@ -2,7 +2,8 @@ from __future__ import (print_function, division, absolute_import)
 
 from gl import *
 
-from render import Program, RenderHandle, create_shader
+import logger
+from render import Program, RenderHandle
 from universe import Agent, Universe
 
 def make_simple_program():
@@ -30,9 +31,8 @@ def make_simple_program():
     }
     '''
     p = Program(glCreateProgram(), 'simple_program')
-    p.attach_shader(create_shader(vertex_src, GL_VERTEX_SHADER, 'vertex'))
-    p.attach_shader(create_shader(frag_src, GL_FRAGMENT_SHADER, 'frag'))
-    p.link()
+    p.build([(vertex_src, GL_VERTEX_SHADER, 'vertex'),
+             (frag_src, GL_FRAGMENT_SHADER, 'frag')])
     return p
 
 
@@ -66,7 +66,7 @@ class TriangleAgent(Agent):
 
 
     def tick(self, dt):
-        print('I am a triangle!')
+        logger.debug('I am a triangle!')
 
 
 class SimpleUniverse(Universe):
@@ -0,0 +1,251 @@
+'''Optional tracing of the GL calls the engine makes.
+Every module star-imports gl, so install() swaps the gl functions in all
+loaded modules for counting wrappers, and uninstall() swaps them back.
+Calls that set state to what it already is are counted as redundant.
+'''
+from __future__ import (print_function, division, absolute_import)
+
+
+from collections import Counter
+from numbers import Number
+import sys
+
+import gl
+import logger
+
+
+# State setting calls: name -> number of leading arguments that say which
+# state is set (e.g. the target of glBindBuffer). The remaining arguments
+# are the value.
+STATE_CALLS = {
+        'glUseProgram': 0,
+        'glBindVertexArray': 0,
+        'glPolygonMode': 1,
+        'glClearColor': 0,
+        'glLineWidth': 0,
+        'glViewport': 0,
+        'glActiveTexture': 0,
+        'glBindBuffer': 1,
+        'glBindTexture': 1,
+        'glBindFramebuffer': 1,
+        'glBindRenderbuffer': 1,
+        }
+# Calls that delete objects whose names may be reused -> the call binding
+# them. Bindings to a deleted name are forgotten.
+DELETE_CALLS = {
+        'glDeleteBuffers': 'glBindBuffer',
+        'glDeleteTextures': 'glBindTexture',
+        'glDeleteVertexArrays': 'glBindVertexArray',
+        'glDeleteFramebuffers': 'glBindFramebuffer',
+        'glDeleteRenderbuffers': 'glBindRenderbuffer',
+        }
+
+
+def _freeze(arg):
+    'A hashable, comparable copy of a GL call argument.'
+    if arg is None or isinstance(arg, (Number, str)):
+        return arg
+    try:
+        return tuple(arg)
+    except TypeError:
+        return arg
+
+
+class GLTracer(object):
+    '''Counts GL calls per function, per frame. Call end_frame() when a frame
+    is done, or attach() to an interface to have that done after each draw.
+    Uniforms are tracked per program and location, glEnable/glDisable per
+    capability, texture bindings per texture unit, and the other calls in
+    STATE_CALLS by their arguments. Linking or deleting a program forgets
+    its uniforms, binding a VAO forgets the element array buffer, which is
+    VAO state, and DELETE_CALLS forget the bindings of what they delete.
+    '''
+    def __init__(self, report_every=1, top=10):
+        self.report_every = report_every  # Frames between summaries, 0: none
+        self.top = top  # Functions listed per summary.
+        self.calls = Counter()
+        self.redundant = Counter()
+        self.frame_count = 0
+        self.last_frame = None  # (calls, redundant) of the last frame.
+        self.state = {}
+        self.program = None
+        self.texture_unit = getattr(gl, 'GL_TEXTURE0', None)
+        self._originals = {}  # name -> gl function
+        self._patched = []  # (module, name) holding a wrapper
+        self._interface = None
+        # (wrapper, the interface's own _draw before it or None) of attach().
+        self._draw_patch = None
+
+
+    def install(self):
+        assert not self._patched
+        originals = self._originals
+        for name in dir(gl):
+            function = getattr(gl, name)
+            if name.startswith('gl') and callable(function):
+                originals[name] = function
+        wrappers = dict((name, self._wrap(name, function))
+                        for name, function in originals.items())
+        by_id = dict((id(function), name)
+                     for name, function in originals.items())
+        for module in list(sys.modules.values()):
+            if module is None:
+                continue
+            for name, value in list(vars(module).items()):
+                original_name = by_id.get(id(value))
+                if original_name is not None:
+                    setattr(module, name, wrappers[original_name])
+                    self._patched.append((module, name, original_name))
+
+
+    def uninstall(self):
+        for module, name, original_name in self._patched:
+            setattr(module, name, self._originals[original_name])
+        self._patched = []
+        interface = self._interface
+        if interface is not None:
+            wrapper, previous = self._draw_patch
+            # Put back exactly what attach() replaced, e.g. a FrameProfiler
+            # wrapper. If something wrapped _draw since, leave it in place;
+            # the wrapper no longer ends frames once detached.
+            if vars(interface).get('_draw') is wrapper:
+                if previous is None:
+                    del interface._draw
+                else:
+                    interface._draw = previous
+            self._interface = None
+            self._draw_patch = None
+
+
+    def attach(self, interface):
+        'install() and end a frame after every interface._draw().'
+        self.install()
+        original = interface._draw
+        tracer = self
+
+        def draw(*args, **kwargs):
+            try:
+                return original(*args, **kwargs)
+            finally:
+                if tracer._interface is interface:
+                    tracer.end_frame()
+        self._draw_patch = (draw, vars(interface).get('_draw'))
+        interface._draw = draw
+        self._interface = interface
+
+
+    def _wrap(self, name, function):
+        calls = self.calls
+        tracer = self
+        if name.startswith('glUniform'):
+            def traced(*args):
+                calls[name] += 1
+                # glUniformMatrix* has a transpose flag before the value.
+                tracer._set_state(name, (tracer.program, args[0]),
+                                  tuple(_freeze(a) for a in args[1:]))
+                return function(*args)
+        elif name in ('glEnable', 'glDisable'):
+            enabled = name == 'glEnable'
+
+            def traced(cap):
+                calls[name] += 1
+                tracer._set_state(name, ('enabled', cap), enabled)
+                return function(cap)
+        elif name in STATE_CALLS:
+            num_keys = STATE_CALLS[name]
+
+            def traced(*args):
+                calls[name] += 1
+                frozen = tuple(_freeze(a) for a in args)
+                key = (name,) + frozen[:num_keys]
+                if name == 'glBindTexture':
+                    key = (name, tracer.texture_unit) + frozen[:num_keys]
+                changed = tracer._set_state(name, key, frozen[num_keys:])
+                if name == 'glUseProgram':
+                    tracer.program = args[0]
+                elif name == 'glActiveTexture':
+                    tracer.texture_unit = args[0]
+                elif name == 'glBindVertexArray' and changed:
+                    tracer._forget_element_buffer()
+                return function(*args)
+        elif name in ('glLinkProgram', 'glDeleteProgram'):
+            def traced(program):
+                calls[name] += 1
+                tracer._forget_uniforms(program)
+                if name == 'glDeleteProgram':
+                    tracer._forget_bindings('glUseProgram', set([program]))
+                return function(program)
+        elif name in DELETE_CALLS:
+            bind_name = DELETE_CALLS[name]
+
+            def traced(*args):
+                calls[name] += 1
+                names = set()
+                for arg in args:
+                    frozen = _freeze(arg)
+                    names.update(frozen if isinstance(frozen, tuple)
+                                 else (frozen,))
+                tracer._forget_bindings(bind_name, names)
+                return function(*args)
+        else:
+            def traced(*args, **kwargs):
+                calls[name] += 1
+                return function(*args, **kwargs)
+        traced.__name__ = name
+        return traced
+
+
+    def _set_state(self, name, key, value):
+        '''Returns whether the state changed.'''
+        state = self.state
+        if key in state and state[key] == value:
+            self.redundant[name] += 1
+            return False
+        state[key] = value
+        return True
+
+
+    def _forget_element_buffer(self):
+        self.state.pop(('glBindBuffer',
+                        getattr(gl, 'GL_ELEMENT_ARRAY_BUFFER', None)), None)
+
+
+    def _forget_uniforms(self, program):
+        # Uniform keys are (program, location); the others start with a
+        # function name or 'enabled'.
+        for key in [key for key in self.state
+                    if len(key) == 2 and key[0] == program]:
+            del self.state[key]
+
+
+    def _forget_bindings(self, bind_name, names):
+        'Forget the bind_name bindings whose value is one of names.'
+        state = self.state
+        for key in [key for key, value in state.items()
+                    if key[0] == bind_name and value and value[0] in names]:
+            del state[key]
+
+
+    def end_frame(self):
+        '''Finish counting a frame and print its summary every report_every
+        frames. The GL state seen so far carries over to the next frame.'''
+        self.last_frame = (self.calls.copy(), self.redundant.copy())
+        self.frame_count += 1
+        if self.report_every and self.frame_count % self.report_every == 0:
+            logger.info(self.summary())
+        self.calls.clear()
+        self.redundant.clear()
+
+
+    def summary(self):
+        '''Text summary of the last finished frame.'''
+        calls, redundant = self.last_frame
+        lines = ['GL frame {}: {} calls, {} redundant'.format(
+                 self.frame_count - 1, sum(calls.values()),
+                 sum(redundant.values()))]
+        for name, count in calls.most_common(self.top):
+            line = '    {:<28} {:6}'.format(name, count)
+            if redundant[name]:
+                line += '  ({} redundant)'.format(redundant[name])
+            lines.append(line)
+        return '\n'.join(lines)
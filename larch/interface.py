@@ -7,22 +7,31 @@ CONVENTIONS:
 
 from __future__ import (print_function, division, absolute_import)
 
+from array import array
+
 import pyglet
-from gl import (glClear, glViewport, glCreateProgram, glPolygonMode,
-        glActiveTexture, GL_TEXTURE0,
+from gl import (glClear, glViewport, glCreateProgram, glPolygonMode, glFinish,
+        glActiveTexture, glBindTexture, GL_TEXTURE0, GL_TEXTURE_2D,
         GL_COLOR_BUFFER_BIT, GL_DEPTH_BUFFER_BIT, GL_VERTEX_SHADER,
         GL_FRAGMENT_SHADER, GL_FRONT_AND_BACK, GL_FILL)
 
+import logger
+
 try:
     import ovr
 except ImportError:
-    print('No support for ovr.')
+    logger.info('No support for ovr.')
 
-import logger
 import render
+from options import renderer_options
+from resolution import ResolutionScaler, GPUFrameTimer, scaled_viewport
+from scheduler import FixedStepScheduler
 
 
 OVR_FRAME_SCALE = 1.8
+OVR_REFRESH_RATE = 60  # Hz. Frame budget of dynamic resolution.
+SIM_STEP = 1 / 120  # Seconds of simulation per tick.
+MAX_FRAME_RATE = 120  # Frames are scheduled at most this often.
 
 
 def get_scaled_resolution():
@@ -34,6 +43,69 @@ def get_resolution():
     return 1280, 800
 
 
+def distortion_params(hmdinfo):
+    '''Returns (scale_in, scale, warp_param) of the lens distortion, as
+    used by the pp_frag shader and distortion_mesh.'''
+    w, h = get_resolution()
+    aspect = w / h
+    dist_scale = 1 / OVR_FRAME_SCALE
+    return ((4, 4 / aspect),
+            (1 / 4 * dist_scale, (1 / 4) * dist_scale * aspect),
+            tuple(hmdinfo.DistortionK))
+
+
+def lens_centers(hmdinfo):
+    '''Returns the lens centers of the left and right eye in texture
+    coordinates of the whole frame.'''
+    hsize = hmdinfo.HScreenSize
+    lsd = hmdinfo.LensSeparationDistance
+    lc_s = (hsize - lsd) / (2 * hsize)
+    return (lc_s, 0.5), (1 - lc_s, 0.5)
+
+
+# Vertex layout of distortion_mesh.
+DISTORTION_MESH_LAYOUT = [('in_pos', 3), ('in_texcoord', 2), ('in_inside', 1)]
+
+
+def distortion_mesh(hmdinfo, eye, resolution):
+    '''A grid of resolution x resolution cells over the eye's half of the
+    screen. Each vertex carries the texture coordinate that pp_frag would
+    sample for its pixel, and 1.0 if that is inside the eye's half of the
+    frame (0.0 if pp_frag would draw green), so drawing it is a single
+    texture fetch per pixel.
+    Returns (data, indices) for RenderHandle.from_interleaved with
+    DISTORTION_MESH_LAYOUT.
+    '''
+    scale_in, scale, warp_param = distortion_params(hmdinfo)
+    k0, k1, k2, k3 = warp_param
+    left, right = lens_centers(hmdinfo)
+    cx, cy = left if eye == 'left' else right
+    u0 = 0.0 if eye == 'left' else 0.5
+
+    data = array('f')
+    for j in xrange(resolution + 1):
+        v = j / resolution
+        for i in xrange(resolution + 1):
+            u = u0 + 0.5 * i / resolution
+            theta_x = (u - cx) * scale_in[0]
+            theta_y = (v - cy) * scale_in[1]
+            rsq = theta_x * theta_x + theta_y * theta_y
+            k = k0 + k1 * rsq + k2 * rsq * rsq + k3 * rsq * rsq * rsq
+            s = cx + scale[0] * theta_x * k
+            t = cy + scale[1] * theta_y * k
+            inside = abs(s - cx) <= 0.25 and abs(t - cy) <= 0.5
+            data.extend((2 * u - 1, 2 * v - 1, 0.0,
+                         s, t, 1.0 if inside else 0.0))
+
+    row = resolution + 1
+    indices = []
+    for j in xrange(resolution):
+        for i in xrange(resolution):
+            a = j * row + i
+            indices.extend((a, a + 1, a + row, a + 1, a + row + 1, a + row))
+    return data, indices
+
+
 class Interface(object):
     """Abstrace Interface class.
     Subclass must define in begin():
@@ -50,14 +122,16 @@ class Interface(object):
         self.universe = None
         self._window = None
         self.hmdinfo = None  # Says that this interface does not support OVR
+        self.sim_step = SIM_STEP
+        self.scheduler = None
 
 
     def __enter__(self):
         w, h = get_resolution()
 
         self._window = pyglet.window.Window(w, h, config=self._gl_config)
-        print('Created pyglet window. GL context version {}'.format(
-            self._window.context.get_info().get_version()))
+        logger.info('Created pyglet window. GL context version {}',
+                    self._window.context.get_info().get_version())
         self._setup_events()
         self.begin()
         return self
@@ -66,6 +140,7 @@ class Interface(object):
     def _setup_events(self):
         @self._window.event
         def on_draw():
+            render.STATS.reset()
             glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
             self._draw()
 
@@ -76,7 +151,16 @@ class Interface(object):
 
     def begin(self):
         'Do setup after loading the window and setting up a GL context.'
-        pyglet.clock.schedule_interval(self.tick, 0.001)
+        # pyglet sleeps until the next frame is due, tick() runs at a fixed
+        # rate in between.
+        self.scheduler = FixedStepScheduler(self.tick, self.sim_step)
+        pyglet.clock.schedule_interval(self._advance, 1 / MAX_FRAME_RATE)
+
+
+    def _advance(self, dt):
+        alpha = self.scheduler.advance(dt)
+        if self.universe is not None:
+            self.universe.set_interpolation(alpha)
 
 
     def tick(self, dt):
@@ -91,17 +175,75 @@ class Interface(object):
         pass
 
 
+class HeadlessInterface(Interface):
+    '''Renders into a RenderTexture of a hidden window, for benchmarks.
+    There is no event loop; call frame() to tick and draw once.
+    Set pyglet.options['headless'] before the first window is created to
+    get an EGL context without a display (pyglet 1.4 and up).
+    '''
+    def __init__(self):
+        super(HeadlessInterface, self).__init__()
+        self.rendertexture = None
+
+
+    def __enter__(self):
+        w, h = get_resolution()
+        self._window = pyglet.window.Window(
+                w, h, config=self._gl_config, visible=False)
+        logger.info('Created hidden pyglet window. GL context version {}',
+                    self._window.context.get_info().get_version())
+        self.rendertexture = render.RenderTexture(w, h)
+        self.begin()
+        return self
+
+
+    def frame(self, clock):
+        '''Tick once by sim_step and draw. clock() is read between the
+        phases. Returns (tick, collect, submit) in seconds: the tick, the
+        render prelude with gathering render handles, and issuing the draws.
+        Waits for the GPU afterwards, outside of the measured time.
+        '''
+        render.STATS.reset()
+        w, h = get_resolution()
+        t0 = clock()
+        self.tick(self.sim_step)
+        t1 = clock()
+        with self.rendertexture:
+            glViewport(0, 0, w, h)
+            glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+            self.universe.render_prelude('center')
+            handles = self.universe.get_render_handles()
+            t2 = clock()
+            render.draw_handles(handles)
+            t3 = clock()
+        glFinish()
+        return t1 - t0, t2 - t1, t3 - t2
+
+
+    def __exit__(self, t, value, traceback):
+        self._window.close()
+
+
 class OVRInterface(Interface):
     def __init__(self):
         super(OVRInterface, self).__init__()
         self._devs = None
         self.devices = []
         self.dm = None
-        self.rendertexture = None
+        self.render_targets = None  # render.RenderTexturePool
+        self.rendertexture = None  # The one of the current frame.
+        # Part of rendertexture drawn into, see resolution.scaled_viewport.
+        self.frame_scale = (1.0, 1.0)
+        # Set with renderer_options.dynamic_resolution.
+        self.resolution_scaler = None
+        self.gpu_timer = None
         self.screen_quads_rh = None
         self.pp_program = None
         self.hmdinfo = None
         self.device = None
+        # Warp with a precomputed mesh instead of per pixel, see
+        # renderer_options.distortion_mesh_resolution.
+        self.use_distortion_mesh = False
 
 
     def __enter__(self):
@@ -118,7 +260,7 @@ class OVRInterface(Interface):
             if not self._devs.Next():
                 break
 
-        print(self.devices)
+        logger.debug('OVR devices: {}', tuple(self.devices))
         self.device = self.devices[0]
         self.hmdinfo = ovr.HMDInfo()
         assert self.device.GetDeviceInfo(self.hmdinfo)
@@ -145,11 +287,26 @@ class OVRInterface(Interface):
 
         self._setup_events()
         w, h = get_scaled_resolution()
-        self.rendertexture = render.RenderTexture(w, h)
-        logger.log('Renderbuffer size: {}x{}'.format(w, h))
-
-        self.pp_program = self._build_postprocess_program()
-        self.screen_quads_rh = self._cook_screen_quads(self.pp_program)
+        if renderer_options.dynamic_resolution:
+            self.render_targets = render.RenderTexturePool(w, h)
+            self.resolution_scaler = ResolutionScaler(
+                    1 / OVR_REFRESH_RATE,
+                    renderer_options.min_resolution_scale)
+            self.gpu_timer = GPUFrameTimer()
+        else:
+            self.render_targets = render.RenderTexturePool(w, h, count=1)
+        self.rendertexture = self.render_targets.acquire()
+        logger.info('Renderbuffer size: {}x{}', w, h)
+
+        resolution = renderer_options.distortion_mesh_resolution
+        self.use_distortion_mesh = resolution > 0
+        if self.use_distortion_mesh:
+            self.pp_program = self._build_mesh_postprocess_program()
+            self.screen_quads_rh = self._cook_distortion_meshes(
+                    self.pp_program, resolution)
+        else:
+            self.pp_program = self._build_postprocess_program()
+            self.screen_quads_rh = self._cook_screen_quads(self.pp_program)
 
         self.begin()
 
@@ -157,39 +314,58 @@ class OVRInterface(Interface):
 
 
     def _draw(self):
-        w, h = get_scaled_resolution()
+        if self.gpu_timer is not None:
+            self.gpu_timer.begin()
+        self.rendertexture = self.render_targets.acquire()
+        width, height = get_scaled_resolution()
+        scale = 1.0
+        if self.resolution_scaler is not None:
+            scale = self.resolution_scaler.scale
+        (w, h), self.frame_scale = scaled_viewport(width, height, scale)
         with self.rendertexture:
             glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-            half = int(w / 2)
-            glViewport(0, 0, half, h)
-            render.render_universe(self.universe, 'left')
-            glViewport(half, 0, half, h)
-            render.render_universe(self.universe, 'right')
-
-        # Render screen quad.
+            if self.universe.stereo:
+                glViewport(0, 0, w, h)
+                render.render_universe_stereo(self.universe)
+            else:
+                half = int(w / 2)
+                glViewport(0, 0, half, h)
+                render.render_universe(self.universe, 'left')
+                glViewport(half, 0, half, h)
+                render.render_universe(self.universe, 'right')
+
+        self._postprocess()
+        if self.gpu_timer is not None:
+            seconds = self.gpu_timer.end()
+            if seconds is not None:
+                self.resolution_scaler.update(seconds)
+
+
+    def _postprocess(self):
+        'Draw the render texture to the screen, warped for the lenses.'
         w, h = get_resolution()
         glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
         glActiveTexture(GL_TEXTURE0)
+        glBindTexture(GL_TEXTURE_2D, self.rendertexture.color_tex)
         glViewport(0, 0, w, h)
         rh = self.screen_quads_rh
+        self.pp_program.set_uniform('frame_scale', self.frame_scale)
 
-        hsize = self.hmdinfo.HScreenSize
-        lsd = self.hmdinfo.LensSeparationDistance
-        lc_s = (hsize - lsd) / (2 * hsize)
+        if self.use_distortion_mesh:
+            render.draw_handles(rh)
+            return
 
-        lens_center = (lc_s, 0.5)
+        left, right = lens_centers(self.hmdinfo)
 
-        self.pp_program.set_uniform('lens_center', lens_center)
+        self.pp_program.set_uniform('lens_center', left)
         render.draw_handles([rh[0]])
 
-        lens_center = (1 - lens_center[0], lens_center[1])
-
-        self.pp_program.set_uniform('lens_center', lens_center)
+        self.pp_program.set_uniform('lens_center', right)
         render.draw_handles([rh[1]])
 
 
     def __exit__(self, t, value, traceback):
-        logger.log("OVRInterface exited succesfully.")
+        logger.debug("OVRInterface exited succesfully.")
         del self.device
         del self.devices
         del self._devs
@@ -218,6 +394,8 @@ class OVRInterface(Interface):
         out vec4 out_color;
 
         uniform sampler2D frame;
+        // Part of frame that was drawn into.
+        uniform vec2 frame_scale;
         uniform vec2 lens_center;
         uniform vec2 scale;
         uniform vec2 scale_in;
@@ -235,7 +413,7 @@ class OVRInterface(Interface):
             vec2 texcoord = lens_center + scale * rvec;
 
 
-            vec4 color = texture(frame, texcoord);
+            vec4 color = texture(frame, texcoord * frame_scale);
             if (!all(equal(clamp(texcoord, lens_center - vec2(0.25, 0.5),
                                            lens_center + vec2(0.25, 0.5)),
                            texcoord)))
@@ -249,27 +427,68 @@ class OVRInterface(Interface):
         }
         '''
         p = render.Program(glCreateProgram(), 'pp_program')
-        p.attach_shader(render.create_shader(
-            vertex_src, GL_VERTEX_SHADER, 'pp_vertex'))
-        p.attach_shader(render.create_shader(
-            frag_src, GL_FRAGMENT_SHADER, 'pp_frag'))
-        p.link()
-
-        w, h = get_scaled_resolution()
-        w, h = get_resolution()
-        aspect = w / h
+        p.build([(vertex_src, GL_VERTEX_SHADER, 'pp_vertex'),
+                 (frag_src, GL_FRAGMENT_SHADER, 'pp_frag')])
 
-        dist_scale = 1 / OVR_FRAME_SCALE
-        hmd_warp = self.hmdinfo.DistortionK
+        scale_in, scale, warp_param = distortion_params(self.hmdinfo)
         # Set up uniforms.
-        p.set_uniform('scale_in', (4, 4 / aspect))
-        p.set_uniform('scale', (1 / 4 * dist_scale,
-                               (1 / 4) * dist_scale * aspect))
-        p.set_uniform('warp_param', hmd_warp)
+        p.set_uniform('scale_in', scale_in)
+        p.set_uniform('scale', scale)
+        p.set_uniform('warp_param', warp_param)
 
         return p
 
 
+    def _build_mesh_postprocess_program(self):
+        '''Draws the meshes from _cook_distortion_meshes. The warp is baked
+        into their texture coordinates.'''
+        vertex_src = '''
+        #version 330
+        in vec3 in_pos;
+        in vec2 in_texcoord;
+        in float in_inside;
+
+        out vec2 vs_texcoord;
+        out float vs_inside;
+        void main(void)
+        {
+            vs_texcoord = in_texcoord;
+            vs_inside = in_inside;
+            gl_Position = vec4(in_pos, 1.0);
+        }
+        '''
+        frag_src = '''
+        #version 330
+        in vec2 vs_texcoord;
+        in float vs_inside;
+        out vec4 out_color;
+
+        uniform sampler2D frame;
+        // Part of frame that was drawn into.
+        uniform vec2 frame_scale;
+
+        void main(void)
+        {
+            out_color = mix(vec4(0,1,0,1),
+                            texture(frame, vs_texcoord * frame_scale),
+                            step(0.5, vs_inside));
+        }
+        '''
+        p = render.Program(glCreateProgram(), 'pp_mesh_program')
+        p.build([(vertex_src, GL_VERTEX_SHADER, 'pp_mesh_vertex'),
+                 (frag_src, GL_FRAGMENT_SHADER, 'pp_mesh_frag')])
+        return p
+
+
+    def _cook_distortion_meshes(self, program, resolution):
+        handles = []
+        for eye in ('left', 'right'):
+            data, indices = distortion_mesh(self.hmdinfo, eye, resolution)
+            handles.append(render.RenderHandle.from_interleaved(
+                program, data, DISTORTION_MESH_LAYOUT, indices))
+        return handles
+
+
     def _cook_screen_quads(self, program):
         verts_left = [
                 0.0 , -1.0  , 0.0,
@@ -1,18 +1,223 @@
+'''Leveled logging that stays off the render thread.
+Messages are format strings with their arguments; they are only formatted,
+by a background writer thread, if their level is enabled. The writer takes
+them from a bounded queue, so a slow terminal drops messages instead of
+stalling a frame. A message repeated more than burst times within interval
+seconds is counted instead of written, and the count reported later.
+
+Arguments are formatted after the call returns, so pass values that won't
+change, not objects that the caller keeps mutating.
+'''
 from __future__ import (print_function, division, absolute_import)
 
 
-from options import debug
+import atexit
+import sys
+import threading
+import time
+
+from collections import deque
+
+import options
+
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: 'debug', INFO: 'info', WARNING: 'warning',
+               ERROR: 'error'}
+
+# Records the writer formats per write().
+BATCH = 256
+# Seconds the writer sleeps between checks for records it wasn't woken for.
+WAKE_TIMEOUT = 0.1
+# Rate limiter entries kept before they are all reported and forgotten.
+MAX_RECENT = 256
+
+
+class Logger(object):
+    '''Writes to stream (sys.stdout by default, looked up when writing).
+    capacity is the size of the queue; messages that don't fit are counted
+    and the count is written once there is room again.
+    '''
+    def __init__(self, level=INFO, stream=None, capacity=1024, burst=5,
+                 interval=1.0, clock=time.time):
+        self.level = level
+        self.stream = stream
+        self.burst = burst
+        self.interval = interval
+        self.clock = clock
+        self.capacity = capacity
+        self.records = deque()  # (level, msg, args)
+        self.queued = 0  # Records appended so far.
+        self.written = 0  # Records the writer has written so far.
+        self.dropped = 0
+        self.recent = {}  # (level, msg) -> [window start, count, suppressed]
+        self._thread = None
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+
+
+    def enabled(self, level):
+        '''Test this before building an expensive argument.'''
+        return level >= self.level
+
+
+    def log(self, level, msg, *args):
+        if level < self.level or not self._allow(level, msg):
+            return
+        self._put((level, msg, args))
+
+
+    def _allow(self, level, msg):
+        key = (level, msg)
+        now = self.clock()
+        state = self.recent.get(key)
+        if state is None or now - state[0] >= self.interval:
+            if state is None and len(self.recent) >= MAX_RECENT:
+                self._report_suppressed()
+            elif state is not None and state[2]:
+                self._put_suppressed(key, state[2])
+            self.recent[key] = [now, 1, 0]
+            return True
+        if state[1] < self.burst:
+            state[1] += 1
+            return True
+        state[2] += 1
+        return False
+
+
+    def _put_suppressed(self, key, count):
+        level, msg = key
+        self._put((level, 'Suppressed {} repeats of: {}', (count, msg)))
+
+
+    def _report_suppressed(self):
+        for key, state in list(self.recent.items()):
+            if state[2]:
+                self._put_suppressed(key, state[2])
+        self.recent.clear()
+
+
+    def _put(self, record):
+        if len(self.records) >= self.capacity:
+            self.dropped += 1
+            return
+        if self.dropped:
+            self._put_dropped()
+        self._append(record)
+
+
+    def _put_dropped(self):
+        self._append((WARNING, 'Dropped {} log messages.', (self.dropped,)))
+        self.dropped = 0
+
+
+    def _append(self, record):
+        records = self.records
+        records.append(record)
+        self.queued += 1
+        # The writer sleeps once it has emptied the queue. Waking it costs a
+        # lock, so only do that for the first record.
+        if len(records) == 1:
+            if self._thread is None:
+                self._start()
+            self._wake.set()
+
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                thread = threading.Thread(target=self._write_loop,
+                                          name='logger')
+                thread.daemon = True
+                thread.start()
+                self._thread = thread
+
+
+    def _write_loop(self):
+        records = self.records
+        while True:
+            self._wake.wait(WAKE_TIMEOUT)
+            self._wake.clear()
+            while records:
+                lines = []
+                while records and len(lines) < BATCH:
+                    lines.append(self._format(*records.popleft()))
+                stream = self.stream or sys.stdout
+                try:
+                    stream.write(''.join(lines))
+                    stream.flush()
+                except Exception as e:  # Keep the writer alive.
+                    sys.stderr.write('Logging failed: {}\n'.format(e))
+                self.written += len(lines)
+
+
+    def _format(self, level, msg, args):
+        try:
+            text = msg.format(*args) if args else msg
+        except Exception as e:
+            text = 'Formatting {!r} failed: {}'.format(msg, e)
+        return '[{}] {}\n'.format(LEVEL_NAMES[level], text)
+
+
+    def flush(self):
+        '''Write out the suppressed counts and wait until everything queued
+        so far has been written.'''
+        self._report_suppressed()
+        self._wait_written()
+        if self.dropped:
+            self._put_dropped()
+            self._wait_written()
+
+
+    def _wait_written(self):
+        while self.written < self.queued:
+            self._wake.set()
+            time.sleep(0.001)
+
+
+_logger = Logger(DEBUG if options.debug else INFO)
+atexit.register(_logger.flush)
+
+
+def get_logger():
+    return _logger
+
+
+def set_level(level):
+    _logger.level = level
+
+
+def enabled(level):
+    return level >= _logger.level
+
+
+def debug(msg, *args):
+    if DEBUG >= _logger.level:
+        _logger.log(DEBUG, msg, *args)
+
+
+def info(msg, *args):
+    if INFO >= _logger.level:
+        _logger.log(INFO, msg, *args)
+
+
+def warning(msg, *args):
+    _logger.log(WARNING, msg, *args)
 
 
-def log(*stuff):
-    if debug:
-        apply(print, stuff)
+def nonfatal_error(msg, *args):
+    _logger.log(ERROR, msg, *args)
 
 
-def nonfatal_error(*stuff):
-    apply(print, stuff)
+def error(msg, *args):
+    '''Log msg, wait until it is written and exit.'''
+    _logger.log(ERROR, msg, *args)
+    _logger.flush()
+    sys.exit(-1)
 
 
-def error(*stuff):
-    apply(print, stuff)
-    exit(-1)
+def flush():
+    _logger.flush()
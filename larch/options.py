@@ -7,8 +7,25 @@ __all__ = ['renderer_options', 'debug']
 class RendererOptions(object):
     def __init__(self):
         self.validate_programs = False
+        # Share per-frame uniforms (persp, eye_ipd) through a uniform buffer.
+        self.use_uniform_buffers = False
+        # Draw both eyes of an HMD in one pass, see
+        # render.render_universe_stereo. Universes that can't fall back to
+        # one pass per eye.
+        self.single_pass_stereo = False
+        # Cells per side of the per-eye grid that OVRInterface warps the
+        # frame with. 0 evaluates the lens distortion per pixel instead.
+        self.distortion_mesh_resolution = 0
+        # Directory for linked program binaries, see render.ProgramCache.
+        # None compiles every program from source.
+        self.program_cache_dir = None
+        # Lower the resolution of the OVR render target while the GPU misses
+        # the refresh deadline, down to min_resolution_scale of each side.
+        # See resolution.ResolutionScaler.
+        self.dynamic_resolution = False
+        self.min_resolution_scale = 0.5
 renderer_options = RendererOptions()
 
 
-debug = True
-# debug = False
+# Write debug level messages, see logger. --debug turns this on too.
+debug = False
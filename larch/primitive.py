@@ -1,16 +1,39 @@
 from __future__ import (print_function, division, absolute_import)
 
 
+from array import array
+from collections import OrderedDict
+from functools import partial
+from math import sqrt
+
 from gl import *
 from glm import mat4x4
 
 from interface import get_resolution
-from render import Program, create_shader, RenderHandle
+import render
+from options import renderer_options
+from render import (Program, RenderHandle, DrawItem,
+                    InstancedRenderHandle, MESH_CACHE, weld_vertices,
+                    FRAME_BLOCK_SRC, STEREO_SRC, get_frame_block)
+from spatial import Frustum, FrustumUnion, LooseOctree
+from transforms import (TransformStore, lerp_transform, model_matrix,
+                        model_matrices, numpy)
+from worker import SimulationWorker, PrimitiveSimulation
 from universe import Agent, Universe
 
 
 PROGRAM = None  # Lazily created when the first agent needs it.
+INSTANCED_PROGRAM = None  # Lazily created by an instanced PrimitiveUniverse.
 ASPECT_RATIO = 1.0
+# Where between the previous and the current simulation state to draw,
+# set by an interpolating PrimitiveUniverse. See render_transform.
+RENDER_ALPHA = 1.0
+
+# Per-instance attributes of InstancedPrimitiveProgram, in buffer order.
+INSTANCE_ATTRIBS = [('in_axis', 3), ('in_angle', 1), ('in_translation', 3)]
+# The same with model_matrix: the columns of the model matrix.
+MODEL_INSTANCE_ATTRIBS = [('in_model0', 4), ('in_model1', 4),
+                          ('in_model2', 4), ('in_model3', 4)]
 
 
 def init_gl(with_ovr):
@@ -23,140 +46,639 @@ def init_gl(with_ovr):
     glPolygonMode(GL_FRONT_AND_BACK, GL_LINE)
 
 
+def default_persp():
+    '''Perspective used when there is no HMD.'''
+    return mat4x4.perspective(75.0, ASPECT_RATIO, 0.001, 100)
+
+
+def rows_to_models(data):
+    '''Model matrices of an array('f') of INSTANCE_ATTRIBS rows: a float32
+    (n, 16) array with numpy, else an array('f') of n * 16 floats.'''
+    stride = TransformStore.STRIDE
+    if numpy is not None:
+        return model_matrices(
+                numpy.frombuffer(data, numpy.float32).reshape(-1, stride))
+    models = array('f')
+    for i in xrange(0, len(data), stride):
+        models.extend(model_matrix((tuple(data[i:i + 3]), data[i + 3]),
+                                   tuple(data[i + 4:i + 7])))
+    return models
+
+
 class Primitive(Agent):
+    # Primitives with the same mesh_name share a mesh and can be drawn
+    # together by an instanced PrimitiveUniverse.
+    mesh_name = None
+    # Radius of a sphere around the origin holding the whole mesh.
+    # None means the primitive is never culled.
+    bounding_radius = None
+
     def __init__(self):
         super(Primitive, self).__init__()
+        # Set by attach_store. Until then the transform lives in this object.
+        self.store = None
+        self.store_slot = None
+        # Set of primitives to re-file in the octree of a culling
+        # PrimitiveUniverse; the translation setter adds this one to it.
+        self.octree_moved = None
         self.rotation = ((0, 1, 0), 0.0)
         self.translation = (0, 0, 0)
+        self.angular_velocity = 0.0  # Radians per second around the axis.
+        # (rotation, translation) before the last tick, see save_transform.
+        self.previous_transform = None
         self.render_handle = None
+        # model_matrix of render_transform() and the PrimitiveUniverse.frame
+        # it is for. Set by a PrimitiveUniverse with model_matrix.
+        self.model = None
+        self.model_frame = None
 
         global PROGRAM
         if not PROGRAM:
             PROGRAM = PrimitiveProgram()
 
 
-    def get_render_handles(self):
-        PROGRAM.set_uniform('transform.axis', self.rotation[0])
-        PROGRAM.set_uniform('transform.angle', (self.rotation[1],))
-        PROGRAM.set_uniform('transform.translation', self.translation)
-        return [self.render_handle]
+    @property
+    def rotation(self):
+        '''(axis, angle)'''
+        if self.store is None:
+            return self._rotation
+        return self.store.get_rotation(self.store_slot)
 
 
-class Cube(Primitive):
-    def __init__(self):
-        super(Cube, self).__init__()
-        self.rotation = ((0, 1, 0), 0.0)
-        self.translation = (0, 0, 0)
-        self._build_rhandle()
+    @rotation.setter
+    def rotation(self, rotation):
+        if self.store is None:
+            self._rotation = rotation
+        else:
+            self.store.set_rotation(self.store_slot, rotation)
 
 
-    def _build_rhandle(self):
-        u = 1.0
+    @property
+    def translation(self):
+        if self.store is None:
+            return self._translation
+        return self.store.get_translation(self.store_slot)
+
 
-        # Repeating vertices because too lazy to render indexed arrays.
-        vertices = [
-                -u , -u  ,u,   # 1
-                -u , u ,u,     # 2
-                u  , -u  ,u,   # 3
+    @translation.setter
+    def translation(self, translation):
+        if self.store is None:
+            self._translation = translation
+        else:
+            self.store.set_translation(self.store_slot, translation)
+        if self.octree_moved is not None:
+            self.octree_moved.add(self)
 
-                u  , -u  ,u,   # 3
-                -u , u , u,     # 2
-                u  , u  ,u,    # 4
 
-                u  , -u  , u,   # 3
-                u  , u  , u,    # 4
-                u  , -u  , -u,  # 6
+    @property
+    def angular_velocity(self):
+        if self.store is None:
+            return self._angular_velocity
+        return float(self.store.angular_velocity[self.store_slot])
 
-                u  , -u  , -u,  # 6
-                u  , u  , u,    # 4
-                u  , u  , -u,   # 5
 
-                u  , u  , -u,   # 5
-                -u  , u, -u,   # 8
-                u  , -u  ,-u,  # 6
+    @angular_velocity.setter
+    def angular_velocity(self, angular_velocity):
+        if self.store is None:
+            self._angular_velocity = angular_velocity
+        else:
+            self.store.angular_velocity[self.store_slot] = angular_velocity
 
-                u  , -u  ,-u,  # 6
-                -u  , u, -u,   # 8
-                -u  , -u  ,-u, # 7
 
-                -u  , -u  ,-u, # 7
-                -u  , u, -u,   # 8
-                -u , u ,u,     # 2
+    def attach_store(self, store):
+        '''Move the transform into a transforms.TransformStore. From then on
+        this primitive is a view of its row.'''
+        assert self.store is None
+        store.add(self, self.rotation, self.translation,
+                  self.angular_velocity)
+        self.store = store
 
-                -u , u ,u,     # 2
-                -u , -u  ,u,   # 1
-                -u  , -u  ,-u, # 7
 
-                -u  , -u  ,-u, # 7
-                u  , -u  ,u,   # 3
-                u  , -u  ,-u,  # 6
+    def tick(self, dt):
+        # Primitives in a store are advanced by TransformStore.tick.
+        if self.store is None and self._angular_velocity:
+            axis, angle = self._rotation
+            self._rotation = (axis, angle + self._angular_velocity * dt)
 
-                u  , -u  ,u,   # 3
-                -u  , -u  ,-u, # 7
-                -u , -u  ,u,   # 1
 
-                -u  , u, -u,   # 8
-                u  , u  ,u,    # 4
-                -u , u ,u,     # 2
+    def save_transform(self):
+        self.previous_transform = (self.rotation, self.translation)
 
-                -u  , u, -u,   # 8
-                u  , u  ,-u,   # 5
-                u  , u  ,u,    # 4
-                ]
 
-        colors = [item for sublist in
-                  [[0.5 , 0.1 , 0.5] for _ in xrange(36)]
-                for item in sublist]
+    def render_transform(self):
+        '''(rotation, translation) to draw with: RENDER_ALPHA of the way from
+        the previous to the current simulation state.'''
+        if RENDER_ALPHA >= 1.0:
+            return self.rotation, self.translation
+        if self.store is not None:
+            return self.store.get_interpolated(self.store_slot, RENDER_ALPHA)
+        if self.previous_transform is None:
+            return self.rotation, self.translation
+        return lerp_transform(self.previous_transform,
+                              (self.rotation, self.translation), RENDER_ALPHA)
 
-        self.render_handle = RenderHandle.from_triangles(
-                PROGRAM, vertices, colors)
+
+    def get_render_handles(self):
+        # The handle is shared with every primitive of the same mesh, so the
+        # transform travels with the draw item instead of being set now.
+        if PROGRAM.model_matrix:
+            model = self.model
+            if model is None:
+                model = model_matrix(*self.render_transform())
+            return [DrawItem(self.render_handle, (('model', model),),
+                             depth=-model[14])]
+        rotation, translation = self.render_transform()
+        uniforms = (('transform.axis', rotation[0]),
+                    ('transform.angle', (rotation[1],)),
+                    ('transform.translation', translation))
+        return [DrawItem(self.render_handle, uniforms,
+                         depth=-translation[2])]
+
+
+    def get_bounds(self):
+        if self.bounding_radius is None:
+            return None
+        return self.translation, self.bounding_radius
+
+
+    def release(self):
+        '''Give back the shared render handle. Call when the primitive is
+        no longer drawn.'''
+        if self.render_handle is not None:
+            MESH_CACHE.release(self.render_handle)
+            self.render_handle = None
+        if self.store is not None:
+            rotation = self.rotation
+            translation = self.translation
+            angular_velocity = self.angular_velocity
+            self.store.remove(self.store_slot)
+            self.store = None
+            self.store_slot = None
+            self.rotation = rotation
+            self.translation = translation
+            self.angular_velocity = angular_velocity
+
+
+    def get_mesh(self):
+        '''Returns (vertices, colors) of the mesh shared by every primitive
+        with this mesh_name: flat lists of floats, three per vertex and three
+        vertices per triangle, see weld_vertices. Primitives drawn by an
+        instanced PrimitiveUniverse must set mesh_name and override this,
+        like Cube does.'''
+        raise NotImplementedError(
+                '{} has no get_mesh() to draw it instanced.'.format(
+                    type(self).__name__))
+
+
+    def write_instance(self, data):
+        '''Append this primitive's INSTANCE_ATTRIBS to the float array data.'''
+        rotation, translation = self.render_transform()
+        data.extend(rotation[0])
+        data.append(rotation[1])
+        data.extend(translation)
+
+
+def cube_mesh():
+    '''Returns (vertices, colors) for a 2x2x2 cube centered at the origin.'''
+    u = 1.0
+
+    # Flat triangle list. weld_vertices turns it into 8 indexed vertices.
+    vertices = [
+            -u , -u  ,u,   # 1
+            -u , u ,u,     # 2
+            u  , -u  ,u,   # 3
+
+            u  , -u  ,u,   # 3
+            -u , u , u,     # 2
+            u  , u  ,u,    # 4
+
+            u  , -u  , u,   # 3
+            u  , u  , u,    # 4
+            u  , -u  , -u,  # 6
+
+            u  , -u  , -u,  # 6
+            u  , u  , u,    # 4
+            u  , u  , -u,   # 5
+
+            u  , u  , -u,   # 5
+            -u  , u, -u,   # 8
+            u  , -u  ,-u,  # 6
+
+            u  , -u  ,-u,  # 6
+            -u  , u, -u,   # 8
+            -u  , -u  ,-u, # 7
+
+            -u  , -u  ,-u, # 7
+            -u  , u, -u,   # 8
+            -u , u ,u,     # 2
+
+            -u , u ,u,     # 2
+            -u , -u  ,u,   # 1
+            -u  , -u  ,-u, # 7
+
+            -u  , -u  ,-u, # 7
+            u  , -u  ,u,   # 3
+            u  , -u  ,-u,  # 6
+
+            u  , -u  ,u,   # 3
+            -u  , -u  ,-u, # 7
+            -u , -u  ,u,   # 1
+
+            -u  , u, -u,   # 8
+            u  , u  ,u,    # 4
+            -u , u ,u,     # 2
+
+            -u  , u, -u,   # 8
+            u  , u  ,-u,   # 5
+            u  , u  ,u,    # 4
+            ]
+
+    colors = [item for sublist in
+              [[0.5 , 0.1 , 0.5] for _ in xrange(36)]
+            for item in sublist]
+
+    return vertices, colors
+
+
+class Cube(Primitive):
+    mesh_name = 'cube'
+    bounding_radius = sqrt(3)
+
+    def __init__(self):
+        super(Cube, self).__init__()
+        self.rotation = ((0, 1, 0), 0.0)
+        self.translation = (0, 0, 0)
+        self._build_rhandle()
+
+
+    def get_mesh(self):
+        return cube_mesh()
+
+
+    def _build_rhandle(self):
+        def build():
+            vertices, colors, indices = weld_vertices(*cube_mesh())
+            return RenderHandle.from_indexed_triangles(
+                    PROGRAM, vertices, colors, indices)
+        self.render_handle = MESH_CACHE.acquire(PROGRAM, self.mesh_name, build)
 
 
 class PrimitiveUniverse(Universe):
-    def __init__(self, hmdinfo):
+    def __init__(self, hmdinfo, instanced=False, cull=False,
+                 transform_store=False, interpolate=False, model_matrix=False):
         '''devinfo is an instance of HMDInfo or None. OVR setup
         is decided based on that.
+        If instanced is True, primitives that share a mesh_name are drawn with
+        a single instanced call instead of one draw call each.
+        If cull is True, primitives are kept in a LooseOctree and only those
+        inside the view frustum of the current eye are drawn.
+        If transform_store is True (needs numpy), the transforms of attached
+        primitives move into one TransformStore per mesh. Their rotation is
+        advanced by angular_velocity in one vectorized step, tick() is only
+        called on primitives that override it, and in instanced mode the
+        store is uploaded as the instance buffer as is.
+        If interpolate is True, each tick remembers the previous transforms
+        and drawing blends between the two by the alpha passed to
+        set_interpolation.
+        If model_matrix is True, the model matrix of every primitive is
+        computed once per frame on the CPU, in one batch, and the programs
+        take it as a single mat4 instead of building it per vertex.
+        With an HMD and renderer_options.single_pass_stereo, the programs
+        are built for render.render_universe_stereo. With either of these,
+        the universe must be created before its primitives.
         '''
         super(PrimitiveUniverse, self).__init__()
-        global PROGRAM
+        global PROGRAM, INSTANCED_PROGRAM
         use_ovr = not hmdinfo is None
+        self.stereo = use_ovr and renderer_options.single_pass_stereo
 
         init_gl(use_ovr)
         if PROGRAM is None:
-            PROGRAM = PrimitiveProgram()
+            PROGRAM = PrimitiveProgram(stereo=self.stereo,
+                                       model_matrix=model_matrix)
+        assert PROGRAM.stereo == self.stereo
+        assert PROGRAM.model_matrix == model_matrix
         self.program = PROGRAM
         self.primitives = []
+        self.instanced = instanced
+        self._instanced_handles = {}  # mesh_name -> InstancedRenderHandle
+        self.octree = LooseOctree() if cull else None
+        self.octree_moved = set()  # Primitives moved since _update_octree.
+        self.unculled = []  # Primitives without bounds, always drawn.
+        self.frustum = None
+        self.view_proj = default_persp()
+        self.transform_store = transform_store
+        self.stores = OrderedDict()  # mesh_name -> TransformStore
+        self.scripted = []  # Primitives whose tick() must still be called.
+        self.store_rows = {}  # mesh_name -> primitive index of each store slot
+        self.interpolate = interpolate
+        self.worker = None  # See start_worker.
+        self._snapshot = None
+        self.model_matrix = model_matrix
+        # Counts the frames drawn, the right eye is part of the left eye's.
+        self.frame = 0
+        self._store_models = {}  # mesh_name -> (frame, model_data)
+
+        if instanced:
+            if INSTANCED_PROGRAM is None:
+                INSTANCED_PROGRAM = PrimitiveProgram(
+                        instanced=True, stereo=self.stereo,
+                        model_matrix=model_matrix)
+            assert INSTANCED_PROGRAM.stereo == self.stereo
+            assert INSTANCED_PROGRAM.model_matrix == model_matrix
+            self.program = INSTANCED_PROGRAM
 
         if use_ovr:
             self.hmdinfo = hmdinfo
     
     
     def attach_primitive(self, p):
+        if self.instanced and (p.mesh_name is None or
+                               type(p).get_mesh == Primitive.get_mesh):
+            raise TypeError('An instanced PrimitiveUniverse needs a mesh_name '
+                            'and a get_mesh(), {} lacks one.'.format(
+                                type(p).__name__))
         self.primitives.append(p)
+        if self.transform_store:
+            store = self.stores.get(p.mesh_name)
+            if store is None:
+                store = TransformStore()
+                self.stores[p.mesh_name] = store
+            p.attach_store(store)
+            self.store_rows.setdefault(p.mesh_name, []).append(
+                    len(self.primitives) - 1)
+            if type(p).tick != Primitive.tick:
+                self.scripted.append(p)
+        if self.octree is not None:
+            bounds = p.get_bounds()
+            if bounds is None:
+                self.unculled.append(p)
+            else:
+                self.octree.insert(p, *bounds)
+                p.octree_moved = self.octree_moved
+
+
+    def visible_primitives(self):
+        '''Primitives to draw for the current eye.'''
+        if self.octree is None:
+            return self.primitives
+        visible = self.octree.query(self.frustum)
+        render.STATS.agents_visible += len(visible)
+        render.STATS.agents_culled += len(self.octree) - len(visible)
+        return visible + self.unculled
     
     
     def get_render_handles(self):
+        primitives = self.visible_primitives()
+        if self.model_matrix and not self.instanced:
+            self._update_models(primitives)
+        if self.instanced:
+            return self._get_instanced_render_handles(primitives)
         rhs = []
-        for p in self.primitives:
+        for p in primitives:
             rhs.extend(p.get_render_handles())
         return rhs
+
+
+    def _get_instanced_render_handles(self, primitives):
+        '''Gather per-instance data for every mesh and return one handle per
+        mesh.'''
+        if self.transform_store:
+            batches = self._get_store_batches(primitives)
+        else:
+            batches = OrderedDict()
+            for p in primitives:
+                if p.mesh_name not in batches:
+                    batches[p.mesh_name] = (p, array('f'))
+                p.write_instance(batches[p.mesh_name][1])
+            if self.model_matrix:
+                for mesh_name, (first, data) in batches.items():
+                    batches[mesh_name] = (first, rows_to_models(data))
+
+        instance_attribs = INSTANCE_ATTRIBS
+        if self.model_matrix:
+            instance_attribs = MODEL_INSTANCE_ATTRIBS
+        rhs = []
+        for mesh_name, (first, data) in batches.items():
+            handle = self._instanced_handles.get(mesh_name)
+            if handle is None:
+                vertices, colors, indices = weld_vertices(*first.get_mesh())
+                handle = InstancedRenderHandle.from_triangles(
+                        self.program, vertices, colors, instance_attribs,
+                        indices, views=2 if self.stereo else 1)
+                self._instanced_handles[mesh_name] = handle
+            handle.update_instances(data)
+            rhs.append(handle)
+        return rhs
+
+
+    def _get_store_batches(self, primitives):
+        '''Like the batches in _get_instanced_render_handles, with the
+        instance data taken from the stores.'''
+        batches = OrderedDict()
+        if self.octree is None:
+            for mesh_name, store in self.stores.items():
+                if store.count:
+                    batches[mesh_name] = (store.owners[0],
+                                          self._store_data(mesh_name))
+            return batches
+        slots = OrderedDict()
+        for p in primitives:
+            slots.setdefault(p.mesh_name, []).append(p.store_slot)
+        for mesh_name, mesh_slots in slots.items():
+            store = self.stores[mesh_name]
+            batches[mesh_name] = (
+                    store.owners[0],
+                    self._store_data(mesh_name, sorted(mesh_slots)))
+        return batches
+
+
+    def _store_data(self, mesh_name, slots=None):
+        '''Instance data of slots (all by default) of a store.'''
+        if not self.model_matrix:
+            return self.stores[mesh_name].instance_data(slots, RENDER_ALPHA)
+        models = self._store_model_data(mesh_name)
+        return models if slots is None else models[slots]
+
+
+    def _store_model_data(self, mesh_name):
+        '''Model matrices of the whole store, computed once per frame.'''
+        frame, models = self._store_models.get(mesh_name, (None, None))
+        if frame != self.frame:
+            models = self.stores[mesh_name].model_data(alpha=RENDER_ALPHA)
+            self._store_models[mesh_name] = (self.frame, models)
+        return models
+
+
+    def _update_models(self, primitives):
+        '''Set the model of those primitives that don't have this frame's
+        yet. With numpy, the matrices are computed in one vectorized batch.
+        '''
+        frame = self.frame
+        todo = [p for p in primitives if p.model_frame != frame]
+        if not todo:
+            return
+        if self.transform_store:
+            for p in todo:
+                p.model = self._store_model_data(p.mesh_name)[p.store_slot]
+                p.model_frame = frame
+            return
+        data = array('f')
+        for p in todo:
+            p.write_instance(data)
+        models = rows_to_models(data)
+        if numpy is not None:
+            models = models.tolist()  # Lists upload faster than numpy rows.
+        else:
+            models = [models[i:i + 16] for i in xrange(0, len(models), 16)]
+        for p, model in zip(todo, models):
+            p.model = model
+            p.model_frame = frame
     
 
+    def set_interpolation(self, alpha):
+        global RENDER_ALPHA
+        super(PrimitiveUniverse, self).set_interpolation(alpha)
+        RENDER_ALPHA = alpha if self.interpolate else 1.0
+
+
+    def start_worker(self, make_simulation=None, step=1 / 120):
+        '''Run the simulation in a worker process from now on.
+        make_simulation() is called in the worker, see
+        worker.SimulationWorker. It must publish one row per attached
+        primitive, in attach order. The default spins the primitives by
+        their angular_velocity.
+        While the worker runs, tick() only picks up its latest snapshot;
+        primitive tick() methods are not called.
+        '''
+        assert self.worker is None
+        if make_simulation is None:
+            states = [(p.rotation, p.translation, p.angular_velocity)
+                      for p in self.primitives]
+            make_simulation = partial(PrimitiveSimulation, states)
+        stride = TransformStore.STRIDE
+        capacity = len(self.primitives)
+        if self.transform_store:
+            self._snapshot = numpy.zeros((capacity, stride), numpy.float32)
+            self.store_rows = dict(
+                    (mesh_name, numpy.asarray(rows, numpy.intp))
+                    for mesh_name, rows in self.store_rows.items())
+        else:
+            self._snapshot = array('f', [0.0] * (capacity * stride))
+        self.worker = SimulationWorker(
+                make_simulation, capacity, stride, step)
+        self.worker.start()
+
+
+    def stop_worker(self):
+        self.worker.stop()
+        self.worker = None
+
+
+    def _apply_snapshot(self):
+        count = self.worker.read(self._snapshot)
+        if count is None:
+            return
+        assert count == len(self.primitives)
+        if self.interpolate:
+            self._save_transforms()
+        snapshot = self._snapshot
+        if self.transform_store:
+            for mesh_name, store in self.stores.items():
+                rows = self.store_rows[mesh_name]
+                instances = store.instances[:store.count]
+                if self.octree is not None:
+                    self._note_moved(store, instances, snapshot[rows])
+                instances[:] = snapshot[rows]
+        else:
+            stride = TransformStore.STRIDE
+            for i, p in enumerate(self.primitives):
+                row = snapshot[i * stride:(i + 1) * stride]
+                p.rotation = (tuple(row[0:3]), row[3])
+                translation = tuple(row[4:7])
+                if translation != p.translation:
+                    p.translation = translation
+
+
+    def _note_moved(self, store, old, new):
+        '''Add the owners of the rows of store whose translation differs
+        between old and new to octree_moved, comparing in one step.'''
+        moved = numpy.flatnonzero((old[:, 4:7] != new[:, 4:7]).any(axis=1))
+        owners = store.owners
+        for slot in moved:
+            p = owners[slot]
+            if p.octree_moved is not None:
+                self.octree_moved.add(p)
+
+
+    def _save_transforms(self):
+        if self.transform_store:
+            for store in self.stores.values():
+                store.save_previous()
+        else:
+            for p in self.primitives:
+                p.save_transform()
+
+
     def tick(self, dt):
-        for p in self.primitives:
-            p.tick(dt)
+        if self.worker is not None:
+            self._apply_snapshot()
+            self._update_octree()
+            return
+        if self.interpolate:
+            self._save_transforms()
+        if self.transform_store:
+            for store in self.stores.values():
+                store.tick(dt)
+            for p in self.scripted:
+                p.tick(dt)
+        else:
+            for p in self.primitives:
+                p.tick(dt)
+        self._update_octree()
+
+
+    def _update_octree(self):
+        '''Re-file the primitives whose translation changed since the last
+        call. Static ones cost nothing.'''
+        if self.octree is not None and self.octree_moved:
+            octree = self.octree
+            for p in self.octree_moved:
+                octree.update(p, *p.get_bounds())
+            self.octree_moved.clear()
     
 
     def render_prelude(self, eye):
+        if eye != 'right':
+            self.frame += 1
         Universe.render_prelude(self, eye)
         glClearColor(1, 1, 1, 1)
         glPolygonMode(GL_FRONT_AND_BACK, GL_LINE)
+        if self.octree is not None:
+            if eye == 'stereo':
+                self.frustum = FrustumUnion(
+                        [Frustum.from_matrix(view_proj.to_c_array())
+                         for view_proj in self.stereo_view_proj])
+            else:
+                self.frustum = Frustum.from_matrix(
+                        self.view_proj.to_c_array())
         
 
 class PrimitiveProgram(Program):
-    def __init__(self):
+    def __init__(self, instanced=False, stereo=False, model_matrix=False):
+        '''An instanced program reads its transform from the per-instance
+        attributes in INSTANCE_ATTRIBS instead of the transform uniform.
+        A stereo program draws for render.render_universe_stereo.
+        A model_matrix program takes the model matrix, see
+        transforms.model_matrix, as the model uniform or, instanced, as
+        MODEL_INSTANCE_ATTRIBS.'''
         super(PrimitiveProgram, self).__init__(
-                glCreateProgram(), 'primitive_program')
+                glCreateProgram(),
+                ('instanced_primitive_program' if instanced
+                 else 'primitive_program') + ('_stereo' if stereo else '') +
+                ('_model' if model_matrix else ''))
+        self.stereo = stereo
+        self.model_matrix = model_matrix
         rotation_src = '''
         mat4 rotation_matrix(vec3 p_axis, float angle)
         {
@@ -189,10 +711,9 @@ class PrimitiveProgram(Program):
             vec3 translation;
         };
         uniform Transform transform;
-        uniform float eye_ipd;
         uniform float persp_offset;
 
-        uniform mat4 persp;
+        {frame_uniforms}
 
         mat4 rotation_matrix(vec3 p_axis, float angle);
 
@@ -218,7 +739,87 @@ class PrimitiveProgram(Program):
 
             vec4 view_vec = vt * view * vec4(in_pos, 1.0);
 
-            gl_Position = persp * view_vec;
+            gl_Position = {viewport}(persp * view_vec);
+        }
+        '''
+        instanced_vertex_src = '''
+        #version 330
+        in vec3 in_pos;
+        in vec3 in_color;
+        in vec3 in_axis;
+        in float in_angle;
+        in vec3 in_translation;
+
+        out vec3 vs_color;
+
+        {frame_uniforms}
+
+        mat4 rotation_matrix(vec3 p_axis, float angle);
+
+        void main(void)
+        {
+            vs_color = in_color;
+
+            mat4 vt = mat4(
+                1.0, 0.0, 0.0, 0.0,
+                0.0, 1.0, 0.0, 0.0,
+                0.0, 0.0, 1.0, 0.0,
+                eye_ipd, 0.0, 0.0, 1.0);
+
+            mat4 translate = mat4(
+                1.0, 0.0, 0.0, 0.0,
+                0.0, 1.0, 0.0, 0.0,
+                0.0, 0.0, 1.0, 0.0,
+                in_translation.x, in_translation.y, in_translation.z, 1.0);
+
+            mat4 view = translate * rotation_matrix(in_axis, in_angle);
+
+            vec4 view_vec = vt * view * vec4(in_pos, 1.0);
+
+            gl_Position = {viewport}(persp * view_vec);
+        }
+        '''
+        # The model matrix is built on the CPU. Offsetting x by eye_ipd is
+        # what multiplying by vt above does.
+        model_vertex_src = '''
+        #version 330
+        in vec3 in_pos;
+        in vec3 in_color;
+
+        out vec3 vs_color;
+
+        uniform mat4 model;
+
+        {frame_uniforms}
+
+        void main(void)
+        {
+            vs_color = in_color;
+            vec4 view_vec = model * vec4(in_pos, 1.0);
+            view_vec.x += eye_ipd * view_vec.w;
+            gl_Position = {viewport}(persp * view_vec);
+        }
+        '''
+        instanced_model_vertex_src = '''
+        #version 330
+        in vec3 in_pos;
+        in vec3 in_color;
+        in vec4 in_model0;
+        in vec4 in_model1;
+        in vec4 in_model2;
+        in vec4 in_model3;
+
+        out vec3 vs_color;
+
+        {frame_uniforms}
+
+        void main(void)
+        {
+            vs_color = in_color;
+            mat4 model = mat4(in_model0, in_model1, in_model2, in_model3);
+            vec4 view_vec = model * vec4(in_pos, 1.0);
+            view_vec.x += eye_ipd * view_vec.w;
+            gl_Position = {viewport}(persp * view_vec);
         }
         '''
         frag_src = '''
@@ -232,13 +833,35 @@ class PrimitiveProgram(Program):
             out_color = vec4(vs_color,1.0);
         }
         '''
-        self.attach_shader(
-                create_shader(rotation_src, GL_VERTEX_SHADER, 'rotation'))
-        self.attach_shader(
-                create_shader(vertex_src, GL_VERTEX_SHADER, 'vertex'))
-        self.attach_shader(
-                create_shader(frag_src, GL_FRAGMENT_SHADER, 'frag'))
-        self.link()
+        # persp and eye_ipd are plain uniforms or live in the shared
+        # uniform block, see render.get_frame_block. Stereo programs have a
+        # pair of each instead.
+        use_ubo = renderer_options.use_uniform_buffers and not stereo
+        if stereo:
+            frame_src = STEREO_SRC
+        elif use_ubo:
+            frame_src = FRAME_BLOCK_SRC
+        else:
+            frame_src = '''
+        uniform float eye_ipd;
+        uniform mat4 persp;
+'''
+        if model_matrix:
+            vertex_src = (instanced_model_vertex_src if instanced
+                          else model_vertex_src)
+        elif instanced:
+            vertex_src = instanced_vertex_src
+        vertex_src = vertex_src.replace('{frame_uniforms}', frame_src)
+        vertex_src = vertex_src.replace(
+                '{viewport}', 'stereo_viewport' if stereo else '')
+
+        shaders = [(vertex_src, GL_VERTEX_SHADER, 'vertex'),
+                   (frag_src, GL_FRAGMENT_SHADER, 'frag')]
+        if not model_matrix:
+            shaders.insert(0, (rotation_src, GL_VERTEX_SHADER, 'rotation'))
+        self.build(shaders)
+        if use_ubo:
+            self.attach_block(get_frame_block())
         # Setup a default perspective matrix.
-        self.set_uniform('persp',
-                         mat4x4.perspective(75.0, ASPECT_RATIO, 0.001, 100))
+        if not stereo:
+            self.set_uniform('persp', default_persp())
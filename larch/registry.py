@@ -0,0 +1,87 @@
+'''Finds games without importing them.
+Built in games are the modules of the games package. Their names are kept
+in a manifest file that is only rebuilt when the package directory
+changes. Installed packages can add games through the 'larch.games' entry
+point group; an entry point names a function new(interface_class) like the
+one of every game module. Entry points are only looked up when a game
+isn't built in, or when listing all games, since that needs pkg_resources.
+'''
+from __future__ import (print_function, division, absolute_import)
+
+
+import importlib
+import json
+import os
+
+
+GAMES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'games')
+MANIFEST_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'larch',
+                             'games.json')
+ENTRY_POINT_GROUP = 'larch.games'
+
+
+def scan_games(directory=GAMES_DIR):
+    '''Names of the modules and packages in directory, sorted.'''
+    names = []
+    for entry in os.listdir(directory):
+        name, ext = os.path.splitext(entry)
+        if name.startswith('_'):
+            continue
+        if ext == '.py' or (not ext and os.path.exists(
+                os.path.join(directory, entry, '__init__.py'))):
+            names.append(name)
+    return sorted(names)
+
+
+def builtin_games(directory=GAMES_DIR, manifest_path=MANIFEST_PATH):
+    '''scan_games(directory), cached in manifest_path until the
+    directory's modification time changes.'''
+    mtime = os.stat(directory).st_mtime
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['directory'] == directory and manifest['mtime'] == mtime:
+            return manifest['games']
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    games = scan_games(directory)
+    try:
+        manifest_dir = os.path.dirname(manifest_path)
+        if not os.path.isdir(manifest_dir):
+            os.makedirs(manifest_dir)
+        tmp_path = '{}.{}.tmp'.format(manifest_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump({'directory': directory, 'mtime': mtime,
+                       'games': games}, f)
+        os.rename(tmp_path, manifest_path)
+    except (IOError, OSError):
+        pass  # Read only home, scan again next time.
+    return games
+
+
+def plugin_entry_points():
+    '''{name: entry point} of installed plugins.'''
+    try:
+        import pkg_resources
+    except ImportError:
+        return {}
+    return dict((entry_point.name, entry_point) for entry_point in
+                pkg_resources.iter_entry_points(ENTRY_POINT_GROUP))
+
+
+def all_games():
+    '''Names of the built in and plugin games, sorted.'''
+    return sorted(set(builtin_games()) | set(plugin_entry_points()))
+
+
+def find_game(name):
+    '''Returns the new(interface_class) function of game name, or None.
+    Imports the game, and with it the graphics modules.'''
+    if name is None:
+        return None
+    if name in builtin_games():
+        return importlib.import_module('games.{}'.format(name)).new
+    entry_point = plugin_entry_points().get(name)
+    if entry_point is None:
+        return None
+    return entry_point.load()
@@ -1,22 +1,219 @@
 from __future__ import (print_function, division, absolute_import)
 
 
+from array import array
 from gl import *
+import cffi
 import glm
+import errno
+import hashlib
+import os
 import re
+import struct
 
 import logger
 from options import renderer_options
 
 
 CURRENT_PROGRAM = -1
+CURRENT_VAO = -1
+# Instances per draw: 2 while render_universe_stereo draws both eyes at once.
+VIEW_INSTANCES = 1
+FLOAT_SIZE = 4  # Bytes in a GLfloat
+
+_ffi = cffi.FFI()
+
+
+def is_float32_buffer(data):
+    '''True for buffer-protocol objects holding float32: array('f'), NumPy
+    float32 arrays, memoryviews with format 'f'. Python lists are False.
+    Anything else raises, so that e.g. float64 data is never uploaded as
+    garbage.
+    '''
+    if isinstance(data, (list, tuple)):
+        return False
+    typecode = getattr(data, 'typecode', None)  # array.array
+    if typecode is None:
+        dtype = getattr(data, 'dtype', None)  # numpy
+        if dtype is not None:
+            typecode = dtype.char
+        else:
+            typecode = getattr(data, 'format', None)  # memoryview
+    if typecode not in ('f', '<f', '=f'):
+        raise TypeError('Expected float32 data, got {!r}'.format(typecode))
+    return True
+
+
+def num_floats(data):
+    '''Number of floats in a flat list or a float32 buffer.'''
+    if is_float32_buffer(data):
+        return len(_ffi.from_buffer(data)) // FLOAT_SIZE
+    return len(data)
+
+
+def buffer_data(target, data, usage):
+    '''glBufferData for a flat list of floats or a float32 buffer-protocol
+    object. Buffers are handed to GL in place, without an intermediate list.
+    For a file mapped with mmap, pass numpy.frombuffer(mapping, numpy.float32,
+    count, offset) to upload straight from the mapping.
+    '''
+    if is_float32_buffer(data):
+        pointer = _ffi.from_buffer(data)
+        # Raw form of the wrapper: byte size and pointer instead of a ctype
+        # and a sequence.
+        glBufferData(target, len(pointer), pointer, usage)
+    else:
+        glBufferData(target, GLfloat, data, usage)
+
+
+def buffer_sub_data(target, offset, data):
+    '''glBufferSubData at offset (in floats) for the same kinds of data as
+    buffer_data.'''
+    if is_float32_buffer(data):
+        pointer = _ffi.from_buffer(data)
+        glBufferSubData(target, offset * FLOAT_SIZE, len(pointer), pointer)
+    else:
+        glBufferSubData(target, offset * FLOAT_SIZE, GLfloat, data)
+
+
+class RenderStats(object):
+    '''Counts GL state changes. reset() is called once per frame by the
+    Interface; the counts of the previous frame are kept in last_frame.
+    '''
+    FIELDS = ('program_binds', 'program_binds_skipped',
+              'vao_binds', 'vao_binds_skipped', 'draw_calls',
+              'uniform_uploads', 'uniform_uploads_skipped',
+              'agents_visible', 'agents_culled')
+
+    def __init__(self):
+        self.last_frame = {}
+        self.reset()
+
+
+    def reset(self):
+        self.last_frame = dict(
+                (field, getattr(self, field, 0)) for field in self.FIELDS)
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+
+    def state_changes(self):
+        return self.program_binds + self.vao_binds
+STATS = RenderStats()
+
+
+def bind_vao(vao):
+    '''glBindVertexArray, skipped when vao is already bound.'''
+    global CURRENT_VAO
+    if CURRENT_VAO != vao:
+        glBindVertexArray(vao)
+        CURRENT_VAO = vao
+        STATS.vao_binds += 1
+    else:
+        STATS.vao_binds_skipped += 1
+
+
+class DrawItem(object):
+    '''A RenderHandle plus the per-draw state it needs.
+    Agents that share a RenderHandle (see MeshCache) return DrawItems from
+    get_render_handles, so that their uniforms are set right before their own
+    draw call and survive the sorting done by RenderQueue.
+    uniforms is a sequence of (name, value) pairs for handle.program.
+    depth is the view distance, used to sort front to back.
+    '''
+    __slots__ = ('handle', 'uniforms', 'depth')
+
+    def __init__(self, handle, uniforms=(), depth=0.0):
+        self.handle = handle
+        self.uniforms = uniforms
+        self.depth = depth
+
+
+class RenderQueue(object):
+    '''Collects RenderHandles and DrawItems and submits them sorted by a
+    packed key: program, then VAO, then depth. This keeps program and VAO
+    binds to one per distinct value.
+    '''
+    KEY_BITS = 20
+    KEY_MASK = (1 << KEY_BITS) - 1
+    MAX_DEPTH = 100.0  # Depths beyond this share the last bucket.
+
+    def __init__(self):
+        self.items = []
+
+
+    @classmethod
+    def sort_key(cls, program_idt, vao, depth):
+        bits = cls.KEY_BITS
+        depth = min(max(depth, 0.0), cls.MAX_DEPTH)
+        depth_bucket = int(depth / cls.MAX_DEPTH * cls.KEY_MASK)
+        return (((program_idt & cls.KEY_MASK) << (2 * bits)) |
+                ((vao & cls.KEY_MASK) << bits) |
+                depth_bucket)
+
+
+    def add(self, item):
+        '''item is a RenderHandle or a DrawItem.'''
+        if not isinstance(item, DrawItem):
+            item = DrawItem(item)
+        handle = item.handle
+        key = self.sort_key(handle.program.idt, handle.vao, item.depth)
+        self.items.append((key, len(self.items), item))
+
+
+    def extend(self, items):
+        for item in items:
+            self.add(item)
+
+
+    def sorted_items(self):
+        # The insertion index keeps the sort stable and never compares items.
+        return [item for _, _, item in sorted(self.items)]
+
+
+    def flush(self):
+        '''Draw everything in sorted order and empty the queue.'''
+        for item in self.sorted_items():
+            handle = item.handle
+            for name, value in item.uniforms:
+                handle.program.set_uniform(name, value)
+            draw_handle(handle)
+        self.items = []
+
+
+def draw_handle(render_handle):
+    with render_handle.program:
+        bind_vao(render_handle.vao)
+        mode = render_handle.mode
+        num_instances = render_handle.num_instances
+        index_type = render_handle.index_type
+        STATS.draw_calls += 1
+        if VIEW_INSTANCES != 1:
+            num_instances = VIEW_INSTANCES * (
+                    1 if num_instances is None else num_instances)
+        if num_instances is None:
+            if index_type is None:
+                glDrawArrays(mode, render_handle.first,
+                             render_handle.num_elements)
+            else:
+                glDrawElements(mode, render_handle.num_elements,
+                               index_type, 0)
+        elif num_instances > 0:
+            if index_type is None:
+                glDrawArraysInstanced(mode, render_handle.first,
+                                      render_handle.num_elements,
+                                      num_instances)
+            else:
+                glDrawElementsInstanced(mode,
+                                        render_handle.num_elements,
+                                        index_type, 0, num_instances)
 
 
 def draw_handles(render_handles):
-    for render_handle in render_handles:
-        with render_handle.program:
-            glBindVertexArray(render_handle.vao)
-            glDrawArrays(GL_TRIANGLES, 0, render_handle.num_elements)
+    '''render_handles may mix RenderHandles and DrawItems.'''
+    queue = RenderQueue()
+    queue.extend(render_handles)
+    queue.flush()
 
 
 def render_universe(universe, eye):
@@ -24,24 +221,123 @@ def render_universe(universe, eye):
     draw_handles(universe.get_render_handles())
 
 
-def create_shader(src, gl_type, name):
-    'src is a string. gl_type is GL_VERTEX_SHADER et al.'
+def render_universe_stereo(universe):
+    '''Draw both eyes in one pass over the universe, into the whole
+    viewport. Every draw is instanced twice; programs built with STEREO_SRC
+    pick the eye from gl_InstanceID and move it into its half.
+    universe.stereo must be True.
+    '''
+    global VIEW_INSTANCES
+    assert universe.stereo
+    universe.render_prelude('stereo')
+    VIEW_INSTANCES = 2
+    glEnable(GL_CLIP_DISTANCE0)
+    try:
+        draw_handles(universe.get_render_handles())
+    finally:
+        VIEW_INSTANCES = 1
+        glDisable(GL_CLIP_DISTANCE0)
+
+
+def submit_shader(src, gl_type):
+    '''Start compiling src. Nothing is queried, so this doesn't wait for
+    the driver. See print_shader_log.'''
     s = glCreateShader(gl_type)
     glShaderSource(s, [src])
     glCompileShader(s)
-    print_shader_log(s, name)
     return s
 
 
+# Whether the driver compiles on its own threads, see enable_parallel_compile.
+PARALLEL_COMPILE = None
+# Programs built but not resolved yet, in build order.
+PENDING_PROGRAMS = []
+
+
+def enable_parallel_compile():
+    '''Let the driver compile and link on as many threads as it likes, if
+    it has KHR/ARB_parallel_shader_compile. Returns whether it does.'''
+    global PARALLEL_COMPILE
+    if PARALLEL_COMPILE is None:
+        extensions = set(glGetStringi(GL_EXTENSIONS, i)
+                         for i in xrange(glGetIntegerv(GL_NUM_EXTENSIONS)))
+        PARALLEL_COMPILE = True
+        if 'GL_KHR_parallel_shader_compile' in extensions:
+            glMaxShaderCompilerThreadsKHR(0xFFFFFFFF)
+        elif 'GL_ARB_parallel_shader_compile' in extensions:
+            glMaxShaderCompilerThreadsARB(0xFFFFFFFF)
+        else:
+            PARALLEL_COMPILE = False
+    return PARALLEL_COMPILE
+
+
+# Vertex attribute locations. Program.build binds them before linking, so
+# handles can set up their VAOs without asking a program that may still be
+# compiling. Names a program doesn't declare are ignored by the driver.
+ATTRIB_LOCATIONS = {
+        'in_pos': 0,
+        'in_color': 1,
+        'in_texcoord': 2,
+        'in_inside': 3,
+        'in_axis': 4,
+        'in_angle': 5,
+        'in_translation': 6,
+        # The columns of a mat4, see primitive.MODEL_INSTANCE_ATTRIBS.
+        'in_model0': 7,
+        'in_model1': 8,
+        'in_model2': 9,
+        'in_model3': 10,
+        }
+
+
+def attrib_location(name):
+    '''Location of the vertex attribute name in every program, see
+    ATTRIB_LOCATIONS.'''
+    return ATTRIB_LOCATIONS[name]
+
+
+def resolve_programs():
+    '''Wait for every program built so far, see Program.resolve.'''
+    while PENDING_PROGRAMS:
+        PENDING_PROGRAMS[0].resolve()
+
+
 class Program(object):
     def __init__(self, idt, name):
         self.idt = idt
         self.name = name
         self.uniforms = {}
+        self.values = {}  # Shadow copy of the last uploaded uniform values.
+        self.blocks = {}  # Uniform name -> UniformBlock holding it.
+        # ([(shader, name)], cache key) while build() is in flight.
+        self.pending = None
+        self._deferred = []  # (function, args) to call once resolved.
 
 
     def set_uniform(self, name, thing):
-        """Currently doesn't support int uniforms"""
+        """Currently doesn't support int uniforms.
+        Does nothing if thing equals the last value set for name.
+        Waits for resolve() if the program is still being built."""
+        if self.pending is not None:
+            self._deferred.append((self.set_uniform, (name, thing)))
+            return
+        block = self.blocks.get(name)
+        if block is not None:
+            block.set(name, thing)
+            return
+
+        is_mat = type(thing) is glm.types.mat4x4
+        if is_mat:
+            c_array = thing.to_c_array()
+            value = tuple(c_array)
+        else:
+            value = tuple(thing)
+        if self.values.get(name) == value:
+            STATS.uniform_uploads_skipped += 1
+            return
+        self.values[name] = value
+        STATS.uniform_uploads += 1
+
         if name not in self.uniforms:
             loc = glGetUniformLocation(self.idt, name)
             assert loc >= 0
@@ -49,10 +345,14 @@ class Program(object):
         else:
             loc = self.uniforms[name]
         
-        # Case 1: 4x4 Matrix
-        if type(thing) is glm.types.mat4x4:
+        # Case 1: 4x4 Matrix, or 16 floats in column-major order.
+        if is_mat:
             with self:
-                glUniformMatrix4fv(loc, False, thing.to_c_array())
+                glUniformMatrix4fv(loc, False, c_array)
+            return
+        if len(value) == 16:
+            with self:
+                glUniformMatrix4fv(loc, False, value)
             return
         
         # Case 2: Call one of these:
@@ -66,97 +366,734 @@ class Program(object):
         return
 
 
-    def attach_shader(self, shader):
-        glAttachShader(self.idt, shader)
+    def build(self, shaders):
+        '''Compile and link shaders, a list of (src, gl_type, name). With a
+        program cache (see get_program_cache) the linked binary of a
+        previous run is loaded instead, if the driver accepts it.
+        Compiling and linking are only submitted; the program is a future
+        that resolve() waits for, at the latest when it is first bound.
+        Building every program before resolving any lets the driver work
+        on them all at once, see enable_parallel_compile.
+        '''
+        cache = get_program_cache()
+        key = None
+        if cache is not None:
+            key = cache.key(shaders)
+            if cache.load(self, key):
+                return
+            glProgramParameteri(
+                    self.idt, GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+        enable_parallel_compile()
+        submitted = []
+        for src, gl_type, name in shaders:
+            shader = submit_shader(src, gl_type)
+            self.attach_shader(shader)
+            submitted.append((shader, name))
+        for name, location in ATTRIB_LOCATIONS.items():
+            glBindAttribLocation(self.idt, location, name)
+        glLinkProgram(self.idt)
+        self.pending = (submitted, key)
+        PENDING_PROGRAMS.append(self)
 
 
-    def link(self):
-        glLinkProgram(self.idt)
+    def done(self):
+        '''True once the program can be used without waiting. While it is
+        being built, only drivers with parallel compile can tell.'''
+        if self.pending is None:
+            return True
+        return bool(PARALLEL_COMPILE and
+                    glGetProgramiv(self.idt, GL_COMPLETION_STATUS_KHR))
+
+
+    def resolve(self):
+        '''Wait for build() to finish, report errors, store the binary in
+        the program cache and run the calls deferred until now.'''
+        if self.pending is None:
+            return
+        submitted, key = self.pending
+        self.pending = None
+        PENDING_PROGRAMS.remove(self)
+        if glGetProgramiv(self.idt, GL_LINK_STATUS) == GL_TRUE:
+            logger.debug('Built program {}.', self.name)
+        else:
+            for shader, name in submitted:
+                print_shader_log(shader, name)
+            print_program_log(self.idt, self.name)
         if renderer_options.validate_programs:
             glValidateProgram(self.idt)
-        print_program_log(self.idt, self.name)
+        if key is not None:
+            get_program_cache().store(self, key)
+        deferred = self._deferred
+        self._deferred = []
+        for function, args in deferred:
+            function(*args)
+
+
+    def attach_block(self, block):
+        '''Use block for the uniforms it holds. set_uniform on any of them
+        updates the shared block instead of this program.'''
+        if self.pending is not None:
+            self._deferred.append((self.attach_block, (block,)))
+            return
+        block.bind_program(self)
+        for name in block.offsets:
+            self.blocks[name] = block
+
+
+    def attach_shader(self, shader):
+        glAttachShader(self.idt, shader)
 
 
     def __enter__(self):
         global CURRENT_PROGRAM
+        if self.pending is not None:
+            self.resolve()
         if CURRENT_PROGRAM != self.idt:
             glUseProgram(self.idt)
             CURRENT_PROGRAM = self.idt
+            STATS.program_binds += 1
+        else:
+            STATS.program_binds_skipped += 1
 
 
     def __exit__(self, t, value, traceback):
         pass
 
 
+class ProgramCache(object):
+    '''Linked program binaries in a directory, one file per program named
+    by a hash of its shader sources and the GL driver, which a binary is
+    only valid for. See Program.build.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0  # Binaries the driver refused, e.g. after updating.
+        self._driver = None
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+
+    def key(self, shaders):
+        if self._driver is None:
+            self._driver = '\n'.join(
+                    str(glGetString(name))
+                    for name in (GL_VENDOR, GL_RENDERER, GL_VERSION))
+        digest = hashlib.sha1(self._driver.encode('utf-8'))
+        # The attribute locations are linked into the binary.
+        digest.update(repr(sorted(ATTRIB_LOCATIONS.items())).encode('utf-8'))
+        for src, gl_type, _ in shaders:
+            digest.update('\0{}\0'.format(gl_type).encode('utf-8'))
+            digest.update(src.encode('utf-8'))
+        return digest.hexdigest()
+
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.bin')
+
+
+    def load(self, program, key):
+        '''Returns True if program was linked from the cached binary.'''
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except IOError:
+            self.misses += 1
+            return False
+        try:
+            binary_format, = struct.unpack('<I', data[:4])
+        except struct.error:
+            # Cut short, e.g. by a full disk.
+            logger.info('Cached binary of {} truncated, compiling.',
+                        program.name)
+            self.rejected += 1
+            self._remove(path)
+            return False
+        binary = data[4:]
+        glProgramBinary(program.idt, binary_format, binary, len(binary))
+        if glGetProgramiv(program.idt, GL_LINK_STATUS) != GL_TRUE:
+            logger.info('Cached binary of {} rejected, compiling.',
+                        program.name)
+            self.rejected += 1
+            self._remove(path)
+            return False
+        self.hits += 1
+        return True
+
+
+    def store(self, program, key):
+        length = glGetProgramiv(program.idt, GL_PROGRAM_BINARY_LENGTH)
+        if not length:
+            return
+        binary_format, binary = glGetProgramBinary(program.idt, length)
+        # Write and rename, so that a concurrent run never reads half a file.
+        # The cache is optional: a read-only directory or a full disk
+        # leaves the program as linked. On Windows rename fails if another
+        # run stored the same key first, which is just as good.
+        path = self.path(key)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(struct.pack('<I', binary_format))
+                f.write(binary)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            logger.info('Could not cache the binary of {}: {}',
+                        program.name, e)
+            self._remove(tmp_path)
+
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # Gone already, e.g. removed by a concurrent run.
+
+
+PROGRAM_CACHE = None  # Lazily created by get_program_cache()
+
+
+def get_program_cache():
+    '''The ProgramCache in renderer_options.program_cache_dir, or None if
+    that is not set.'''
+    global PROGRAM_CACHE
+    directory = renderer_options.program_cache_dir
+    if directory is None:
+        return None
+    if PROGRAM_CACHE is None or PROGRAM_CACHE.directory != directory:
+        PROGRAM_CACHE = ProgramCache(directory)
+    return PROGRAM_CACHE
+
+
+def std140_layout(fields):
+    '''fields is a list of (name, type) with type one of STD140_TYPES.
+    Returns ({name: offset in floats}, size in floats) for a std140 block.
+    '''
+    offsets = {}
+    offset = 0
+    for name, kind in fields:
+        size, align = STD140_TYPES[kind]
+        offset = (offset + align - 1) // align * align
+        offsets[name] = offset
+        offset += size
+    # The block size is rounded up to a vec4.
+    return offsets, (offset + 3) // 4 * 4
+
+
+# type -> (size, alignment), both in floats.
+STD140_TYPES = {
+        'float': (1, 1),
+        'vec2': (2, 2),
+        'vec3': (3, 4),
+        'vec4': (4, 4),
+        'mat4': (16, 4),
+        }
+
+
+class UniformBlock(object):
+    '''A std140 uniform block backed by a uniform buffer object.
+    Every program that attaches it reads the same buffer, so a value is
+    uploaded once no matter how many programs use it. Declare it in GLSL as
+        layout(std140) uniform <name> { <fields in the same order> };
+    '''
+    def __init__(self, name, binding, fields):
+        self.name = name
+        self.binding = binding
+        self.offsets, size = std140_layout(fields)
+        self.sizes = dict((n, STD140_TYPES[kind][0]) for n, kind in fields)
+        self.data = array('f', [0.0] * size)
+
+        self.ubo = glGenBuffers(1)[0]
+        glBindBuffer(GL_UNIFORM_BUFFER, self.ubo)
+        buffer_data(GL_UNIFORM_BUFFER, self.data, GL_DYNAMIC_DRAW)
+        glBindBufferBase(GL_UNIFORM_BUFFER, binding, self.ubo)
+
+
+    def bind_program(self, program):
+        index = glGetUniformBlockIndex(program.idt, self.name)
+        assert index != GL_INVALID_INDEX
+        glUniformBlockBinding(program.idt, index, self.binding)
+
+
+    def set(self, name, thing):
+        '''Same types as Program.set_uniform. Uploads only when changed.'''
+        if type(thing) is glm.types.mat4x4:
+            thing = thing.to_c_array()
+        offset = self.offsets[name]
+        size = self.sizes[name]
+        value = array('f', thing)
+        if self.data[offset:offset + size] == value:
+            STATS.uniform_uploads_skipped += 1
+            return
+        STATS.uniform_uploads += 1
+        self.data[offset:offset + size] = value
+        glBindBuffer(GL_UNIFORM_BUFFER, self.ubo)
+        buffer_sub_data(GL_UNIFORM_BUFFER, offset, value)
+
+
+FRAME_BLOCK = None  # Lazily created by get_frame_block()
+FRAME_BLOCK_SRC = '''
+        layout(std140) uniform Frame {
+            mat4 persp;
+            float eye_ipd;
+        };
+'''
+
+
+# Replaces the persp and eye_ipd uniforms of a vertex shader for
+# render_universe_stereo. Even instances are the left eye, odd ones the right;
+# per-instance attributes need a divisor of 2 (see
+# InstancedRenderHandle.from_triangles). The shader must pass its clip space
+# position through stereo_viewport().
+STEREO_SRC = '''
+        uniform mat4 stereo_persp[2];
+        uniform float stereo_eye_ipd[2];
+        #define STEREO_EYE (gl_InstanceID % 2)
+        #define persp stereo_persp[STEREO_EYE]
+        #define eye_ipd stereo_eye_ipd[STEREO_EYE]
+        out float gl_ClipDistance[1];
+
+        vec4 stereo_viewport(vec4 clip)
+        {
+            // Squeeze into the eye's half of the viewport and clip away
+            // what would spill over into the other half.
+            float side = STEREO_EYE == 0 ? -1.0 : 1.0;
+            clip.x = 0.5 * clip.x + 0.5 * side * clip.w;
+            gl_ClipDistance[0] = side * clip.x;
+            return clip;
+        }
+'''
+
+
+def get_frame_block():
+    '''The uniform block with per-frame data shared by all programs:
+    the perspective matrix and the eye offset. See FRAME_BLOCK_SRC.'''
+    global FRAME_BLOCK
+    if FRAME_BLOCK is None:
+        FRAME_BLOCK = UniformBlock(
+                'Frame', 0, [('persp', 'mat4'), ('eye_ipd', 'float')])
+    return FRAME_BLOCK
+
+
 class RenderHandle(object):
     '''Contains all necessary pointers to make a draw call.
     Should be used by higher level libraries to provide Agent-creating functions
     that hide get_render_handles
     '''
-    def __init__(self, program, vao, num_elements):
+    # None means a plain draw. Instanced handles set this to an int.
+    num_instances = None
+    # None means glDrawArrays. Indexed handles set GL_UNSIGNED_SHORT or
+    # GL_UNSIGNED_INT and num_elements is the number of indices.
+    index_type = None
+    mode = GL_TRIANGLES
+    # First vertex for glDrawArrays. DynamicRenderHandle moves it around.
+    first = 0
+
+    def __init__(self, program, vao, num_elements, vbos=()):
         self.program = program
         self.vao = vao
         self.num_elements = num_elements
+        self.vbos = list(vbos)
+
+
+    def delete(self):
+        'Free the GL objects owned by this handle.'
+        global CURRENT_VAO
+        if self.vbos:
+            glDeleteBuffers(self.vbos)
+        glDeleteVertexArrays([self.vao])
+        if CURRENT_VAO == self.vao:
+            CURRENT_VAO = -1
+        self.vbos = []
 
 
     @staticmethod
     def from_triangles(program, vertices, colors):
-        assert len(vertices) % 3 == 0
-        has_colors = len(colors) == len(vertices)
+        '''vertices and colors are flat lists of floats or float32 buffers,
+        see buffer_data.'''
+        num_vertex_floats = num_floats(vertices)
+        num_color_floats = num_floats(colors)
+        assert num_vertex_floats % 3 == 0
+        has_colors = num_color_floats == num_vertex_floats
         if not has_colors:
-            print('warning! no colors')
-            print(len(colors), len(vertices))
+            logger.warning('No colors: {} color floats for {} vertex floats.',
+                           num_color_floats, num_vertex_floats)
 
         va = glGenVertexArrays(1)
         vbos =  glGenBuffers(2)
 
         attrib_locs = [
-                glGetAttribLocation(program.idt, "in_pos"),
-                glGetAttribLocation(program.idt, "in_color")
+                attrib_location("in_pos"),
+                attrib_location("in_color")
                 ]
 
-        glBindVertexArray(va[0])
+        bind_vao(va[0])
         for i in (0, 1):
-            if attrib_locs[i] >= 0:
-                glBindBuffer(
-                        GL_ARRAY_BUFFER, vbos[i])
-                glBufferData(
-                        GL_ARRAY_BUFFER, GLfloat,
-                        (vertices, colors)[i], GL_STATIC_DRAW)
-                glVertexAttribPointer(
-                        attrib_locs[i], 3, GL_FLOAT, GL_FALSE, 0, 0)
-                glEnableVertexAttribArray(i)
-        return RenderHandle(program, va[0], int(len(vertices) / 3))
+            glBindBuffer(
+                    GL_ARRAY_BUFFER, vbos[i])
+            buffer_data(
+                    GL_ARRAY_BUFFER, (vertices, colors)[i], GL_STATIC_DRAW)
+            glVertexAttribPointer(
+                    attrib_locs[i], 3, GL_FLOAT, GL_FALSE, 0, 0)
+            glEnableVertexAttribArray(attrib_locs[i])
+        return RenderHandle(program, va[0], num_vertex_floats // 3, vbos)
+
+
+    @staticmethod
+    def from_indexed_triangles(program, vertices, colors, indices):
+        '''Like from_triangles, but every three entries of indices make a
+        triangle. See weld_vertices to build indices from flat triangles.
+        Indices are 16 bit when possible, 32 bit otherwise.
+        '''
+        assert len(indices) % 3 == 0
+        handle = RenderHandle.from_triangles(program, vertices, colors)
+        index_type, ctype = index_type_for(handle.num_elements)
+        ebo = glGenBuffers(1)[0]
+
+        # The element buffer binding is VAO state.
+        bind_vao(handle.vao)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, ebo)
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, ctype, indices, GL_STATIC_DRAW)
+        bind_vao(0)
+
+        handle.vbos.append(ebo)
+        handle.num_elements = len(indices)
+        handle.index_type = index_type
+        return handle
 
 
     @staticmethod
     def from_triangles_and_texcoords(program, vertices, texcoords):
-        assert len(vertices) % 3 == 0
-        has_texcoords = int(len(texcoords) / 2) == int(len(vertices) / 3)
+        num_vertex_floats = num_floats(vertices)
+        num_texcoord_floats = num_floats(texcoords)
+        assert num_vertex_floats % 3 == 0
+        has_texcoords = num_texcoord_floats // 2 == num_vertex_floats // 3
         if not has_texcoords:
-            print('warning! no texcoords')
-            print(len(texcoords), len(vertices))
+            logger.warning('No texcoords: {} texcoord floats for {} vertex '
+                           'floats.', num_texcoord_floats, num_vertex_floats)
 
         va = glGenVertexArrays(1)
         vbos =  glGenBuffers(2)
 
         attrib_locs = [
-                glGetAttribLocation(program.idt, 'in_pos'),
-                glGetAttribLocation(program.idt, 'in_texcoord')
+                attrib_location('in_pos'),
+                attrib_location('in_texcoord')
                 ]
 
-        glBindVertexArray(va[0])
+        bind_vao(va[0])
         for i in (0, 1):
-            assert attrib_locs[i] >= 0
             glBindBuffer(
                     GL_ARRAY_BUFFER, vbos[i])
-            glBufferData(
-                    GL_ARRAY_BUFFER, GLfloat,
-                    (vertices, texcoords)[i], GL_STATIC_DRAW)
+            buffer_data(
+                    GL_ARRAY_BUFFER, (vertices, texcoords)[i], GL_STATIC_DRAW)
             glVertexAttribPointer(
                     attrib_locs[i], (3, 2)[i], GL_FLOAT, GL_FALSE, 0, 0)
-            glEnableVertexAttribArray(i)
-        return RenderHandle(program, va[0], int(len(vertices) / 3))
+            glEnableVertexAttribArray(attrib_locs[i])
+        return RenderHandle(program, va[0], num_vertex_floats // 3, vbos)
+
+
+    @staticmethod
+    def from_interleaved(program, data, layout, indices=None):
+        '''All attributes in one VBO. layout is a list of
+        (attrib_name, num_floats) in the order they appear in each vertex:
+            [('in_pos', 3), ('in_color', 3), ('in_texcoord', 2)]
+        Every attribute needs an entry in ATTRIB_LOCATIONS.
+        data is a flat list of floats or a float32 buffer. If indices is given
+        the handle is indexed, like from_indexed_triangles.
+        '''
+        stride = sum(size for _, size in layout)
+        total = num_floats(data)
+        assert total % stride == 0
+        num_vertices = total // stride
+
+        va = glGenVertexArrays(1)
+        vbo = glGenBuffers(1)[0]
+        vbos = [vbo]
+
+        bind_vao(va[0])
+        glBindBuffer(GL_ARRAY_BUFFER, vbo)
+        buffer_data(GL_ARRAY_BUFFER, data, GL_STATIC_DRAW)
+        offset = 0
+        for name, size in layout:
+            loc = attrib_location(name)
+            glVertexAttribPointer(
+                    loc, size, GL_FLOAT, GL_FALSE,
+                    stride * FLOAT_SIZE, offset * FLOAT_SIZE)
+            glEnableVertexAttribArray(loc)
+            offset += size
+
+        handle = RenderHandle(program, va[0], num_vertices, vbos)
+        if indices is not None:
+            assert len(indices) % 3 == 0
+            index_type, ctype = index_type_for(num_vertices)
+            ebo = glGenBuffers(1)[0]
+            glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, ebo)
+            glBufferData(
+                    GL_ELEMENT_ARRAY_BUFFER, ctype, indices, GL_STATIC_DRAW)
+            vbos.append(ebo)
+            handle.num_elements = len(indices)
+            handle.index_type = index_type
+        bind_vao(0)
+        return handle
+
+
+class InstancedRenderHandle(RenderHandle):
+    '''A RenderHandle that is drawn num_instances times with a single call.
+    Per-instance attributes are interleaved in one buffer, described by
+    instance_attribs: a list of (attrib_name, num_floats) pairs, e.g.
+        [('in_axis', 3), ('in_angle', 1), ('in_translation', 3)]
+    Fill it every frame with update_instances().
+    '''
+    def __init__(self, program, vao, num_elements, vbos, instance_vbo, stride):
+        super(InstancedRenderHandle, self).__init__(
+                program, vao, num_elements, vbos)
+        self.instance_vbo = instance_vbo
+        self.stride = stride  # In floats.
+        self.num_instances = 0
+
+
+    @staticmethod
+    def from_triangles(program, vertices, colors, instance_attribs,
+                       indices=None, views=1):
+        '''views is the number of consecutive instances that read the same
+        instance data: 2 for render_universe_stereo.'''
+        if indices is None:
+            handle = RenderHandle.from_triangles(program, vertices, colors)
+        else:
+            handle = RenderHandle.from_indexed_triangles(
+                    program, vertices, colors, indices)
+        vbo = glGenBuffers(1)[0]
+        stride = sum(size for _, size in instance_attribs)
+
+        bind_vao(handle.vao)
+        glBindBuffer(GL_ARRAY_BUFFER, vbo)
+        offset = 0
+        for name, size in instance_attribs:
+            loc = attrib_location(name)
+            glVertexAttribPointer(
+                    loc, size, GL_FLOAT, GL_FALSE,
+                    stride * FLOAT_SIZE, offset * FLOAT_SIZE)
+            glEnableVertexAttribArray(loc)
+            glVertexAttribDivisor(loc, views)
+            offset += size
+        bind_vao(0)
+
+        instanced = InstancedRenderHandle(
+                program, handle.vao, handle.num_elements,
+                handle.vbos + [vbo], vbo, stride)
+        instanced.index_type = handle.index_type
+        return instanced
+
+
+    def update_instances(self, data):
+        '''data is a flat list of floats or a float32 buffer, self.stride
+        floats per instance.
+        Re-specifies the whole buffer so the driver can orphan the old one.
+        '''
+        assert num_floats(data) % self.stride == 0
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_vbo)
+        buffer_data(GL_ARRAY_BUFFER, data, GL_STREAM_DRAW)
+        self.num_instances = num_floats(data) // self.stride
+
+
+class DynamicRenderHandle(RenderHandle):
+    '''A RenderHandle whose vertices can be replaced every frame with
+    update(), e.g. from an agent's tick.
+    Attributes are interleaved as in from_interleaved; max_vertices bounds
+    what update() accepts. Two strategies keep updates from waiting on the
+    GPU:
+        'ring': the VBO holds num_regions copies of the mesh. Each update
+            writes the next region with glBufferSubData and moves self.first
+            there. A fence per region makes sure the GPU is done with a
+            region before it is written again.
+        'orphan': each update re-specifies the whole VBO, so the driver can
+            hand out fresh memory while the GPU still reads the old one.
+    '''
+    def __init__(self, program, layout, max_vertices,
+                 mode=GL_TRIANGLES, strategy='ring', num_regions=3):
+        assert strategy in ('ring', 'orphan')
+        self.stride = sum(size for _, size in layout)
+        self.max_vertices = max_vertices
+        self.strategy = strategy
+        self.num_regions = num_regions if strategy == 'ring' else 1
+        self.region = 0
+        self.fences = [None] * self.num_regions
+        self.stalls = 0  # Times update() had to wait for the GPU.
+
+        va = glGenVertexArrays(1)
+        vbo = glGenBuffers(1)[0]
+        super(DynamicRenderHandle, self).__init__(program, va[0], 0, [vbo])
+        self.mode = mode
+        self.vbo = vbo
+
+        bind_vao(self.vao)
+        glBindBuffer(GL_ARRAY_BUFFER, vbo)
+        self._allocate()
+        offset = 0
+        for name, size in layout:
+            loc = attrib_location(name)
+            glVertexAttribPointer(
+                    loc, size, GL_FLOAT, GL_FALSE,
+                    self.stride * FLOAT_SIZE, offset * FLOAT_SIZE)
+            glEnableVertexAttribArray(loc)
+            offset += size
+        bind_vao(0)
+
+
+    def _allocate(self):
+        # Raw form of glBufferData: byte size and a NULL pointer.
+        size = self.num_regions * self.max_vertices * self.stride * FLOAT_SIZE
+        glBufferData(GL_ARRAY_BUFFER, size, None, GL_STREAM_DRAW)
+
+
+    def update(self, data):
+        '''Replace the vertices. data is a flat list of floats or a float32
+        buffer, see buffer_data.'''
+        total = num_floats(data)
+        assert total % self.stride == 0
+        num_vertices = total // self.stride
+        assert num_vertices <= self.max_vertices
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.vbo)
+        if self.strategy == 'orphan':
+            self._allocate()
+            buffer_sub_data(GL_ARRAY_BUFFER, 0, data)
+        else:
+            # Everything drawn from the current region has been submitted.
+            self.fences[self.region] = glFenceSync(
+                    GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+            self.region = (self.region + 1) % self.num_regions
+            self._wait_for_region(self.region)
+            first = self.region * self.max_vertices
+            buffer_sub_data(GL_ARRAY_BUFFER, first * self.stride, data)
+            self.first = first
+        self.num_elements = num_vertices
+
+
+    def _wait_for_region(self, region):
+        fence = self.fences[region]
+        if fence is None:
+            return
+        status = glClientWaitSync(fence, 0, 0)
+        if status == GL_TIMEOUT_EXPIRED:
+            self.stalls += 1
+            glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, 10 ** 9)
+        glDeleteSync(fence)
+        self.fences[region] = None
+
+
+    def delete(self):
+        for fence in self.fences:
+            if fence is not None:
+                glDeleteSync(fence)
+        self.fences = [None] * self.num_regions
+        super(DynamicRenderHandle, self).delete()
+
+
+def index_type_for(num_vertices):
+    '''Returns (GL enum, ctype) of the smallest index type that can address
+    num_vertices vertices.'''
+    if num_vertices <= 0x10000:
+        return GL_UNSIGNED_SHORT, GLushort
+    return GL_UNSIGNED_INT, GLuint
+
+
+def weld_vertices(vertices, colors):
+    '''Merge identical (position, color) pairs of a flat triangle list.
+    Returns (vertices, colors, indices) for from_indexed_triangles.
+    '''
+    assert len(vertices) % 3 == 0
+    assert len(colors) == len(vertices)
+    seen = {}
+    out_vertices = []
+    out_colors = []
+    indices = []
+    for i in xrange(0, len(vertices), 3):
+        position = tuple(vertices[i:i + 3])
+        color = tuple(colors[i:i + 3])
+        key = position + color
+        index = seen.get(key)
+        if index is None:
+            index = len(seen)
+            seen[key] = index
+            out_vertices.extend(position)
+            out_colors.extend(color)
+        indices.append(index)
+    return out_vertices, out_colors, indices
+
+
+def mesh_key(vertices, *attribs):
+    '''Content hash of a mesh given as flat float lists.'''
+    h = hashlib.sha1()
+    for data in (vertices,) + attribs:
+        if not is_float32_buffer(data):
+            data = array('f', data)
+        h.update(data)
+        h.update(b'|')
+    return h.hexdigest()
+
+
+class MeshCache(object):
+    '''Shares RenderHandles between agents that use identical geometry, so N
+    agents cost one VAO and one upload.
+    Handles are reference counted; every acquire must be matched by a release.
+    The GL objects are freed when the last reference goes away.
+    '''
+    def __init__(self):
+        self._entries = {}  # (program idt, key) -> [handle, refcount]
+        self._keys = {}  # id(handle) -> (program idt, key)
+
+
+    def acquire(self, program, key, build):
+        '''Returns the handle cached under key for program. On a miss, build()
+        is called to create it. key is any hashable mesh identity, e.g. a
+        name like 'cube' or the result of mesh_key().
+        '''
+        full_key = (program.idt, key)
+        entry = self._entries.get(full_key)
+        if entry is None:
+            entry = [build(), 0]
+            self._entries[full_key] = entry
+            self._keys[id(entry[0])] = full_key
+        entry[1] += 1
+        return entry[0]
+
+
+    def acquire_triangles(self, program, vertices, colors):
+        '''Like RenderHandle.from_triangles, keyed by the content hash.'''
+        return self.acquire(
+                program, mesh_key(vertices, colors),
+                lambda: RenderHandle.from_triangles(program, vertices, colors))
+
+
+    def release(self, handle):
+        full_key = self._keys[id(handle)]
+        entry = self._entries[full_key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._entries[full_key]
+            del self._keys[id(handle)]
+            handle.delete()
+
+
+    def refcount(self, handle):
+        full_key = self._keys.get(id(handle))
+        if full_key is None:
+            return 0
+        return self._entries[full_key][1]
+
+
+    def num_buffers(self):
+        '''Number of GL buffers owned by cached handles.'''
+        return sum(len(handle.vbos) for handle, _ in self._entries.values())
+
+
+MESH_CACHE = MeshCache()
 
 
 class RenderTexture(object):
@@ -170,7 +1107,7 @@ class RenderTexture(object):
         self.width = width
         self.height = height
 
-        logger.log('Generating RenderTexture')
+        logger.debug('Generating RenderTexture')
 
         # Create texture (RGBA8 is the convention for Larch)
         glActiveTexture(GL_TEXTURE0)
@@ -222,8 +1159,35 @@ class RenderTexture(object):
         glBindRenderbuffer(GL_RENDERBUFFER, 0)
 
 
+class RenderTexturePool(object):
+    '''count RenderTextures of width x height, all created up front, so that
+    nothing is allocated while rendering. acquire() hands them out in turn;
+    with two, a frame is drawn into another texture than the one the last
+    frame's post-process reads.
+    Draw into a smaller part of one with glViewport to lower the resolution,
+    see resolution.scaled_viewport.
+    '''
+    def __init__(self, width, height, count=2):
+        self.width = width
+        self.height = height
+        self.textures = [RenderTexture(width, height) for _ in range(count)]
+        self._next = 0
+
+
+    def acquire(self):
+        texture = self.textures[self._next]
+        self._next = (self._next + 1) % len(self.textures)
+        return texture
+
+
 # Got most of this from Beige: ================================
 def print_shader_log(shader, name):
+    '''Waits for shader to compile. The source and log are only fetched if
+    it failed.'''
+    if glGetShaderiv(shader, GL_COMPILE_STATUS) == GL_TRUE:
+        logger.debug('Compilation of {0} succeeded.', name)
+        return
+
     shader_type = {
         0 : 'unknown shader type',
         GL_VERTEX_SHADER : 'vertex shader',
@@ -231,31 +1195,21 @@ def print_shader_log(shader, name):
         GL_GEOMETRY_SHADER : 'geometry shader',
     }[glGetShaderiv(shader, GL_SHADER_TYPE)]
 
-    judgement, logfunc = {
-        GL_TRUE : ('succeeded',logger.log),
-        GL_FALSE : ('FAILED',logger.nonfatal_error)
-    }[glGetShaderiv(shader, GL_COMPILE_STATUS)]
-
-    logfunc('Compilation of {0} for {1} {2}:'.format(
-        shader_type, name, judgement))
-
+    # One message, so that the report isn't interleaved or rate limited.
+    lines = ['Compilation of {0} for {1} FAILED:'.format(shader_type, name)]
     source = glGetShaderSource(shader)
     msglog = glGetShaderInfoLog(shader)
-    map_source_to_log(source, msglog, logfunc)
+    map_source_to_log(source, msglog, lines.append)
+    logger.nonfatal_error('\n'.join(lines))
 
 
 def print_program_log(program, name):
-    judgement, logfunc = {
-        GL_TRUE : ('succeeded',logger.log),
-        GL_FALSE : ('FAILED',logger.error)
-    }[glGetProgramiv(program, GL_LINK_STATUS)]
-
-    logfunc('Compilation of program for {0} {1}:'.format(
-        name, judgement))
-
-    msglog = glGetProgramInfoLog(program)
-    for line in msglog.split('\n'):
-        logfunc(line)
+    '''Exits if program failed to link.'''
+    if glGetProgramiv(program, GL_LINK_STATUS) == GL_TRUE:
+        logger.debug('Compilation of program for {0} succeeded.', name)
+        return
+    logger.error('Compilation of program for {0} FAILED:\n{1}', name,
+                 glGetProgramInfoLog(program))
 
 
 # how much source code lines to display before shader error line
@@ -0,0 +1,77 @@
+'''Dynamic resolution: draw the frame into a smaller part of the render
+target when the GPU can't keep up with the display, and grow it back when
+it can. Pixel cost goes with the area, i.e. with the square of the scale.
+'''
+from __future__ import (print_function, division, absolute_import)
+
+
+from math import sqrt
+
+from timing import TimestampQueries
+
+
+class ResolutionScaler(object):
+    '''Keeps the GPU time of a frame under headroom * frame_budget seconds.
+    When over, the scale drops at once to what should fit; when under
+    raise_below * frame_budget, it grows by step per frame. The gap between
+    the two keeps it from oscillating.
+    '''
+    def __init__(self, frame_budget, min_scale=0.5, max_scale=1.0,
+                 headroom=0.9, raise_below=0.75, step=0.02):
+        self.frame_budget = frame_budget
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.headroom = headroom
+        self.raise_below = raise_below
+        self.step = step
+        self.scale = max_scale
+
+
+    def update(self, gpu_seconds):
+        '''Call with the GPU time of each measured frame. Returns the scale
+        for the next frame.'''
+        target = self.headroom * self.frame_budget
+        if gpu_seconds > target:
+            scale = self.scale * sqrt(target / gpu_seconds)
+        elif gpu_seconds < self.raise_below * self.frame_budget:
+            scale = self.scale + self.step
+        else:
+            return self.scale
+        self.scale = min(max(scale, self.min_scale), self.max_scale)
+        return self.scale
+
+
+def scaled_viewport(width, height, scale):
+    '''Returns ((w, h), frame_scale): the size of the part of a width x
+    height target to draw into at scale, and that size as a fraction of the
+    target, by which full frame texture coordinates are multiplied.
+    w is even so that both eyes get the same width.'''
+    w = max(2, int(round(width * scale / 2)) * 2)
+    h = max(1, int(round(height * scale)))
+    return (w, h), (w / width, h / height)
+
+
+class GPUFrameTimer(object):
+    '''GPU time between begin() and end(), read back up to latency frames
+    later, see timing.TimestampQueries.
+    '''
+    def __init__(self, latency=3):
+        self.timestamps = TimestampQueries(latency)
+        self._start = None
+
+
+    def begin(self):
+        self._start = self.timestamps.query()
+
+
+    def end(self):
+        '''Returns the GPU seconds of the newest finished frame, or None if
+        no frame finished since the last call.'''
+        self.timestamps.end_frame(
+                None, [('frame', self._start, self.timestamps.query())])
+        self._start = None
+        done = self.timestamps.collect()
+        if not done:
+            return None
+        _, times = done[-1]
+        return times[0][1]
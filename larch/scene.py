@@ -0,0 +1,194 @@
+'''Scene graph: agents placed relative to a parent.
+Needs numpy. The local and world matrices of all nodes of a SceneGraph live
+in two float32 arrays, 16 floats per node in column-major order (see
+transforms.model_matrix).
+update() recomputes the world matrices of the nodes whose local transform
+changed and of everything below them, one depth level at a time. The graph
+is drawn with one instanced draw per mesh, whose instance data are the
+world matrices of the nodes with that mesh, uploaded only when they
+changed. A frame in which nothing moved costs nothing but the draws.
+'''
+from __future__ import (print_function, division, absolute_import)
+
+
+from collections import OrderedDict
+
+from transforms import model_matrix, numpy
+from universe import Agent
+
+
+IDENTITY = (1.0, 0.0, 0.0, 0.0,
+            0.0, 1.0, 0.0, 0.0,
+            0.0, 0.0, 1.0, 0.0,
+            0.0, 0.0, 0.0, 1.0)
+
+
+class SceneGraph(Agent):
+    '''Nodes are numbered in the order they are added. A parent is added
+    before its children, so it always has the lower index.
+    Add the graph to a universe to draw it; its nodes draw nothing
+    themselves. A mesh is an InstancedRenderHandle built with
+    primitive.MODEL_INSTANCE_ATTRIBS for a model_matrix program, see
+    primitive.PrimitiveProgram.
+    '''
+    def __init__(self, capacity=1024):
+        if numpy is None:
+            raise ImportError('SceneGraph needs numpy.')
+        self.count = 0
+        self.local = numpy.zeros((capacity, 16), numpy.float32)
+        self.world = numpy.zeros((capacity, 16), numpy.float32)
+        self.parent = numpy.zeros(capacity, numpy.intp)  # -1 for roots.
+        self.depth = numpy.zeros(capacity, numpy.intp)
+        self.children = []  # Child indices of each node.
+        self.nodes = []
+        self.updated = 0  # Nodes recomputed by the last update().
+        self._moved = []  # Nodes whose local matrix changed since update().
+        self.meshes = OrderedDict()  # mesh -> indices of its nodes
+        self._batches = None  # [(mesh, slice or index array)]
+        self._version = 0  # Bumped whenever world changes.
+        self._uploaded = {}  # mesh -> _version of its instance data
+
+
+    def add(self, node, parent=None, mesh=None):
+        '''Add node below parent, a node of this graph or None for a root.
+        Its local matrix is the identity, and it is drawn with mesh, if
+        any. Returns its index.'''
+        if self.count == len(self.local):
+            self._grow()
+        index = self.count
+        self.count += 1
+        self.local[index] = IDENTITY
+        if parent is None:
+            self.parent[index] = -1
+            self.depth[index] = 0
+        else:
+            self.parent[index] = parent.index
+            self.depth[index] = self.depth[parent.index] + 1
+            self.children[parent.index].append(index)
+        self.children.append([])
+        self.nodes.append(node)
+        self._moved.append(index)
+        if mesh is not None:
+            self.meshes.setdefault(mesh, []).append(index)
+            self._batches = None
+        return index
+
+
+    def _grow(self):
+        capacity = 2 * len(self.local)
+        n = self.count
+        for name in ('local', 'world', 'parent', 'depth'):
+            old = getattr(self, name)
+            new = numpy.zeros((capacity,) + old.shape[1:], old.dtype)
+            new[:n] = old[:n]
+            setattr(self, name, new)
+
+
+    def set_local(self, index, matrix):
+        '''matrix is 16 floats in column-major order.'''
+        self.local[index] = matrix
+        self._moved.append(index)
+
+
+    def update(self):
+        '''Recompute the world matrices that the local changes since the
+        last update() affect. Returns the number of nodes recomputed.'''
+        moved = self._moved
+        if not moved:
+            self.updated = 0
+            return 0
+        self._moved = []
+        children = self.children
+        dirty = list(moved)
+        stack = list(moved)
+        while stack:
+            below = children[stack.pop()]
+            if below:
+                dirty.extend(below)
+                stack.extend(below)
+        dirty = numpy.unique(numpy.asarray(dirty, numpy.intp))
+        depth = self.depth[dirty]
+        order = numpy.argsort(depth, kind='mergesort')
+        dirty = dirty[order]
+        depth = depth[order]
+
+        # Stored column-major, a (4, 4) view is the transpose, so
+        # parent * local is matmul(local, parent).
+        local = self.local.reshape(-1, 4, 4)
+        world = self.world.reshape(-1, 4, 4)
+        levels = numpy.split(dirty, numpy.flatnonzero(numpy.diff(depth)) + 1)
+        for level in levels:
+            if self.depth[level[0]] == 0:
+                world[level] = local[level]
+            else:
+                world[level] = numpy.matmul(local[level],
+                                            world[self.parent[level]])
+        self.updated = len(dirty)
+        self._version += 1
+        return self.updated
+
+
+    def _get_batches(self):
+        batches = self._batches
+        if batches is None:
+            batches = []
+            for mesh, indices in self.meshes.items():
+                first, last = indices[0], indices[-1]
+                if last - first + 1 == len(indices):
+                    # Nodes added in a row upload as a view, without a copy.
+                    rows = slice(first, last + 1)
+                else:
+                    rows = numpy.asarray(indices, numpy.intp)
+                batches.append((mesh, rows))
+            self._batches = batches
+        return batches
+
+
+    def get_render_handles(self):
+        '''update() and one instanced handle per mesh.'''
+        self.update()
+        version = self._version
+        uploaded = self._uploaded
+        world = self.world
+        handles = []
+        for mesh, rows in self._get_batches():
+            if uploaded.get(mesh) != version:
+                mesh.update_instances(world[rows])
+                uploaded[mesh] = version
+            handles.append(mesh)
+        return handles
+
+
+class SceneNode(Agent):
+    '''An agent in a SceneGraph. Its transform is relative to parent, a
+    SceneNode of the same graph or None. The graph draws mesh, see
+    SceneGraph, with the node's world matrix.
+    '''
+    def __init__(self, graph, parent=None, mesh=None):
+        self.graph = graph
+        self.parent = parent
+        self.children = []
+        self.mesh = mesh
+        self.index = graph.add(self, parent, mesh)
+        if parent is not None:
+            parent.children.append(self)
+
+
+    @property
+    def local(self):
+        return self.graph.local[self.index]
+
+
+    def set_local(self, matrix):
+        self.graph.set_local(self.index, matrix)
+
+
+    def set_transform(self, rotation, translation):
+        '''Like Primitive: rotation is (axis, angle).'''
+        self.graph.set_local(self.index, model_matrix(rotation, translation))
+
+
+    @property
+    def world(self):
+        '''As of the last SceneGraph.update().'''
+        return self.graph.world[self.index]
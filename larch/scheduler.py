@@ -0,0 +1,77 @@
+'''Fixed timestep simulation.
+The simulation advances in steps of exactly `step` seconds, however often and
+irregularly frames arrive. What is left over is returned as alpha, the
+fraction of a step between the last two simulation states, so that rendering
+can interpolate.
+'''
+from __future__ import (print_function, division, absolute_import)
+
+
+import time
+
+
+class FixedStepScheduler(object):
+    def __init__(self, tick, step, max_steps=5):
+        '''tick(dt) advances the simulation, it is always called with step.
+        At most max_steps ticks run per advance(); if the simulation falls
+        further behind than that, the backlog is dropped instead of making
+        the next frame even later.
+        '''
+        self.tick = tick
+        self.step = step
+        self.max_steps = max_steps
+        self.accumulator = 0.0
+        self.ticks = 0
+        self.dropped = 0.0  # Seconds of simulation skipped to catch up.
+
+
+    def advance(self, elapsed):
+        '''Call once per frame with the seconds since the last call.
+        Returns alpha.'''
+        self.accumulator += elapsed
+        steps = 0
+        while self.accumulator >= self.step:
+            if steps == self.max_steps:
+                # The epsilon keeps float error from leaving a whole step.
+                backlog = int(self.accumulator / self.step + 1e-6) * self.step
+                self.dropped += backlog
+                self.accumulator = max(self.accumulator - backlog, 0.0)
+                break
+            self.tick(self.step)
+            self.accumulator -= self.step
+            self.ticks += 1
+            steps += 1
+        return self.alpha
+
+
+    @property
+    def alpha(self):
+        return self.accumulator / self.step
+
+
+def run_headless(scheduler, duration, frame_interval, draw=None,
+                 clock=time.time, sleep=time.sleep):
+    '''Drive scheduler the way the pyglet loop does, without a window: a
+    frame every frame_interval seconds, sleeping in between.
+    draw(alpha) is called once per frame. Returns the number of frames.
+    '''
+    start = last = clock()
+    next_frame = start
+    frames = 0
+    while True:
+        now = clock()
+        if now - start >= duration:
+            break
+        if now < next_frame:
+            sleep(next_frame - now)
+            continue
+        alpha = scheduler.advance(now - last)
+        last = now
+        if draw is not None:
+            draw(alpha)
+        frames += 1
+        next_frame += frame_interval
+        if next_frame < now:
+            # Running late. Don't try to make up frames in a burst.
+            next_frame = now
+    return frames
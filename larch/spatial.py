@@ -0,0 +1,213 @@
+'''Spatial index for agents and frustum culling.
+Agents are indexed by a bounding sphere: (center, radius).
+'''
+from __future__ import (print_function, division, absolute_import)
+
+
+from math import sqrt
+
+
+class Frustum(object):
+    '''Six planes (a, b, c, d), normalized so that a*x + b*y + c*z + d is the
+    signed distance of a point, positive inside.
+    '''
+    def __init__(self, planes):
+        self.planes = planes
+
+
+    @staticmethod
+    def from_matrix(m):
+        '''m is a flat, column-major clip matrix (projection * view), as
+        returned by mat4x4.to_c_array().
+        '''
+        rows = [(m[i], m[4 + i], m[8 + i], m[12 + i]) for i in xrange(4)]
+        planes = []
+        for i in xrange(3):
+            for sign in (1, -1):
+                plane = [rows[3][k] + sign * rows[i][k] for k in xrange(4)]
+                length = sqrt(plane[0] ** 2 + plane[1] ** 2 + plane[2] ** 2)
+                planes.append(tuple(p / length for p in plane))
+        return Frustum(planes)
+
+
+    def intersects_sphere(self, center, radius):
+        x, y, z = center
+        for a, b, c, d in self.planes:
+            if a * x + b * y + c * z + d < -radius:
+                return False
+        return True
+
+
+    def classify_box(self, center, half_size):
+        '''Returns OUTSIDE, INSIDE or INTERSECTING for an axis aligned cube.'''
+        x, y, z = center
+        result = INSIDE
+        for a, b, c, d in self.planes:
+            dist = a * x + b * y + c * z + d
+            extent = half_size * (abs(a) + abs(b) + abs(c))
+            if dist < -extent:
+                return OUTSIDE
+            if dist < extent:
+                result = INTERSECTING
+        return result
+
+
+OUTSIDE, INSIDE, INTERSECTING = range(3)
+
+
+class FrustumUnion(object):
+    '''What any of several frusta can see, e.g. both eyes of a single pass
+    stereo draw. Has the same tests as Frustum.'''
+    def __init__(self, frusta):
+        self.frusta = frusta
+
+
+    def intersects_sphere(self, center, radius):
+        for frustum in self.frusta:
+            if frustum.intersects_sphere(center, radius):
+                return True
+        return False
+
+
+    def classify_box(self, center, half_size):
+        result = OUTSIDE
+        for frustum in self.frusta:
+            inside = frustum.classify_box(center, half_size)
+            if inside == INSIDE:
+                return INSIDE
+            if inside == INTERSECTING:
+                result = INTERSECTING
+        return result
+
+
+class _Node(object):
+    __slots__ = ('center', 'half_size', 'depth', 'children', 'objects')
+
+    def __init__(self, center, half_size, depth):
+        self.center = center
+        self.half_size = half_size
+        self.depth = depth
+        self.children = None  # Created lazily, list of 8.
+        self.objects = {}  # agent -> (center, radius)
+
+
+    def loose_fits(self, center, radius):
+        return loose_fits(self.center, self.half_size, center, radius)
+
+
+    def child_index(self, center):
+        c = self.center
+        return ((center[0] >= c[0]) |
+                (center[1] >= c[1]) << 1 |
+                (center[2] >= c[2]) << 2)
+
+
+    def child_center(self, index):
+        c = self.center
+        h = self.half_size / 2
+        return (c[0] + (h if index & 1 else -h),
+                c[1] + (h if index & 2 else -h),
+                c[2] + (h if index & 4 else -h))
+
+
+    def child(self, index):
+        if self.children is None:
+            self.children = [None] * 8
+        child = self.children[index]
+        if child is None:
+            child = _Node(self.child_center(index), self.half_size / 2,
+                          self.depth + 1)
+            self.children[index] = child
+        return child
+
+
+def loose_fits(cell_center, half_size, center, radius):
+    '''Loose bounds are twice the size of the cell.'''
+    limit = 2 * half_size - radius
+    return (abs(center[0] - cell_center[0]) <= limit and
+            abs(center[1] - cell_center[1]) <= limit and
+            abs(center[2] - cell_center[2]) <= limit)
+
+
+class LooseOctree(object):
+    '''Loose octree over bounding spheres.
+    An object lives in the deepest cell that holds its center and whose
+    loose bounds (twice the cell) hold the whole sphere, so finding its cell
+    needs no search and a small move rarely changes cells.
+    Objects outside the root cell are kept in the root.
+    '''
+    def __init__(self, center=(0.0, 0.0, 0.0), half_size=64.0, max_depth=6):
+        self.root = _Node(tuple(center), half_size, 0)
+        self.max_depth = max_depth
+        self.locations = {}  # agent -> _Node
+        self.nodes_visited = 0  # By the last query.
+
+
+    def __len__(self):
+        return len(self.locations)
+
+
+    def insert(self, agent, center, radius):
+        node = self.root
+        while node.depth < self.max_depth and radius <= node.half_size / 2:
+            index = node.child_index(center)
+            if not loose_fits(node.child_center(index), node.half_size / 2,
+                              center, radius):
+                break
+            node = node.child(index)
+        node.objects[agent] = (center, radius)
+        self.locations[agent] = node
+
+
+    def remove(self, agent):
+        node = self.locations.pop(agent)
+        del node.objects[agent]
+
+
+    def update(self, agent, center, radius):
+        '''Call when an agent moved. Cheap if it is still inside the loose
+        bounds of its cell.'''
+        node = self.locations[agent]
+        if node is not self.root and node.loose_fits(center, radius):
+            node.objects[agent] = (center, radius)
+        else:
+            del node.objects[agent]
+            self.insert(agent, center, radius)
+
+
+    def query(self, frustum):
+        '''Returns the agents whose sphere intersects frustum.'''
+        self.nodes_visited = 0
+        result = []
+        self._query(self.root, frustum, result)
+        return result
+
+
+    def _query(self, node, frustum, result):
+        self.nodes_visited += 1
+        if node is self.root:
+            # The root also holds everything outside of it.
+            inside = INTERSECTING
+        else:
+            inside = frustum.classify_box(node.center, 2 * node.half_size)
+            if inside == OUTSIDE:
+                return
+        if inside == INSIDE:
+            self._collect(node, result)
+            return
+        for agent, (center, radius) in node.objects.items():
+            if frustum.intersects_sphere(center, radius):
+                result.append(agent)
+        if node.children is not None:
+            for child in node.children:
+                if child is not None:
+                    self._query(child, frustum, result)
+
+
+    def _collect(self, node, result):
+        result.extend(node.objects)
+        if node.children is not None:
+            for child in node.children:
+                if child is not None:
+                    self.nodes_visited += 1
+                    self._collect(child, result)
@@ -0,0 +1,300 @@
+'''Frame timing: summaries of measured times, the headless benchmark
+behind `python larch --game <name> --bench N`, FrameProfiler, which
+times the parts of every frame of a running interface, and TimestampQueries,
+the GPU timer both it and resolution.GPUFrameTimer read.
+'''
+from __future__ import (print_function, division, absolute_import)
+
+
+import csv
+import json
+from collections import deque
+from math import ceil
+from timeit import default_timer
+
+from gl import (glGenQueries, glQueryCounter, glGetQueryObjectiv,
+                glGetQueryObjectui64v, GL_TIMESTAMP, GL_QUERY_RESULT,
+                GL_QUERY_RESULT_AVAILABLE)
+
+import render
+
+
+PHASES = ('tick', 'collect', 'submit')
+
+
+def percentile(sorted_values, fraction):
+    '''Nearest rank percentile of an ascending list, e.g. fraction 0.99.'''
+    rank = int(ceil(fraction * len(sorted_values)))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def summarize(times):
+    '''times in seconds. Returns {'min', 'median', 'p99'} in milliseconds.'''
+    times = sorted(times)
+    return {'min': times[0] * 1000,
+            'median': percentile(times, 0.5) * 1000,
+            'p99': percentile(times, 0.99) * 1000}
+
+
+def bench(game_class, frames, warmup=10, clock=default_timer):
+    '''Run game_class, a game built on interface.HeadlessInterface, for
+    warmup + frames frames. Returns a dict ready for json.dump with a
+    summary of each of PHASES and of their total, over the last frames
+    frames.
+    '''
+    samples = []
+    with game_class() as game:
+        for i in xrange(warmup + frames):
+            sample = game.frame(clock)
+            if i >= warmup:
+                samples.append(sample)
+    result = {'frames': frames}
+    for index, phase in enumerate(PHASES):
+        result[phase] = summarize([sample[index] for sample in samples])
+    result['total'] = summarize([sum(sample) for sample in samples])
+    return result
+
+
+class RingBuffer(object):
+    '''Keeps the last capacity items appended.'''
+    def __init__(self, capacity):
+        self.items = [None] * capacity
+        self.next = 0
+        self.count = 0
+
+
+    def __len__(self):
+        return self.count
+
+
+    def append(self, item):
+        self.items[self.next] = item
+        self.next = (self.next + 1) % len(self.items)
+        self.count = min(self.count + 1, len(self.items))
+
+
+    def to_list(self):
+        '''Oldest first.'''
+        if self.count < len(self.items):
+            return self.items[:self.count]
+        return self.items[self.next:] + self.items[:self.next]
+
+
+class TimestampQueries(object):
+    '''GL_TIMESTAMP queries of the frames in flight. A frame is read back
+    once its last query is available, or when it is more than latency
+    frames behind, so that reading never waits for the GPU unless it is
+    that far behind.
+    '''
+    def __init__(self, latency=3):
+        self.latency = latency
+        self._in_flight = deque()  # (frame, spans) awaiting their results
+        self._free_queries = []
+
+
+    def __len__(self):
+        'Frames in flight.'
+        return len(self._in_flight)
+
+
+    def query(self):
+        '''Returns a query that records the GPU time once the commands
+        issued so far are done.'''
+        if not self._free_queries:
+            self._free_queries.extend(glGenQueries(16))
+        query = self._free_queries.pop()
+        glQueryCounter(query, GL_TIMESTAMP)
+        return query
+
+
+    def end_frame(self, frame, spans):
+        '''frame is anything to hand back with the results. spans is a
+        list of (key, start query, end query), the last one issued last.'''
+        self._in_flight.append((frame, spans))
+
+
+    def collect(self):
+        '''Returns [(frame, [(key, seconds)])] of the frames read back since
+        the last call, oldest first.'''
+        done = []
+        # Queries complete in order, so a frame is done when its last one
+        # is. Only more than latency frames behind is it worth waiting for.
+        in_flight = self._in_flight
+        while in_flight:
+            frame, spans = in_flight[0]
+            if (len(in_flight) <= self.latency and not glGetQueryObjectiv(
+                    spans[-1][2], GL_QUERY_RESULT_AVAILABLE)):
+                break
+            in_flight.popleft()
+            times = []
+            for key, start, end in spans:
+                nanoseconds = (glGetQueryObjectui64v(end, GL_QUERY_RESULT) -
+                               glGetQueryObjectui64v(start, GL_QUERY_RESULT))
+                times.append((key, nanoseconds / 10 ** 9))
+                self._free_queries.extend((start, end))
+            done.append((frame, times))
+        return done
+
+
+# Timed sections: (name, whether it issues GL commands worth a GPU timer).
+SECTIONS = (('tick', False),
+            ('render_prelude', True),
+            ('draw_handles', True),
+            ('postprocess', True))
+
+
+class FrameProfiler(object):
+    '''Times the sections of every frame of an interface: CPU time with
+    clock, GPU time with GL_TIMESTAMP queries read back latency frames
+    later, so that reading them never waits for the GPU.
+    attach() wraps Interface.tick, Universe.render_prelude,
+    render.draw_handles and the OVR post-process; detach() restores them.
+    Nothing is wrapped while detached, so it costs nothing.
+    A section called from inside another one counts for the outer one.
+
+    Each frame is a dict with 'frame', 'frame_cpu' and '<section>_cpu' /
+    '<section>_gpu' in milliseconds; _gpu is None without GPU timing. The
+    last capacity frames are kept, see frames() and summary().
+    '''
+    def __init__(self, capacity=1000, gpu=True, latency=3,
+                 clock=default_timer):
+        self.frames_kept = RingBuffer(capacity)
+        self.gpu = gpu
+        self.clock = clock
+        self.frame_count = 0
+        self._patched = []  # (owner, attribute name, original or None)
+        self._interface = None
+        self._active = None  # Name of the section being timed.
+        self._cpu = {}
+        self._queries = []  # (section name, start query, end query)
+        self._timestamps = TimestampQueries(latency)
+
+
+    def attach(self, interface):
+        '''Call after the interface has entered, i.e. has a universe.'''
+        assert not self._patched
+        self._wrap(interface, 'tick', 'tick')
+        if interface.scheduler is not None:
+            # The scheduler holds on to the unwrapped bound method.
+            interface.scheduler.tick = interface.tick
+        self._wrap(interface.universe, 'render_prelude', 'render_prelude')
+        self._wrap(render, 'draw_handles', 'draw_handles')
+        if hasattr(interface, '_postprocess'):
+            self._wrap(interface, '_postprocess', 'postprocess')
+        original = interface._draw
+        profiler = self
+
+        def draw(*args, **kwargs):
+            start = profiler.clock()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                profiler._end_frame(profiler.clock() - start)
+        self._replace(interface, '_draw', draw)
+        self._interface = interface
+
+
+    def detach(self):
+        for owner, name, original in reversed(self._patched):
+            if original is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+        self._patched = []
+        interface = self._interface
+        if interface.scheduler is not None:
+            interface.scheduler.tick = interface.tick
+        self._interface = None
+
+
+    def _replace(self, owner, name, function):
+        # Bound methods live on the class; only modules need the original
+        # put back.
+        original = getattr(owner, name) if name in vars(owner) else None
+        self._patched.append((owner, name, original))
+        setattr(owner, name, function)
+
+
+    def _wrap(self, owner, name, section):
+        original = getattr(owner, name)
+        gpu = self.gpu and dict(SECTIONS)[section]
+        profiler = self
+
+        def timed(*args, **kwargs):
+            if profiler._active is not None:
+                return original(*args, **kwargs)
+            profiler._active = section
+            if gpu:
+                start_query = profiler._timestamps.query()
+            start = profiler.clock()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                elapsed = profiler.clock() - start
+                if gpu:
+                    end_query = profiler._timestamps.query()
+                    profiler._queries.append(
+                            (section, start_query, end_query))
+                profiler._cpu[section] = (
+                        profiler._cpu.get(section, 0.0) + elapsed)
+                profiler._active = None
+        self._replace(owner, name, timed)
+
+
+    def _end_frame(self, frame_time):
+        frame = {'frame': self.frame_count, 'frame_cpu': frame_time * 1000}
+        for section, gpu in SECTIONS:
+            frame[section + '_cpu'] = self._cpu.get(section, 0.0) * 1000
+            frame[section + '_gpu'] = None
+        self.frame_count += 1
+        self._cpu = {}
+        if self._queries:
+            self._timestamps.end_frame(frame, self._queries)
+            self._queries = []
+        else:
+            self.frames_kept.append(frame)
+        for frame, times in self._timestamps.collect():
+            for section, seconds in times:
+                key = section + '_gpu'
+                frame[key] = (frame[key] or 0.0) + seconds * 1000
+            self.frames_kept.append(frame)
+
+
+    def frames(self):
+        '''The kept frames, oldest first. Up to latency recent frames may
+        still be waiting for their GPU times and are not included.'''
+        return self.frames_kept.to_list()
+
+
+    def columns(self):
+        columns = ['frame', 'frame_cpu']
+        for section, _ in SECTIONS:
+            columns.extend((section + '_cpu', section + '_gpu'))
+        return columns
+
+
+    def summary(self):
+        '''{column: summarize() of it} over the kept frames, for the
+        columns that have values.'''
+        frames = self.frames()
+        result = {}
+        for column in self.columns()[1:]:
+            values = [f[column] / 1000 for f in frames
+                      if f[column] is not None]
+            if values:
+                result[column] = summarize(values)
+        return result
+
+
+    def dump(self, path):
+        '''Write the kept frames to path, as JSON if it ends in .json and
+        as CSV otherwise.'''
+        frames = self.frames()
+        with open(path, 'w') as f:
+            if path.endswith('.json'):
+                json.dump({'frames': frames, 'summary': self.summary()}, f,
+                          indent=2, sort_keys=True)
+            else:
+                writer = csv.DictWriter(f, self.columns())
+                writer.writeheader()
+                writer.writerows(frames)
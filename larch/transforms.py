@@ -0,0 +1,257 @@
+'''Structure-of-arrays storage for primitive transforms.
+Needs numpy. Primitives attached to a TransformStore keep their rotation and
+translation in its arrays, so simple motion advances in one vectorized step
+and the arrays can be uploaded as an instance buffer without copying.
+'''
+from __future__ import (print_function, division, absolute_import)
+
+
+from math import pi, floor, sin, cos, sqrt
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class TransformStore(object):
+    '''Rows of self.instances follow primitive.INSTANCE_ATTRIBS:
+    axis (3 floats), angle (1), translation (3). Rows [0, count) are live.
+    Each owner is told its row through its store_slot attribute, which is
+    updated when rows move.
+    '''
+    STRIDE = 7
+
+    def __init__(self, capacity=64):
+        if numpy is None:
+            raise ImportError('TransformStore needs numpy.')
+        self.count = 0
+        self.instances = numpy.zeros((capacity, self.STRIDE), numpy.float32)
+        # Rows as of the last save_previous(), for interpolation.
+        self.previous = numpy.zeros((capacity, self.STRIDE), numpy.float32)
+        self.angular_velocity = numpy.zeros(capacity, numpy.float32)
+        self.owners = []
+
+
+    def add(self, owner, rotation, translation, angular_velocity=0.0):
+        'Returns the row of owner.'
+        if self.count == len(self.instances):
+            self._grow()
+        slot = self.count
+        self.count += 1
+        self.owners.append(owner)
+        owner.store_slot = slot
+        self.set_rotation(slot, rotation)
+        self.set_translation(slot, translation)
+        self.angular_velocity[slot] = angular_velocity
+        self.previous[slot] = self.instances[slot]
+        return slot
+
+
+    def remove(self, slot):
+        'The last row moves into slot.'
+        last = self.count - 1
+        if slot != last:
+            self.instances[slot] = self.instances[last]
+            self.previous[slot] = self.previous[last]
+            self.angular_velocity[slot] = self.angular_velocity[last]
+            moved = self.owners[last]
+            self.owners[slot] = moved
+            moved.store_slot = slot
+        self.owners.pop()
+        self.count = last
+
+
+    def _grow(self):
+        capacity = 2 * len(self.instances)
+        instances = numpy.zeros((capacity, self.STRIDE), numpy.float32)
+        instances[:self.count] = self.instances[:self.count]
+        previous = numpy.zeros((capacity, self.STRIDE), numpy.float32)
+        previous[:self.count] = self.previous[:self.count]
+        angular_velocity = numpy.zeros(capacity, numpy.float32)
+        angular_velocity[:self.count] = self.angular_velocity[:self.count]
+        self.instances = instances
+        self.previous = previous
+        self.angular_velocity = angular_velocity
+
+
+    def save_previous(self):
+        '''Remember the current rows. Call before each simulation step when
+        rendering interpolates.'''
+        n = self.count
+        self.previous[:n] = self.instances[:n]
+
+
+    def tick(self, dt):
+        'Advance every angle by its angular velocity.'
+        n = self.count
+        angles = self.instances[:n, 3]
+        angles += self.angular_velocity[:n] * dt
+        numpy.fmod(angles, 2 * pi, out=angles)
+
+
+    def get_rotation(self, slot):
+        row = self.instances[slot]
+        return (float(row[0]), float(row[1]), float(row[2])), float(row[3])
+
+
+    def set_rotation(self, slot, rotation):
+        row = self.instances[slot]
+        row[0:3] = rotation[0]
+        row[3] = rotation[1]
+
+
+    def get_interpolated(self, slot, alpha):
+        '''(rotation, translation) of one row, see lerp_transform.'''
+        row = [float(x) for x in self.instance_data([slot], alpha)[0]]
+        return (tuple(row[0:3]), row[3]), tuple(row[4:7])
+
+
+    def get_translation(self, slot):
+        row = self.instances[slot]
+        return float(row[4]), float(row[5]), float(row[6])
+
+
+    def set_translation(self, slot, translation):
+        self.instances[slot, 4:7] = translation
+
+
+    def model_data(self, slots=None, alpha=1.0):
+        '''model_matrices of instance_data(slots, alpha).'''
+        return model_matrices(self.instance_data(slots, alpha))
+
+
+    def instance_data(self, slots=None, alpha=1.0):
+        '''Float32 rows ready for InstancedRenderHandle.update_instances.
+        Without slots and with alpha 1 this is a view of the live rows; no
+        copy is made. With alpha < 1 the rows are interpolated between
+        the previous and the current state.'''
+        if slots is None:
+            current = self.instances[:self.count]
+            previous = self.previous[:self.count]
+        else:
+            slots = numpy.asarray(slots, numpy.intp)
+            current = self.instances[slots]
+            previous = self.previous[slots]
+        if alpha >= 1.0:
+            return current
+        delta = current - previous
+        # Angles are wrapped by tick(); interpolate the short way around.
+        angle_delta = delta[:, 3]
+        angle_delta -= 2 * pi * numpy.round(angle_delta / (2 * pi))
+        return previous + delta * numpy.float32(alpha)
+
+
+def lerp_transform(previous, current, alpha):
+    '''Interpolate between two (rotation, translation) pairs, as kept by
+    Primitive. alpha is 0 at previous and 1 at current.
+    The axis is interpolated linearly, the shader normalizes it.
+    '''
+    (axis0, angle0), translation0 = previous
+    (axis1, angle1), translation1 = current
+    angle_delta = angle1 - angle0
+    angle_delta -= 2 * pi * floor(angle_delta / (2 * pi) + 0.5)
+    axis = tuple(a + (b - a) * alpha for a, b in zip(axis0, axis1))
+    translation = tuple(a + (b - a) * alpha
+                        for a, b in zip(translation0, translation1))
+    return (axis, angle0 + angle_delta * alpha), translation
+
+
+def model_matrix(rotation, translation):
+    '''translate * rotate as 16 floats in column-major order, the same
+    matrix PrimitiveProgram's rotation_matrix builds in the shader.'''
+    (x, y, z), angle = rotation
+    length = sqrt(x * x + y * y + z * z) or 1.0
+    x, y, z = x / length, y / length, z / length
+    s = sin(angle)
+    c = cos(angle)
+    oc = 1.0 - c
+    tx, ty, tz = translation
+    return (oc * x * x + c, oc * x * y - z * s, oc * z * x + y * s, 0.0,
+            oc * x * y + z * s, oc * y * y + c, oc * y * z - x * s, 0.0,
+            oc * z * x - y * s, oc * y * z + x * s, oc * z * z + c, 0.0,
+            tx, ty, tz, 1.0)
+
+
+def model_matrices(rows):
+    '''model_matrix of every row of a float32 (n, 7) array laid out like
+    TransformStore rows. Returns a float32 (n, 16) array.'''
+    n = len(rows)
+    axis = rows[:, 0:3]
+    length = numpy.sqrt((axis * axis).sum(axis=1))
+    length[length == 0] = 1.0
+    x, y, z = (axis / length[:, numpy.newaxis]).T
+    angle = rows[:, 3]
+    s = numpy.sin(angle)
+    c = numpy.cos(angle)
+    oc = 1.0 - c
+    out = numpy.zeros((n, 16), numpy.float32)
+    out[:, 0] = oc * x * x + c
+    out[:, 1] = oc * x * y - z * s
+    out[:, 2] = oc * z * x + y * s
+    out[:, 4] = oc * x * y + z * s
+    out[:, 5] = oc * y * y + c
+    out[:, 6] = oc * y * z - x * s
+    out[:, 8] = oc * z * x - y * s
+    out[:, 9] = oc * y * z + x * s
+    out[:, 10] = oc * z * z + c
+    out[:, 12:15] = rows[:, 4:7]
+    out[:, 15] = 1.0
+    return out
+
+
+class MatrixStack(object):
+    '''A stack of 4x4 matrices in one float32 block, see Universe.push.
+    Level 0 is the identity. push(mat) writes top * mat into the next level
+    and pop() moves back down; neither allocates unless the stack outgrows
+    its capacity, which is then doubled.
+    Matrices are 16 floats in column-major order, like
+    mat4x4.to_c_array(). levels[i] is level i as a (4, 4) view, i.e. the
+    transpose, so top * mat is numpy.dot(mat, top).
+    '''
+    def __init__(self, capacity=32):
+        if numpy is None:
+            raise ImportError('MatrixStack needs numpy.')
+        self.depth = 0
+        self.block = numpy.zeros((capacity, 16), numpy.float32)
+        self.block[0] = numpy.identity(4, numpy.float32).ravel()
+        self.levels = [row.reshape(4, 4) for row in self.block]
+
+
+    def _grow(self):
+        block = numpy.zeros((2 * len(self.block), 16), numpy.float32)
+        block[:len(self.block)] = self.block
+        self.block = block
+        self.levels = [row.reshape(4, 4) for row in block]
+
+
+    def push(self, mat):
+        '''mat is a glm mat4x4 or 16 floats in column-major order, flat or
+        (4, 4). A float32 numpy array is used without copying.'''
+        depth = self.depth + 1
+        if depth == len(self.levels):
+            self._grow()
+        if type(mat) is not numpy.ndarray or mat.dtype != numpy.float32:
+            if hasattr(mat, 'to_c_array'):
+                mat = tuple(mat.to_c_array())
+            mat = numpy.asarray(mat, numpy.float32)
+        if mat.ndim == 1:
+            mat = mat.reshape(4, 4)
+        levels = self.levels
+        numpy.dot(mat, levels[depth - 1], out=levels[depth])
+        self.depth = depth
+
+
+    def pop(self):
+        assert self.depth > 0
+        self.depth -= 1
+
+
+    def get(self, level):
+        '''The 16 floats of level, a view.'''
+        return self.block[level]
+
+
+    @property
+    def top(self):
+        return self.block[self.depth]
@@ -4,7 +4,54 @@ from __future__ import (print_function, division, absolute_import)
 from math import tan, atan
 
 from glm import mat4x4
-from interface import OVR_FRAME_SCALE
+import interface
+from transforms import MatrixStack, numpy
+
+
+# The HMDInfo fields hmd_projection depends on.
+HMD_PROJECTION_FIELDS = ('HResolution', 'VResolution', 'VScreenSize',
+                         'EyeToScreenDistance', 'LensSeparationDistance',
+                         'HScreenSize', 'InterpupillaryDistance')
+
+
+def mat4x4_from_c_array(values):
+    'Inverse of mat4x4.to_c_array(): 16 floats in column-major order.'
+    mat = mat4x4.zero()
+    for col in range(4):
+        for row in range(4):
+            setattr(mat, 'i{}{}'.format(col, row),
+                    float(values[4 * col + row]))
+    return mat
+
+
+class GLMMatrixStack(object):
+    '''transforms.MatrixStack on mat4x4s, for when numpy is missing. push()
+    allocates a mat4x4 and only takes mat4x4s.'''
+    def __init__(self):
+        self.matrices = [mat4x4.identity()]
+
+
+    @property
+    def depth(self):
+        return len(self.matrices) - 1
+
+
+    def push(self, mat):
+        self.matrices.append(self.matrices[-1].mul_mat4(mat))
+
+
+    def pop(self):
+        assert self.depth > 0
+        self.matrices.pop()
+
+
+    def get(self, level):
+        return self.matrices[level].to_c_array()
+
+
+    @property
+    def top(self):
+        return self.matrices[-1].to_c_array()
 
 
 class Agent(object):
@@ -22,6 +69,12 @@ class Agent(object):
         return []
 
 
+    def get_bounds(self):
+        '''Returns a bounding sphere (center, radius) used for culling, or
+        None if the agent is never culled.'''
+        return None
+
+
     def tick(self, dt):
         pass
 
@@ -33,27 +86,69 @@ class Universe(Agent):
     handles to return.
     """
     def __init__(self):
-        self.modelview = mat4x4.identity()
-        self.matstack = []
+        # Model view matrices, see push().
+        if numpy is not None:
+            self.matrices = MatrixStack()
+        else:
+            self.matrices = GLMMatrixStack()
         self.head = ()
         self.hmdinfo = None
         self.program = None
+        # Projection times eye offset, for culling. Set by setup_hmd_persp.
+        self.view_proj = None
+        # True if self.program can draw both eyes at once, see
+        # render.render_universe_stereo.
+        self.stereo = False
+        # (left, right) view_proj, set by setup_hmd_stereo.
+        self.stereo_view_proj = None
+        # eye -> (persp, eye_ipd, view_proj), see hmd_projection.
+        self.projections = {}
+        self.projection_key = None
+        # Fraction of a simulation step since the last tick, see
+        # set_interpolation.
+        self.alpha = 1.0
 
 
     def push(self, mat):
-        'Push current modelview and then multiply it by mat'
-        self.matstack.append(self.modelview)
-        self.modelview = self.modelview.mul_mat4(mat)
+        '''Push current modelview and then multiply it by mat, a mat4x4 or
+        16 floats in column-major order. The product is computed in place,
+        read it as self.matrices.top to avoid allocating.'''
+        self.matrices.push(mat)
 
 
     def pop(self):
-        self.modelview = self.matstack.pop()
+        self.matrices.pop()
+
+
+    @property
+    def modelview(self):
+        '''The top of the stack as a new mat4x4.'''
+        return mat4x4_from_c_array(self.matrices.top)
+
+
+    @property
+    def matstack(self):
+        '''The mat4x4s saved by push(), oldest first.'''
+        return [mat4x4_from_c_array(self.matrices.get(level))
+                for level in range(self.matrices.depth)]
+
+
+    def set_interpolation(self, alpha):
+        '''Called before drawing. tick() runs at a fixed rate, alpha says
+        how far the frame is between the last two ticks (0 to 1). A universe
+        may blend its agents' previous and current state by it.'''
+        self.alpha = alpha
 
 
     def render_prelude(self, eye):
-        """Setup opengl state for this universe"""
+        """Setup opengl state for this universe.
+        eye is 'left', 'right', 'center' or, for single pass stereo, 'stereo'.
+        """
         if self.hmdinfo:
-            self.setup_hmd_persp(eye, 0.01, 100)
+            if eye == 'stereo':
+                self.setup_hmd_stereo(0.01, 100)
+            else:
+                self.setup_hmd_persp(eye, 0.01, 100)
 
 
     def setup_hmd_persp(self, eye, znear, zfar):
@@ -61,13 +156,67 @@ class Universe(Agent):
         '''
         if self.hmdinfo is None:
             return
+        rift_persp, eye_ipd, self.view_proj = self.hmd_projection(
+                eye, znear, zfar)
+
+        self.program.set_uniform('eye_ipd', eye_ipd)
+        self.program.set_uniform('persp', rift_persp)
+
+
+    def setup_hmd_stereo(self, znear, zfar):
+        '''Both eyes at once. self.program must be built with
+        render.STEREO_SRC.'''
+        view_projs = []
+        for index, eye in enumerate(('left', 'right')):
+            rift_persp, eye_ipd, view_proj = self.hmd_projection(
+                    eye, znear, zfar)
+            self.program.set_uniform(
+                    'stereo_eye_ipd[{}]'.format(index), eye_ipd)
+            self.program.set_uniform(
+                    'stereo_persp[{}]'.format(index), rift_persp)
+            view_projs.append(view_proj)
+        self.stereo_view_proj = tuple(view_projs)
+
+
+    def hmd_projection(self, eye, znear, zfar):
+        '''Returns (perspective matrix, (eye_ipd,), view_proj) of eye for
+        the HMD. They only change with the HMD's HMD_PROJECTION_FIELDS,
+        znear, zfar and interface.OVR_FRAME_SCALE, so they are cached until
+        one of those does.'''
+        key = (tuple(getattr(self.hmdinfo, field)
+                     for field in HMD_PROJECTION_FIELDS),
+               znear, zfar, interface.OVR_FRAME_SCALE)
+        if key != self.projection_key:
+            self.invalidate_projections()
+            self.projection_key = key
+        projection = self.projections.get(eye)
+        if projection is None:
+            rift_persp, eye_ipd = self._compute_hmd_projection(
+                    eye, znear, zfar)
+            view_proj = rift_persp.mul_mat4(
+                    mat4x4.translation_fff(eye_ipd, 0, 0))
+            projection = rift_persp, (eye_ipd,), view_proj
+            self.projections[eye] = projection
+        return projection
+
+
+    def invalidate_projections(self):
+        '''Forget the cached HMD projections. Needed only when something
+        hmd_projection doesn't know about affects them.'''
+        self.projections = {}
+        self.projection_key = None
+
+
+    def _compute_hmd_projection(self, eye, znear, zfar):
+        '''Returns (perspective matrix, eye_ipd) of eye for the HMD.'''
         assert eye == 'left' or eye == 'right'
 
         rift_ar = self.hmdinfo.HResolution / (2 * self.hmdinfo.VResolution)
 
         v_size = self.hmdinfo.VScreenSize
         eye_to_screen = self.hmdinfo.EyeToScreenDistance
-        v_fov = 2 * atan(OVR_FRAME_SCALE * v_size / (2 * eye_to_screen))
+        v_fov = 2 * atan(interface.OVR_FRAME_SCALE * v_size /
+                         (2 * eye_to_screen))
 
         rift_persp = mat4x4.zero()
 
@@ -88,10 +237,10 @@ class Universe(Agent):
         if eye == 'right':
             translation_mat = mat4x4.translation_fff(-offset, 0, 0)
             rift_persp = translation_mat.mul_mat4(rift_persp)
-            self.program.set_uniform('eye_ipd', (-ipd / 2,))
+            eye_ipd = -ipd / 2
         elif eye == 'left':
             translation_mat = mat4x4.translation_fff(offset, 0, 0)
             rift_persp = translation_mat.mul_mat4(rift_persp)
-            self.program.set_uniform('eye_ipd', (ipd / 2,))
+            eye_ipd = ipd / 2
 
-        self.program.set_uniform('persp', rift_persp)
+        return rift_persp, eye_ipd
@@ -0,0 +1,180 @@
+'''Run a simulation in a worker process.
+The worker ticks at a fixed rate and publishes agent transforms into a
+shared-memory double buffer. The render side copies the latest complete
+snapshot whenever it likes, without taking a lock.
+'''
+from __future__ import (print_function, division, absolute_import)
+
+
+import ctypes
+import multiprocessing
+import time
+
+from scheduler import FixedStepScheduler
+
+
+# Header slots of SharedSnapshots.
+LATEST = 0
+SEQ = 1  # SEQ + buffer index
+COUNT = 3  # COUNT + buffer index
+TICKS = 5  # TICKS + buffer index
+HEADER_SIZE = 7
+
+
+class SharedSnapshots(object):
+    '''Two snapshot buffers of capacity rows of stride floats in shared
+    memory, written by one process and read by another.
+    Handoff:
+        The writer fills the buffer that is not LATEST. Its sequence number
+        is odd while it is being written and even otherwise. When done, the
+        writer makes it LATEST.
+        The reader copies LATEST and then checks that its sequence number is
+        even and unchanged. If not, the writer has lapped the reader and
+        reused the buffer mid-copy, and the reader tries again.
+    '''
+    def __init__(self, capacity, stride):
+        self.capacity = capacity
+        self.stride = stride
+        self.data = multiprocessing.RawArray(ctypes.c_float,
+                                             2 * capacity * stride)
+        self.header = multiprocessing.RawArray(ctypes.c_longlong, HEADER_SIZE)
+        self.header[LATEST] = -1
+
+
+    def publish(self, values, ticks):
+        '''Writer side. values is a flat sequence of floats, whole rows.'''
+        header = self.header
+        latest = header[LATEST]
+        buf = 0 if latest < 0 else 1 - latest
+        n = len(values)
+        assert n % self.stride == 0 and n <= self.capacity * self.stride
+        offset = buf * self.capacity * self.stride
+
+        header[SEQ + buf] += 1
+        self.data[offset:offset + n] = values
+        header[COUNT + buf] = n // self.stride
+        header[TICKS + buf] = ticks
+        header[SEQ + buf] += 1
+        header[LATEST] = buf
+
+
+    def read(self, out, last_ticks=None):
+        '''Reader side. Copies the latest snapshot into out, an array('f') or
+        float32 numpy array with room for capacity rows.
+        Returns (count, ticks), or None if there is no snapshot newer than
+        last_ticks.
+        '''
+        header = self.header
+        base = ctypes.addressof(self.data)
+        dest = _address(out)
+        while True:
+            buf = header[LATEST]
+            if buf < 0:
+                return None
+            seq = header[SEQ + buf]
+            if seq & 1:
+                continue
+            ticks = header[TICKS + buf]
+            if ticks == last_ticks:
+                return None
+            count = header[COUNT + buf]
+            offset = buf * self.capacity * self.stride
+            ctypes.memmove(dest, base + offset * 4, count * self.stride * 4)
+            if header[SEQ + buf] == seq:
+                return count, ticks
+
+
+def _address(out):
+    if hasattr(out, 'buffer_info'):  # array.array
+        assert out.typecode == 'f'
+        return out.buffer_info()[0]
+    assert out.dtype.char == 'f' and out.flags['C_CONTIGUOUS']
+    return out.ctypes.data
+
+
+def _simulate(make_simulation, shared, step, stop):
+    'Worker process main loop.'
+    simulation = make_simulation()
+    ticks = [0]
+
+    def tick(dt):
+        # Publish after every step, even when catching up.
+        simulation.tick(dt)
+        ticks[0] += 1
+        shared.publish(simulation.get_transforms(), ticks[0])
+
+    scheduler = FixedStepScheduler(tick, step)
+    shared.publish(simulation.get_transforms(), 0)
+    last = time.time()
+    while not stop.is_set():
+        now = time.time()
+        scheduler.advance(now - last)
+        last = now
+        time.sleep(max(0.0, step - scheduler.accumulator))
+
+
+class SimulationWorker(object):
+    '''Runs make_simulation() in a worker process and ticks it every step
+    seconds. The simulation needs:
+        tick(dt)
+        get_transforms(): flat float sequence of up to capacity rows of
+            stride floats.
+    make_simulation must be picklable (e.g. a module level class or a
+    functools.partial of one).
+    '''
+    def __init__(self, make_simulation, capacity, stride, step):
+        self.shared = SharedSnapshots(capacity, stride)
+        self.ticks = None  # Of the last snapshot read.
+        self._stop = multiprocessing.Event()
+        self.process = multiprocessing.Process(
+                target=_simulate,
+                args=(make_simulation, self.shared, step, self._stop))
+        self.process.daemon = True
+
+
+    def start(self):
+        self.process.start()
+
+
+    def stop(self):
+        self._stop.set()
+        self.process.join()
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+
+    def __exit__(self, t, value, traceback):
+        self.stop()
+
+
+    def read(self, out):
+        '''Copy the newest snapshot into out. Returns the number of rows, or
+        None if the worker hasn't published anything new.'''
+        result = self.shared.read(out, self.ticks)
+        if result is None:
+            return None
+        count, self.ticks = result
+        return count
+
+
+class PrimitiveSimulation(object):
+    '''Simulation side of PrimitiveUniverse.start_worker. Spins every
+    primitive by its angular velocity. Rows follow primitive.INSTANCE_ATTRIBS.
+    '''
+    def __init__(self, states):
+        'states is a list of (rotation, translation, angular_velocity).'
+        self.rows = [list(axis) + [angle] + list(translation)
+                     for (axis, angle), translation, _ in states]
+        self.velocities = [velocity for _, _, velocity in states]
+
+
+    def tick(self, dt):
+        for row, velocity in zip(self.rows, self.velocities):
+            row[3] += velocity * dt
+
+
+    def get_transforms(self):
+        return [x for row in self.rows for x in row]
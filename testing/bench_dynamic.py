@@ -0,0 +1,72 @@
+'''Updates per second of a moving line mesh: DynamicRenderHandle ('ring' and
+'orphan') against recreating the RenderHandle every update.'''
+from __future__ import (print_function, division, absolute_import)
+
+from benchutil import make_context
+
+import random
+import time
+from array import array
+
+from gl import glFinish, GL_LINES
+
+from games.triangle import make_simple_program
+import render
+
+
+NUM_LINES = 5000
+LAYOUT = [('in_pos', 3), ('in_color', 3)]
+SECONDS = 2.0
+
+
+def random_lines():
+    data = array('f')
+    for _ in xrange(NUM_LINES * 2):
+        data.extend((random.uniform(-1, 1), random.uniform(-1, 1), 0.0,
+                     0.0, 0.0, 0.0))
+    return data
+
+
+def updates_per_second(update):
+    frames = [random_lines() for _ in xrange(8)]
+    count = 0
+    t0 = time.time()
+    while time.time() - t0 < SECONDS:
+        update(frames[count % len(frames)])
+        count += 1
+    glFinish()
+    return count / (time.time() - t0)
+
+
+def main():
+    window = make_context()
+    program = make_simple_program()
+
+    handle = [None]
+
+    def recreate(data):
+        if handle[0] is not None:
+            handle[0].delete()
+        handle[0] = render.RenderHandle.from_interleaved(program, data, LAYOUT)
+        handle[0].mode = GL_LINES
+        render.draw_handles(handle)
+
+    print('{:<10} {:10.1f} updates/s'.format(
+        'recreate', updates_per_second(recreate)))
+
+    for strategy in ('ring', 'orphan'):
+        dynamic = render.DynamicRenderHandle(
+                program, LAYOUT, NUM_LINES * 2, GL_LINES, strategy)
+
+        def update(data):
+            dynamic.update(data)
+            render.draw_handles([dynamic])
+
+        print('{:<10} {:10.1f} updates/s, {} stalls'.format(
+            strategy, updates_per_second(update), dynamic.stalls))
+        dynamic.delete()
+    window.close()
+
+
+if __name__ == '__main__':
+    main()
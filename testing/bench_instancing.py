@@ -0,0 +1,60 @@
+'''Frame CPU time of PrimitiveUniverse with and without instancing, and
+with instancing fed from a TransformStore; each also with model matrices
+built on the CPU (model_matrix) instead of per vertex.'''
+from __future__ import (print_function, division, absolute_import)
+
+from benchutil import make_context, time_it, report
+
+import random
+
+from gl import glFinish
+
+import primitive
+import render
+
+
+MODES = [
+        {'instanced': False},
+        {'instanced': True},
+        {'instanced': True, 'transform_store': True},
+        {'instanced': False, 'model_matrix': True},
+        {'instanced': True, 'model_matrix': True},
+        {'instanced': True, 'transform_store': True, 'model_matrix': True},
+        ]
+
+
+def make_universe(num_cubes, mode):
+    model_matrix = mode.get('model_matrix', False)
+    if primitive.PROGRAM and primitive.PROGRAM.model_matrix != model_matrix:
+        primitive.PROGRAM = None
+        primitive.INSTANCED_PROGRAM = None
+    universe = primitive.PrimitiveUniverse(None, **mode)
+    for _ in xrange(num_cubes):
+        cube = primitive.Cube()
+        cube.angular_velocity = random.uniform(0, 3)
+        cube.translation = (random.uniform(-10, 10),
+                            random.uniform(-10, 10),
+                            random.uniform(-30, -5))
+        universe.attach_primitive(cube)
+    return universe
+
+
+def main():
+    window = make_context()
+    for num_cubes in (100, 1000, 10000):
+        for mode in MODES:
+            universe = make_universe(num_cubes, mode)
+
+            def frame():
+                universe.tick(1 / 60)
+                render.render_universe(universe, 'center')
+                glFinish()
+
+            frame()  # Warm up, builds the instanced handles.
+            report('{} cubes, {}'.format(num_cubes, sorted(mode.items())),
+                   time_it(frame, 30))
+    window.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+'''Log calls per second the calling thread absorbs: the old eager
+print against logger.Logger with the message disabled, enabled and
+repeated (rate limited). Output goes to /dev/null.'''
+from __future__ import (print_function, division, absolute_import)
+
+import benchutil
+
+import os
+import time
+
+import logger
+
+
+SECONDS = 1.0
+MESSAGE = 'Frame {} drew {} handles in {:.3f} ms'
+
+
+def calls_per_second(call):
+    count = 0
+    t0 = time.time()
+    while time.time() - t0 < SECONDS:
+        for i in xrange(1000):
+            call(i)
+        count += 1000
+    return count / (time.time() - t0)
+
+
+def main():
+    with open(os.devnull, 'w') as devnull:
+        def eager(i):
+            print(MESSAGE.format(i, 100, 1.5), file=devnull)
+
+        print('{:<20} {:12.0f} calls/s'.format(
+            'print (eager)', calls_per_second(eager)))
+
+        cases = [
+                ('disabled', logger.INFO, 1),
+                ('enabled', logger.DEBUG, 1 << 30),
+                ('rate limited', logger.DEBUG, 5),
+                ]
+        for name, level, burst in cases:
+            log = logger.Logger(level, devnull, capacity=1 << 16, burst=burst)
+            debug = logger.DEBUG
+
+            def call(i):
+                log.log(debug, MESSAGE, i, 100, 1.5)
+
+            rate = calls_per_second(call)
+            t0 = time.time()
+            log.flush()
+            print('{:<20} {:12.0f} calls/s  {:8} dropped, {:.1f} ms to '
+                  'flush'.format(name, rate, log.dropped,
+                                 1000 * (time.time() - t0)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+'''Push/multiply/pop throughput of Universe's matrix stack: the mat4x4
+path (universe.GLMMatrixStack) against transforms.MatrixStack fed mat4x4s
+and float32 arrays. Walks a tree of DEPTH levels with FANOUT children
+each, like drawing a scene hierarchy.'''
+from __future__ import (print_function, division, absolute_import)
+
+from benchutil import time_it, report
+
+import numpy
+from glm import mat4x4
+
+from transforms import MatrixStack
+from universe import GLMMatrixStack
+
+
+DEPTH = 4
+FANOUT = 6  # 1554 pushes per walk.
+
+
+def walk(stack, mats, depth=0):
+    for mat in mats[depth]:
+        stack.push(mat)
+        if depth + 1 < DEPTH:
+            walk(stack, mats, depth + 1)
+        stack.pop()
+
+
+def main():
+    glm_mats = [[mat4x4.translation_fff(i, depth, 0) for i in xrange(FANOUT)]
+                for depth in xrange(DEPTH)]
+    array_mats = [[numpy.array(tuple(mat.to_c_array()), numpy.float32)
+                   for mat in mats] for mats in glm_mats]
+    pushes = sum(FANOUT ** (depth + 1) for depth in xrange(DEPTH))
+    cases = [
+            ('mat4x4 list', GLMMatrixStack(), glm_mats),
+            ('MatrixStack, mat4x4', MatrixStack(), glm_mats),
+            ('MatrixStack, float32', MatrixStack(), array_mats),
+            ]
+    for label, stack, mats in cases:
+        times = time_it(lambda: walk(stack, mats), 50)
+        report('{} ({} pushes)'.format(label, pushes), times)
+        best = min(times)
+        print('{:<40} {:12.0f} push/pop per second'.format('', pushes / best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+'''Spawn time and GL buffer count for many cubes, with and without the
+shared MESH_CACHE.'''
+from __future__ import (print_function, division, absolute_import)
+
+from benchutil import make_context, time_it, report
+
+from gl import glFinish
+
+import primitive
+import render
+
+
+NUM_CUBES = 2000
+
+
+def spawn_uncached():
+    'What Cube did before the cache: one upload per cube.'
+    handles = []
+    for _ in xrange(NUM_CUBES):
+        vertices, colors = primitive.cube_mesh()
+        handles.append(render.RenderHandle.from_triangles(
+            primitive.PROGRAM, vertices, colors))
+    glFinish()
+    return handles
+
+
+def spawn_cached():
+    cubes = [primitive.Cube() for _ in xrange(NUM_CUBES)]
+    glFinish()
+    return cubes
+
+
+def main():
+    window = make_context()
+    primitive.PrimitiveUniverse(None)  # Creates primitive.PROGRAM
+
+    handles = []
+    report('{} cubes, uncached'.format(NUM_CUBES),
+           time_it(lambda: handles.extend(spawn_uncached()), 5))
+    print('  buffers: {}'.format(sum(len(h.vbos) for h in handles)))
+    for h in handles:
+        h.delete()
+
+    cubes = []
+    report('{} cubes, MESH_CACHE'.format(NUM_CUBES),
+           time_it(lambda: cubes.extend(spawn_cached()), 5))
+    print('  buffers: {}'.format(render.MESH_CACHE.num_buffers()))
+    for cube in cubes:
+        cube.release()
+    window.close()
+
+
+if __name__ == '__main__':
+    main()
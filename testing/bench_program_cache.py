@@ -0,0 +1,54 @@
+'''Time to build the primitive programs with a cold and a warm program
+cache, and without one.'''
+from __future__ import (print_function, division, absolute_import)
+
+from benchutil import make_context, time_it, report
+
+import shutil
+import tempfile
+
+from gl import glDeleteProgram, glFinish
+
+from options import renderer_options
+import primitive
+import render
+
+
+VARIANTS = [
+        {},
+        {'instanced': True},
+        {'stereo': True},
+        {'instanced': True, 'stereo': True},
+        ]
+
+
+def build_all():
+    programs = [primitive.PrimitiveProgram(**variant) for variant in VARIANTS]
+    render.resolve_programs()
+    for program in programs:
+        glDeleteProgram(program.idt)
+    glFinish()
+
+
+def main():
+    window = make_context()
+    directory = tempfile.mkdtemp()
+    try:
+        renderer_options.program_cache_dir = None
+        report('no cache', time_it(build_all, 5))
+
+        def cold():
+            shutil.rmtree(directory)
+            render.PROGRAM_CACHE = None  # Makes the directory again.
+            build_all()
+        renderer_options.program_cache_dir = directory
+        report('cold cache', time_it(cold, 5))
+        report('warm cache', time_it(build_all, 5))
+    finally:
+        renderer_options.program_cache_dir = None
+        shutil.rmtree(directory, ignore_errors=True)
+    window.close()
+
+
+if __name__ == '__main__':
+    main()
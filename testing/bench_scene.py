@@ -0,0 +1,99 @@
+'''Per-frame cost of a SceneGraph on mostly static scenes: nothing moving,
+1% of the nodes moving, and every node recomputed (what a scene without
+dirty flags pays). Trees of FANOUT ** 3 leaves under 10 roots, every node a
+cube.
+Times update() alone, then whole frames: update, collect and submit, drawn
+by the graph as one instanced draw, and as one draw per node with a model
+uniform for comparison.'''
+from __future__ import (print_function, division, absolute_import)
+
+from benchutil import make_context, time_it, report
+
+import random
+
+from gl import glFinish
+
+import primitive
+import render
+from render import DrawItem, InstancedRenderHandle, RenderHandle
+from scene import SceneGraph, SceneNode
+
+
+def build(fanout, mesh=None):
+    graph = SceneGraph()
+    nodes = []
+    for _ in xrange(10):
+        level = [SceneNode(graph, mesh=mesh)]
+        nodes.extend(level)
+        for _ in xrange(3):
+            level = [SceneNode(graph, parent, mesh) for parent in level
+                     for _ in xrange(fanout)]
+            nodes.extend(level)
+    for node in nodes:
+        node.set_transform(((0, 1, 0), random.uniform(0, 3)),
+                           (random.uniform(-1, 1), 0, -1))
+    graph.update()
+    return graph, nodes
+
+
+def per_node_handles(graph, handle):
+    'What drawing every node on its own costs.'
+    graph.update()
+    world = graph.world[:graph.count].tolist()
+    return [DrawItem(handle, (('model', model),), depth=-model[14])
+            for model in world]
+
+
+def cases(graph, nodes):
+    roots = [node for node in nodes if node.parent is None]
+    moving = random.sample(nodes, len(nodes) // 100)
+    angle = [0.0]
+    for label, movers in (('static', []), ('1% moving', moving),
+                          ('all', roots)):
+        def move(movers=movers):
+            angle[0] += 0.01
+            for node in movers:
+                node.set_transform(((0, 1, 0), angle[0]), (0, 0, -1))
+        yield label, move
+
+
+def main():
+    window = make_context()
+    vertices, colors, indices = render.weld_vertices(*primitive.cube_mesh())
+    program = primitive.PrimitiveProgram(model_matrix=True)
+    instanced_program = primitive.PrimitiveProgram(
+            instanced=True, model_matrix=True)
+    render.resolve_programs()
+    handle = RenderHandle.from_indexed_triangles(
+            program, vertices, colors, indices)
+    for fanout in (6, 10, 17):
+        mesh = InstancedRenderHandle.from_triangles(
+                instanced_program, vertices, colors,
+                primitive.MODEL_INSTANCE_ATTRIBS, indices)
+        graph, nodes = build(fanout, mesh)
+        for label, move in cases(graph, nodes):
+            def update():
+                move()
+                graph.update()
+
+            def instanced():
+                move()
+                render.draw_handles(graph.get_render_handles())
+                glFinish()
+
+            def per_node():
+                move()
+                render.draw_handles(per_node_handles(graph, handle))
+                glFinish()
+
+            for kind, frame in (('update', update), ('instanced', instanced),
+                                ('per node', per_node)):
+                times = time_it(frame, 30)
+                report('{} nodes, {}, {}'.format(len(nodes), label, kind),
+                       times)
+        mesh.delete()
+    window.close()
+
+
+if __name__ == '__main__':
+    main()
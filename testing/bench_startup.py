@@ -0,0 +1,38 @@
+'''Wall time of starting `python larch` for --help, --list-games and
+running a game headless for one frame (needs a GL context).'''
+from __future__ import (print_function, division, absolute_import)
+
+from benchutil import report
+
+import os
+import subprocess
+import sys
+import time
+
+
+LARCH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                     'larch')
+COMMANDS = [
+        ['--help'],
+        ['--list-games'],
+        ['--game', 'cube', '--bench', '1'],
+        ]
+
+
+def main():
+    with open(os.devnull, 'w') as devnull:
+        for args in COMMANDS:
+            times = []
+            for _ in xrange(10):
+                t0 = time.time()
+                status = subprocess.call([sys.executable, LARCH] + args,
+                                         stdout=devnull, stderr=devnull)
+                times.append(time.time() - t0)
+            label = ' '.join(args)
+            if status != 0:
+                label += ' (exit status {})'.format(status)
+            report(label, times)
+
+
+if __name__ == '__main__':
+    main()
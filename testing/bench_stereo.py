@@ -0,0 +1,63 @@
+'''CPU time per VR frame with one pass per eye and with single pass stereo,
+for PrimitiveUniverse with and without instancing.'''
+from __future__ import (print_function, division, absolute_import)
+
+from benchutil import make_context, time_it, report
+from fakes import DK1Info
+
+import random
+
+from gl import glFinish, glViewport
+
+from options import renderer_options
+import primitive
+import render
+
+
+def make_universe(num_cubes, instanced, stereo):
+    renderer_options.single_pass_stereo = stereo
+    # The programs are built for one mode or the other.
+    primitive.PROGRAM = None
+    primitive.INSTANCED_PROGRAM = None
+    universe = primitive.PrimitiveUniverse(DK1Info(), instanced=instanced)
+    for _ in xrange(num_cubes):
+        cube = primitive.Cube()
+        cube.translation = (random.uniform(-10, 10),
+                            random.uniform(-10, 10),
+                            random.uniform(-30, -5))
+        universe.attach_primitive(cube)
+    return universe
+
+
+def main():
+    w, h = 1280, 800
+    window = make_context(w, h)
+    for num_cubes in (100, 1000):
+        for instanced in (False, True):
+            for stereo in (False, True):
+                universe = make_universe(num_cubes, instanced, stereo)
+
+                def frame():
+                    render.STATS.reset()
+                    if stereo:
+                        glViewport(0, 0, w, h)
+                        render.render_universe_stereo(universe)
+                    else:
+                        glViewport(0, 0, w // 2, h)
+                        render.render_universe(universe, 'left')
+                        glViewport(w // 2, 0, w // 2, h)
+                        render.render_universe(universe, 'right')
+                    glFinish()
+
+                frame()
+                report('{} cubes, instanced={}, stereo={}'.format(
+                           num_cubes, instanced, stereo),
+                       time_it(frame, 30))
+                print('    draw calls per frame: {}'.format(
+                    render.STATS.draw_calls))
+    renderer_options.single_pass_stereo = False
+    window.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+'''Helpers for the bench_*.py scripts. These are not collected by pytest;
+run them directly, e.g.
+    python testing/bench_instancing.py
+'''
+from __future__ import (print_function, division, absolute_import)
+
+import sys, os
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+sys.path.insert(0, myPath + '/../larch')
+
+import time
+
+import pyglet
+
+
+def make_context(width=640, height=480):
+    'Open a hidden window with the same GL config the Interface uses.'
+    config = pyglet.gl.Config(
+            major_version = 3,
+            minor_version = 3,
+            double_buffer = True,
+            depth_size = 24)
+    return pyglet.window.Window(
+            width, height, config=config, visible=False)
+
+
+def time_it(func, repeat):
+    '''Call func() repeat times. Returns the list of wall times in seconds.'''
+    times = []
+    for _ in xrange(repeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return times
+
+
+def report(label, times):
+    times = sorted(times)
+    median = times[len(times) // 2]
+    print('{:<40} min {:8.3f} ms  median {:8.3f} ms'.format(
+        label, times[0] * 1000, median * 1000))
@@ -0,0 +1,16 @@
+'''Stand-ins for hardware, shared by the tests and the bench_*.py scripts.
+'''
+from __future__ import (print_function, division, absolute_import)
+
+
+class DK1Info(object):
+    '''Stands in for ovr.HMDInfo of an Oculus Rift DK1, so VR code paths
+    can be run without the headset.'''
+    HResolution = 1280
+    VResolution = 800
+    HScreenSize = 0.14976
+    VScreenSize = 0.0936
+    EyeToScreenDistance = 0.041
+    LensSeparationDistance = 0.0635
+    InterpupillaryDistance = 0.064
+    DistortionK = (1.0, 0.22, 0.24, 0.0)
@@ -0,0 +1,107 @@
+from __future__ import (print_function, division, absolute_import)
+
+
+import sys, os
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+sys.path.insert(0, myPath + '/../larch')
+
+import pytest
+
+from larch import interface
+from testing.fakes import DK1Info
+
+
+def vertices(data):
+    stride = sum(size for _, size in interface.DISTORTION_MESH_LAYOUT)
+    return [data[i:i + stride] for i in range(0, len(data), stride)]
+
+
+def test_mesh_size():
+    data, indices = interface.distortion_mesh(DK1Info(), 'left', 8)
+    assert len(vertices(data)) == 9 * 9
+    assert len(indices) == 8 * 8 * 6
+    assert max(indices) == 9 * 9 - 1
+
+
+def test_mesh_covers_eye():
+    for eye, x_range in (('left', (-1, 0)), ('right', (0, 1))):
+        data, _ = interface.distortion_mesh(DK1Info(), eye, 4)
+        xs = [v[0] for v in vertices(data)]
+        ys = [v[1] for v in vertices(data)]
+        assert (min(xs), max(xs)) == x_range
+        assert (min(ys), max(ys)) == (-1, 1)
+
+
+def test_mesh_warp():
+    info = DK1Info()
+    # Put a vertex on the lens center, which the warp leaves in place.
+    info.LensSeparationDistance = info.HScreenSize / 2
+    left, right = interface.lens_centers(info)
+    assert left == (0.25, 0.5)
+    data, _ = interface.distortion_mesh(info, 'left', 4)
+    verts = vertices(data)
+    center = verts[2 * 5 + 2]
+    assert center[:2] == pytest.approx((-0.5, 0.0))
+    assert center[3:] == pytest.approx((0.25, 0.5, 1.0))
+    # The corners are pulled in from outside the eye's half.
+    for corner in (verts[0], verts[4], verts[-5], verts[-1]):
+        assert corner[5] == 0.0
+
+
+def test_mesh_matches_shader():
+    '''Render a test pattern through both post-process paths on a real
+    (e.g. software) GL and compare the images.'''
+    pyglet = pytest.importorskip('pyglet')
+    import render
+    try:
+        w, h = interface.get_resolution()
+        window = pyglet.window.Window(w, h, visible=False,
+                                      config=pyglet.gl.Config(
+                                          major_version=3, minor_version=3))
+    except Exception:
+        pytest.skip('No GL 3.3 context')
+    from gl import (glClear, glClearColor, glScissor, glEnable, glDisable,
+                    GL_SCISSOR_TEST, GL_COLOR_BUFFER_BIT)
+
+    ovr = interface.OVRInterface()
+    ovr.hmdinfo = DK1Info()
+    tw, th = interface.get_scaled_resolution()
+    ovr.rendertexture = render.RenderTexture(tw, th)
+    with ovr.rendertexture:
+        # 16 x 10 checkerboard of colors.
+        glEnable(GL_SCISSOR_TEST)
+        cw, ch = tw // 16, th // 10
+        for j in range(10):
+            for i in range(16):
+                glScissor(i * cw, j * ch, cw, ch)
+                glClearColor(i / 15, j / 9, (i + j) % 2, 1)
+                glClear(GL_COLOR_BUFFER_BIT)
+        glDisable(GL_SCISSOR_TEST)
+
+    def postprocess(use_mesh):
+        ovr.use_distortion_mesh = use_mesh
+        if use_mesh:
+            ovr.pp_program = ovr._build_mesh_postprocess_program()
+            ovr.screen_quads_rh = ovr._cook_distortion_meshes(
+                    ovr.pp_program, 64)
+        else:
+            ovr.pp_program = ovr._build_postprocess_program()
+            ovr.screen_quads_rh = ovr._cook_screen_quads(ovr.pp_program)
+        glClearColor(0, 0, 0, 1)
+        glClear(GL_COLOR_BUFFER_BIT)
+        ovr._postprocess()
+        buf = pyglet.image.get_buffer_manager().get_color_buffer()
+        return bytearray(buf.get_image_data().get_data('RGBA', w * 4))
+
+    shader_image = postprocess(False)
+    mesh_image = postprocess(True)
+    window.close()
+
+    differing = 0
+    for i in range(0, len(shader_image), 4):
+        if max(abs(a - b) for a, b in zip(shader_image[i:i + 3],
+                                           mesh_image[i:i + 3])) > 8:
+            differing += 1
+    # Only pixels next to a checker edge or the green border may differ.
+    assert differing < 0.03 * w * h
@@ -0,0 +1,178 @@
+from __future__ import (print_function, division, absolute_import)
+
+
+import sys, os
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+sys.path.insert(0, myPath + '/../larch')
+
+import types
+
+from larch import gltrace
+
+
+NAMES = ['glUseProgram', 'glBindVertexArray', 'glUniform3fv',
+         'glUniformMatrix4fv', 'glEnable', 'glDisable', 'glPolygonMode',
+         'glDrawArrays']
+
+
+def test_tracer(monkeypatch):
+    made = []
+
+    def fake(name):
+        def function(*args):
+            made.append((name,) + args)
+        return function
+    # A module that star-imported the (fake) gl functions.
+    user = types.ModuleType('gltrace_test_user')
+    for name in NAMES:
+        function = fake(name)
+        monkeypatch.setattr(gltrace.gl, name, function, raising=False)
+        setattr(user, name, function)
+    monkeypatch.setitem(sys.modules, user.__name__, user)
+
+    tracer = gltrace.GLTracer(report_every=0)
+    tracer.install()
+    for _ in range(2):
+        user.glUseProgram(1)
+        user.glBindVertexArray(5)
+        user.glUniform3fv(0, [1.0, 2.0, 3.0])
+        user.glUniformMatrix4fv(1, False, [0.0] * 16)
+        user.glUseProgram(2)
+        user.glUseProgram(2)
+        user.glUniform3fv(0, [1.0, 2.0, 3.0])  # Another program.
+        user.glEnable('DEPTH')
+        user.glPolygonMode('FRONT_AND_BACK', 'LINE')
+        user.glDrawArrays('TRIANGLES', 0, 3)
+        tracer.end_frame()
+    tracer.uninstall()
+
+    assert len(made) == 20  # Every call went through.
+    assert user.glUseProgram is gltrace.gl.glUseProgram
+    calls, redundant = tracer.last_frame
+    assert calls['glUseProgram'] == 3
+    assert calls['glDrawArrays'] == 1
+    # State carries over from the first frame. Only the switch back to
+    # program 1 changes anything.
+    assert redundant['glUseProgram'] == 1
+    assert redundant['glBindVertexArray'] == 1
+    assert redundant['glUniform3fv'] == 2
+    assert redundant['glUniformMatrix4fv'] == 1
+    assert redundant['glEnable'] == 1
+    assert redundant['glPolygonMode'] == 1
+    summary = tracer.summary()
+    assert summary.startswith('GL frame 1: 10 calls, 7 redundant')
+    assert 'glUniform3fv' in summary
+
+
+def test_enable_disable(monkeypatch):
+    user = types.ModuleType('gltrace_test_user')
+    for name in ('glEnable', 'glDisable'):
+        function = lambda cap: None
+        monkeypatch.setattr(gltrace.gl, name, function, raising=False)
+        setattr(user, name, function)
+    monkeypatch.setitem(sys.modules, user.__name__, user)
+
+    tracer = gltrace.GLTracer(report_every=0)
+    tracer.install()
+    user.glEnable('BLEND')
+    user.glDisable('BLEND')
+    user.glDisable('BLEND')
+    user.glEnable('BLEND')
+    tracer.end_frame()
+    tracer.uninstall()
+    assert tracer.last_frame[1] == {'glDisable': 1}
+
+
+class FakeInterface(object):
+    def __init__(self):
+        self.frames = 0
+
+    def _draw(self):
+        self.frames += 1
+
+
+def test_detach_keeps_other_wrappers(monkeypatch):
+    monkeypatch.setattr(gltrace, 'gl', types.ModuleType('gl'))
+    interface = FakeInterface()
+    # Wrapped before the tracer, like FrameProfiler with --profile.
+    original = interface._draw
+    profiled = lambda: original()
+    interface._draw = profiled
+
+    tracer = gltrace.GLTracer(report_every=0)
+    tracer.attach(interface)
+    interface._draw()
+    assert tracer.frame_count == 1
+    tracer.uninstall()
+    assert interface._draw is profiled
+
+    tracer.attach(interface)
+    wrapped = interface._draw
+    interface._draw = lambda: wrapped()  # Wrapped after the tracer.
+    tracer.uninstall()
+    interface._draw()
+    assert tracer.frame_count == 1
+    assert interface.frames == 2
+
+
+def traced_user(monkeypatch, names):
+    'A module using fake gl functions names, and an installed tracer.'
+    user = types.ModuleType('gltrace_test_user')
+    for name in names:
+        function = lambda *args: None
+        monkeypatch.setattr(gltrace.gl, name, function, raising=False)
+        setattr(user, name, function)
+    monkeypatch.setitem(sys.modules, user.__name__, user)
+    for name in ('GL_TEXTURE0', 'GL_ELEMENT_ARRAY_BUFFER'):
+        monkeypatch.setattr(gltrace.gl, name, name, raising=False)
+    tracer = gltrace.GLTracer(report_every=0)
+    tracer.install()
+    return user, tracer
+
+
+def test_texture_binds_per_unit(monkeypatch):
+    user, tracer = traced_user(monkeypatch,
+                               ['glActiveTexture', 'glBindTexture'])
+    user.glBindTexture('TEXTURE_2D', 7)
+    user.glActiveTexture('GL_TEXTURE1')
+    user.glBindTexture('TEXTURE_2D', 7)  # Another unit.
+    user.glActiveTexture('GL_TEXTURE0')
+    user.glBindTexture('TEXTURE_2D', 7)
+    tracer.end_frame()
+    tracer.uninstall()
+    assert tracer.last_frame[1] == {'glBindTexture': 1}
+
+
+def test_element_buffer_is_vao_state(monkeypatch):
+    user, tracer = traced_user(monkeypatch,
+                               ['glBindVertexArray', 'glBindBuffer'])
+    user.glBindVertexArray(1)
+    user.glBindBuffer('GL_ELEMENT_ARRAY_BUFFER', 3)
+    user.glBindBuffer('GL_ARRAY_BUFFER', 4)
+    user.glBindVertexArray(2)
+    user.glBindBuffer('GL_ELEMENT_ARRAY_BUFFER', 3)  # Into the new VAO.
+    user.glBindBuffer('GL_ARRAY_BUFFER', 4)
+    tracer.end_frame()
+    tracer.uninstall()
+    assert tracer.last_frame[1] == {'glBindBuffer': 1}
+
+
+def test_link_and_delete_forget_state(monkeypatch):
+    user, tracer = traced_user(monkeypatch, [
+            'glUseProgram', 'glUniform1fv', 'glLinkProgram',
+            'glDeleteProgram', 'glBindBuffer', 'glDeleteBuffers'])
+    user.glUseProgram(1)
+    user.glUniform1fv(0, [0.5])
+    user.glLinkProgram(1)  # Relinking resets the uniforms.
+    user.glUniform1fv(0, [0.5])
+    user.glDeleteProgram(1)
+    user.glUseProgram(1)  # The name may be reused.
+    user.glUniform1fv(0, [0.5])
+    user.glBindBuffer('GL_ARRAY_BUFFER', 4)
+    user.glDeleteBuffers([4])
+    user.glBindBuffer('GL_ARRAY_BUFFER', 4)
+    user.glUniform1fv(0, [0.5])
+    tracer.end_frame()
+    tracer.uninstall()
+    assert tracer.last_frame[1] == {'glUniform1fv': 1}
@@ -0,0 +1,82 @@
+from __future__ import (print_function, division, absolute_import)
+
+
+import sys, os
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+sys.path.insert(0, myPath + '/../larch')
+
+import threading
+
+from larch import logger
+
+
+class Stream(object):
+    'Collects written lines. write() blocks while gate is clear.'
+    def __init__(self):
+        self.lines = []
+        self.writing = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def write(self, text):
+        self.writing.set()
+        self.gate.wait()
+        self.lines.extend(text.splitlines())
+
+    def flush(self):
+        pass
+
+
+class Unformattable(object):
+    def __format__(self, spec):
+        raise AssertionError('formatted')
+
+
+def test_levels_and_lazy_formatting():
+    stream = Stream()
+    log = logger.Logger(logger.INFO, stream)
+    log.log(logger.DEBUG, 'hidden {}', Unformattable())
+    assert not log.records
+    log.log(logger.INFO, 'shown {} {}', 1, 'two')
+    log.log(logger.ERROR, 'braces {} are fine without args')
+    log.flush()
+    assert stream.lines == ['[info] shown 1 two',
+                            '[error] braces {} are fine without args']
+
+
+def test_repeats_are_rate_limited():
+    stream = Stream()
+    now = [0.0]
+    log = logger.Logger(logger.DEBUG, stream, burst=2, interval=1.0,
+                        clock=lambda: now[0])
+    for i in range(5):
+        log.log(logger.DEBUG, 'tick {}', i)
+    log.flush()
+    assert stream.lines == ['[debug] tick 0', '[debug] tick 1',
+                            '[debug] Suppressed 3 repeats of: tick {}']
+
+    del stream.lines[:]
+    for i in range(4):
+        log.log(logger.DEBUG, 'tick {}', i)
+    now[0] = 1.0
+    log.log(logger.DEBUG, 'tick {}', 9)
+    log.flush()
+    assert stream.lines == ['[debug] tick 0', '[debug] tick 1',
+                            '[debug] Suppressed 2 repeats of: tick {}',
+                            '[debug] tick 9']
+
+
+def test_full_queue_drops_and_counts():
+    stream = Stream()
+    log = logger.Logger(logger.INFO, stream, capacity=2, burst=100)
+    stream.gate.clear()
+    log.log(logger.INFO, 'first')
+    assert stream.writing.wait(5)
+    for i in range(10):
+        log.log(logger.INFO, 'm{}', i)
+    assert log.dropped == 8
+    stream.gate.set()
+    log.flush()
+    assert stream.lines == ['[info] first', '[info] m0', '[info] m1',
+                            '[warning] Dropped 8 log messages.']
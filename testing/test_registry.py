@@ -0,0 +1,60 @@
+from __future__ import (print_function, division, absolute_import)
+
+
+import sys, os
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+sys.path.insert(0, myPath + '/../larch')
+
+import json
+
+from larch import registry
+
+
+def make_games(tmpdir):
+    games = tmpdir.mkdir('games')
+    games.join('__init__.py').write('')
+    games.join('cube.py').write('')
+    games.join('cube.pyc').write('')
+    games.join('_helpers.py').write('')
+    games.mkdir('maze').join('__init__.py').write('')
+    games.mkdir('assets')
+    return games
+
+
+def test_scan_games(tmpdir):
+    games = make_games(tmpdir)
+    assert registry.scan_games(str(games)) == ['cube', 'maze']
+
+
+def test_manifest(tmpdir, monkeypatch):
+    games = make_games(tmpdir)
+    manifest = str(tmpdir.join('cache', 'games.json'))
+    assert registry.builtin_games(str(games), manifest) == ['cube', 'maze']
+    with open(manifest) as f:
+        assert json.load(f)['games'] == ['cube', 'maze']
+
+    # Served from the manifest while the directory is unchanged.
+    monkeypatch.setattr(registry, 'scan_games', lambda directory: ['stale'])
+    assert registry.builtin_games(str(games), manifest) == ['cube', 'maze']
+    stat = os.stat(str(games))
+    os.utime(str(games), (stat.st_atime, stat.st_mtime + 10))
+    assert registry.builtin_games(str(games), manifest) == ['stale']
+
+
+class FakeEntryPoint(object):
+    def __init__(self, name):
+        self.name = name
+
+    def load(self):
+        return 'new function of {}'.format(self.name)
+
+
+def test_find_game(monkeypatch):
+    monkeypatch.setattr(registry, 'builtin_games', lambda: ['cube'])
+    monkeypatch.setattr(registry, 'plugin_entry_points',
+                        lambda: {'maze': FakeEntryPoint('maze')})
+    assert registry.all_games() == ['cube', 'maze']
+    assert registry.find_game('maze') == 'new function of maze'
+    assert registry.find_game('nope') is None
+    assert registry.find_game(None) is None
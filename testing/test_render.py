@@ -0,0 +1,396 @@
+from __future__ import (print_function, division, absolute_import)
+
+
+import sys, os
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+sys.path.insert(0, myPath + '/../larch')
+
+import pytest
+
+from larch import render
+
+
+class FakeProgram(object):
+    def __init__(self, idt):
+        self.idt = idt
+        self.name = 'fake_program'
+
+
+class FakeHandle(object):
+    def __init__(self):
+        self.vbos = [1, 2]
+        self.deleted = False
+
+    def delete(self):
+        self.deleted = True
+
+
+def test_mesh_key():
+    a = render.mesh_key([0, 1, 2], [1, 1, 1])
+    assert a == render.mesh_key([0, 1, 2], [1, 1, 1])
+    assert a != render.mesh_key([0, 1, 2], [1, 1, 0])
+    # Moving a float between attributes changes the key.
+    assert (render.mesh_key([0, 1], [2]) != render.mesh_key([0], [1, 2]))
+
+
+def test_mesh_cache_shares_and_releases():
+    cache = render.MeshCache()
+    program = FakeProgram(1)
+    built = []
+
+    def build():
+        built.append(FakeHandle())
+        return built[-1]
+
+    h1 = cache.acquire(program, 'cube', build)
+    h2 = cache.acquire(program, 'cube', build)
+    assert h1 is h2
+    assert len(built) == 1
+    assert cache.refcount(h1) == 2
+    assert cache.num_buffers() == 2
+
+    cache.release(h1)
+    assert not h1.deleted
+    cache.release(h2)
+    assert h1.deleted
+    assert cache.refcount(h1) == 0
+    assert cache.num_buffers() == 0
+
+    # After the last release the mesh is rebuilt.
+    h3 = cache.acquire(program, 'cube', build)
+    assert h3 is not h1
+
+
+def test_mesh_cache_per_program():
+    cache = render.MeshCache()
+    h1 = cache.acquire(FakeProgram(1), 'cube', FakeHandle)
+    h2 = cache.acquire(FakeProgram(2), 'cube', FakeHandle)
+    assert h1 is not h2
+
+
+def test_weld_vertices():
+    vertices = [0, 0, 0,  1, 0, 0,  0, 1, 0,
+                1, 0, 0,  1, 1, 0,  0, 1, 0]
+    colors = [1, 1, 1] * 6
+    v, c, indices = render.weld_vertices(vertices, colors)
+    assert v == [0, 0, 0,  1, 0, 0,  0, 1, 0,  1, 1, 0]
+    assert c == [1, 1, 1] * 4
+    assert indices == [0, 1, 2, 1, 3, 2]
+
+
+def test_weld_keeps_distinct_colors():
+    vertices = [0, 0, 0] * 3
+    colors = [1, 0, 0,  0, 1, 0,  1, 0, 0]
+    v, c, indices = render.weld_vertices(vertices, colors)
+    assert len(v) == 6
+    assert indices == [0, 1, 0]
+
+
+def test_index_type_for():
+    assert render.index_type_for(8) == (render.GL_UNSIGNED_SHORT,
+                                        render.GLushort)
+    assert render.index_type_for(0x10000)[0] == render.GL_UNSIGNED_SHORT
+    assert render.index_type_for(0x10001) == (render.GL_UNSIGNED_INT,
+                                              render.GLuint)
+
+
+def test_render_queue_sort_key():
+    key = render.RenderQueue.sort_key
+    # Program dominates VAO, VAO dominates depth.
+    assert key(1, 9, 99.0) < key(2, 0, 0.0)
+    assert key(1, 1, 99.0) < key(1, 2, 0.0)
+    assert key(1, 1, 1.0) < key(1, 1, 2.0)
+    # Depth is clamped, not wrapped into the VAO bits.
+    assert key(1, 1, 1e9) < key(1, 2, 0.0)
+    assert key(1, 1, -5.0) == key(1, 1, 0.0)
+
+
+class FakeVaoHandle(object):
+    def __init__(self, program, vao):
+        self.program = program
+        self.vao = vao
+
+
+def test_render_queue_order():
+    p1, p2 = FakeProgram(1), FakeProgram(2)
+    near = render.DrawItem(FakeVaoHandle(p1, 3), depth=1.0)
+    far = render.DrawItem(FakeVaoHandle(p1, 3), depth=50.0)
+    other_vao = FakeVaoHandle(p1, 4)
+    other_program = FakeVaoHandle(p2, 1)
+
+    queue = render.RenderQueue()
+    queue.extend([other_program, far, other_vao, near])
+    ordered = queue.sorted_items()
+    assert ordered[0] is near
+    assert ordered[1] is far
+    assert ordered[2].handle is other_vao
+    assert ordered[3].handle is other_program
+
+
+def test_std140_layout():
+    offsets, size = render.std140_layout(
+            [('persp', 'mat4'), ('eye_ipd', 'float')])
+    assert offsets == {'persp': 0, 'eye_ipd': 16}
+    assert size == 20
+
+    # vec3 is aligned to a vec4, a float may follow it directly.
+    offsets, size = render.std140_layout(
+            [('a', 'float'), ('b', 'vec3'), ('c', 'float'), ('d', 'vec2')])
+    assert offsets == {'a': 0, 'b': 4, 'c': 7, 'd': 8}
+    assert size == 12
+
+
+def test_float32_buffers():
+    from array import array
+    assert not render.is_float32_buffer([1.0, 2.0])
+    assert render.is_float32_buffer(array('f', [1.0, 2.0]))
+    assert render.num_floats([1.0, 2.0, 3.0]) == 3
+    assert render.num_floats(array('f', [1.0, 2.0, 3.0])) == 3
+    try:
+        render.is_float32_buffer(array('d', [1.0]))
+    except TypeError:
+        pass
+    else:
+        assert False, 'float64 data must be rejected'
+    # Content hashing doesn't depend on the container.
+    assert (render.mesh_key([0.5, 1.0], [2.0]) ==
+            render.mesh_key(array('f', [0.5, 1.0]), array('f', [2.0])))
+
+
+def test_buffer_data_from_mmap(monkeypatch, tmpdir):
+    import mmap
+    numpy = pytest.importorskip('numpy')
+    path = str(tmpdir.join('mesh.bin'))
+    numpy.arange(5, dtype=numpy.float32).tofile(path)
+    uploads = []
+
+    def buffer_data(target, size, pointer, usage):
+        data = render._ffi.buffer(pointer, size)[:]
+        uploads.append(numpy.frombuffer(data, numpy.float32).tolist())
+    monkeypatch.setattr(render, 'glBufferData', buffer_data)
+    with open(path, 'rb') as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        data = numpy.frombuffer(mapping, numpy.float32, 3,
+                                offset=render.FLOAT_SIZE)
+        render.buffer_data(render.GL_ARRAY_BUFFER, data, render.GL_STATIC_DRAW)
+        del data
+        mapping.close()
+    assert uploads == [[1.0, 2.0, 3.0]]
+
+
+class FakeDriver(object):
+    '''The GL calls ProgramCache makes. Programs "link" from a binary only
+    if it was made by this driver version.'''
+    def __init__(self, version):
+        self.version = version
+        self.linked = {}
+
+    def install(self, monkeypatch):
+        for name in ('glGetString', 'glGetProgramiv', 'glGetProgramBinary',
+                     'glProgramBinary'):
+            monkeypatch.setattr(render, name, getattr(self, name))
+
+    def glGetString(self, name):
+        return 'driver {} {}'.format(self.version, name)
+
+    def glGetProgramiv(self, idt, pname):
+        if pname == render.GL_LINK_STATUS:
+            return render.GL_TRUE if self.linked.get(idt) else render.GL_FALSE
+        return 4
+
+    def glGetProgramBinary(self, idt, length):
+        return 7, ('v{}'.format(self.version)).encode('ascii')
+
+    def glProgramBinary(self, idt, binary_format, binary, length):
+        assert binary_format == 7 and length == len(binary)
+        self.linked[idt] = binary == 'v{}'.format(
+                self.version).encode('ascii')
+
+
+def test_program_cache(monkeypatch, tmpdir):
+    driver = FakeDriver(1)
+    driver.install(monkeypatch)
+    shaders = [('void main() {}', 'VERTEX', 'vertex')]
+    cache = render.ProgramCache(str(tmpdir.join('programs')))
+    key = cache.key(shaders)
+    assert key != cache.key([('void main() { }', 'VERTEX', 'vertex')])
+    assert key != cache.key([('void main() {}', 'FRAGMENT', 'vertex')])
+
+    assert not cache.load(FakeProgram(1), key)
+    assert cache.misses == 1
+    cache.store(FakeProgram(1), key)
+    assert cache.load(FakeProgram(2), key)
+    assert cache.hits == 1
+
+    # A new driver rejects the old binary.
+    driver.version = 2
+    assert not cache.load(FakeProgram(3), key)
+    assert cache.rejected == 1
+    assert not os.path.exists(cache.path(key))
+    # And wouldn't be asked to, as its key differs.
+    assert render.ProgramCache(cache.directory).key(shaders) != key
+
+
+def test_program_cache_store_failure(monkeypatch, tmpdir):
+    FakeDriver(1).install(monkeypatch)
+    cache = render.ProgramCache(str(tmpdir.join('programs')))
+
+    def rename(source, destination):
+        raise OSError('destination exists')
+    monkeypatch.setattr(render.os, 'rename', rename)
+    cache.store(FakeProgram(1), 'key')
+    assert os.listdir(cache.directory) == []
+
+
+class FakeCompiler(object):
+    '''Records the GL calls of building programs. Shaders whose source
+    contains 'error' fail to compile, and programs with one fail to link.'''
+    def __init__(self, monkeypatch):
+        self.calls = []
+        self.sources = {}
+        self.programs = {}  # program -> [shader]
+        self.next_id = 10
+        for name in ('glCreateShader', 'glShaderSource', 'glCompileShader',
+                     'glAttachShader', 'glLinkProgram', 'glGetShaderiv',
+                     'glGetProgramiv', 'glGetShaderSource',
+                     'glGetShaderInfoLog', 'glGetProgramInfoLog',
+                     'glGetUniformLocation', 'glUseProgram', 'glUniform1fv',
+                     'glBindAttribLocation', 'glGenVertexArrays',
+                     'glGenBuffers', 'glBindVertexArray', 'glBindBuffer',
+                     'glBufferData', 'glVertexAttribPointer',
+                     'glEnableVertexAttribArray'):
+            monkeypatch.setattr(render, name, self.recorder(name))
+        monkeypatch.setattr(render, 'PARALLEL_COMPILE', False)
+        monkeypatch.setattr(render, 'PENDING_PROGRAMS', [])
+        monkeypatch.setattr(render, 'CURRENT_PROGRAM', -1)
+        monkeypatch.setattr(render, 'CURRENT_VAO', -1)
+        monkeypatch.setattr(render.logger, 'error', self.recorder('error'))
+        monkeypatch.setattr(render.renderer_options, 'program_cache_dir',
+                            None)
+
+    def recorder(self, name):
+        def record(*args):
+            self.calls.append(name)
+            return getattr(self, name, lambda *args: None)(*args)
+        return record
+
+    def queries(self):
+        return [c for c in self.calls if c.startswith('glGet')]
+
+    def glCreateShader(self, gl_type):
+        self.next_id += 1
+        return self.next_id
+
+    def glShaderSource(self, shader, sources):
+        self.sources[shader] = sources[0]
+
+    def glAttachShader(self, program, shader):
+        self.programs.setdefault(program, []).append(shader)
+
+    def glGetShaderiv(self, shader, pname):
+        if pname == render.GL_COMPILE_STATUS:
+            ok = 'error' not in self.sources[shader]
+            return render.GL_TRUE if ok else render.GL_FALSE
+        return render.GL_VERTEX_SHADER
+
+    def glGetProgramiv(self, program, pname):
+        ok = all('error' not in self.sources[s]
+                 for s in self.programs[program])
+        return render.GL_TRUE if ok else render.GL_FALSE
+
+    def glGetShaderSource(self, shader):
+        return self.sources[shader]
+
+    def glGetShaderInfoLog(self, shader):
+        return ''
+
+    def glGetProgramInfoLog(self, program):
+        return ''
+
+    def glGetUniformLocation(self, program, name):
+        return 0
+
+    def glGenVertexArrays(self, n):
+        return [1]
+
+    def glGenBuffers(self, n):
+        return list(range(1, n + 1))
+
+
+def test_program_build_is_deferred(monkeypatch):
+    compiler = FakeCompiler(monkeypatch)
+    a = render.Program(1, 'a')
+    a.build([('void main() {}', render.GL_VERTEX_SHADER, 'a_vertex')])
+    a.set_uniform('alpha', (0.5,))
+    b = render.Program(2, 'b')
+    b.build([('void main() {}', render.GL_VERTEX_SHADER, 'b_vertex')])
+    # Everything is submitted before anything is asked of the driver.
+    assert compiler.queries() == []
+    assert compiler.calls.count('glLinkProgram') == 2
+    assert render.PENDING_PROGRAMS == [a, b]
+    assert not a.done()
+
+    with a:
+        pass
+    assert a.done()
+    assert 'glUniform1fv' in compiler.calls  # The deferred set_uniform.
+    assert render.PENDING_PROGRAMS == [b]
+    render.resolve_programs()
+    assert render.PENDING_PROGRAMS == []
+    # Success doesn't fetch sources or logs.
+    assert 'glGetShaderSource' not in compiler.calls
+    assert 'glGetProgramInfoLog' not in compiler.calls
+
+
+def test_handles_dont_wait_for_programs(monkeypatch):
+    # As in OVRInterface.__enter__: build a program, make its handle, then
+    # the next one.
+    compiler = FakeCompiler(monkeypatch)
+    for idt in (1, 2):
+        program = render.Program(idt, 'p{}'.format(idt))
+        program.build([('void main() {}', render.GL_VERTEX_SHADER, 'vertex')])
+        render.RenderHandle.from_triangles(
+                program, [0.0] * 9, [1.0] * 9)
+    assert compiler.queries() == []
+    assert compiler.calls.count('glLinkProgram') == 2
+    # Locations are bound before each link.
+    first_link = compiler.calls.index('glLinkProgram')
+    assert 'glBindAttribLocation' in compiler.calls[:first_link]
+    render.resolve_programs()
+    assert compiler.queries()
+
+
+def test_program_build_failure(monkeypatch):
+    compiler = FakeCompiler(monkeypatch)
+    program = render.Program(1, 'broken')
+    program.build([('void main() {}', render.GL_VERTEX_SHADER, 'fine'),
+                   ('error', render.GL_FRAGMENT_SHADER, 'broken')])
+    program.resolve()
+    # Only the shader that failed has its source fetched.
+    assert compiler.calls.count('glGetShaderSource') == 1
+    assert 'error' in compiler.calls
+
+
+def test_program_cache_bad_files(monkeypatch, tmpdir):
+    compiler = FakeCompiler(monkeypatch)
+    for name in ('glProgramBinary', 'glProgramParameteri'):
+        monkeypatch.setattr(render, name, compiler.recorder(name))
+    monkeypatch.setattr(render, 'glGetString', lambda name: 'driver')
+    monkeypatch.setattr(render.renderer_options, 'program_cache_dir',
+                        str(tmpdir.join('programs')))
+    monkeypatch.setattr(render, 'PROGRAM_CACHE', None)
+    cache = render.get_program_cache()
+    # Empty and cut short, e.g. by a full disk or a crash.
+    for idt, contents in ((1, b''), (2, b'\x07\x00')):
+        shaders = [('void main() {{}} // {}'.format(idt),
+                    render.GL_VERTEX_SHADER, 'vertex')]
+        path = cache.path(cache.key(shaders))
+        with open(path, 'wb') as f:
+            f.write(contents)
+        program = render.Program(idt, 'p{}'.format(idt))
+        program.build(shaders)
+        assert program.pending is not None  # Compiling from source.
+        assert not os.path.exists(path)
+    assert cache.rejected == 2
+    assert 'glProgramBinary' not in compiler.calls
@@ -0,0 +1,81 @@
+from __future__ import (print_function, division, absolute_import)
+
+
+import sys, os
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+sys.path.insert(0, myPath + '/../larch')
+
+import pytest
+
+from larch import resolution
+
+
+def test_scaler_drops_to_fit_and_creeps_back():
+    scaler = resolution.ResolutionScaler(0.010, min_scale=0.5, step=0.1)
+    assert scaler.scale == 1.0
+    # Twice the target time: half the pixels.
+    assert scaler.update(0.018) == pytest.approx(0.5 ** 0.5)
+    # Between raise_below and headroom it holds still.
+    assert scaler.update(0.008) == pytest.approx(0.5 ** 0.5)
+    assert scaler.update(0.005) == pytest.approx(0.5 ** 0.5 + 0.1)
+    for _ in range(10):
+        scaler.update(0.001)
+    assert scaler.scale == 1.0
+    scaler.update(1.0)
+    assert scaler.scale == 0.5
+
+
+def test_scaled_viewport():
+    assert resolution.scaled_viewport(2304, 1440, 1.0) == (
+            (2304, 1440), (1.0, 1.0))
+    (w, h), frame_scale = resolution.scaled_viewport(2304, 1440, 0.7)
+    assert w % 2 == 0
+    assert (w, h) == (1612, 1008)
+    assert frame_scale == (1612 / 2304, 1008 / 1440)
+
+
+def test_gpu_frame_timer(monkeypatch):
+    import timing
+    queries = iter(range(1, 1000))
+    available = set()
+    stamps = {}
+    # Each timestamp is 2 ms after the previous one.
+    gpu_time = iter(range(0, 10 ** 9, 2 * 10 ** 6))
+
+    def query_counter(query, target):
+        stamps[query] = next(gpu_time)
+    monkeypatch.setattr(timing, 'glGenQueries',
+                        lambda n: [next(queries) for _ in range(n)])
+    monkeypatch.setattr(timing, 'glQueryCounter', query_counter)
+    monkeypatch.setattr(timing, 'glGetQueryObjectiv',
+                        lambda query, pname: query in available)
+    monkeypatch.setattr(timing, 'glGetQueryObjectui64v',
+                        lambda query, pname: stamps[query])
+
+    timer = resolution.GPUFrameTimer(latency=2)
+    timer.begin()
+    assert timer.end() is None
+    timer.begin()
+    assert timer.end() is None
+    timer.begin()
+    # Three in flight, the first is read.
+    assert timer.end() == pytest.approx(0.002)
+    available.update(range(1000))
+    timer.begin()
+    assert timer.end() == pytest.approx(0.002)
+    assert len(timer.timestamps) == 0
+
+
+def test_render_texture_pool(monkeypatch):
+    import render
+    created = []
+
+    def render_texture(width, height):
+        created.append((width, height))
+        return len(created)
+    monkeypatch.setattr(render, 'RenderTexture', render_texture)
+    pool = render.RenderTexturePool(640, 400)
+    assert created == [(640, 400), (640, 400)]
+    assert [pool.acquire() for _ in range(4)] == [1, 2, 1, 2]
+    assert len(created) == 2
@@ -0,0 +1,89 @@
+from __future__ import (print_function, division, absolute_import)
+
+
+import sys, os
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+sys.path.insert(0, myPath + '/../larch')
+
+from math import pi
+
+import pytest
+numpy = pytest.importorskip('numpy')
+
+from larch import scene
+
+
+def matrix(model):
+    'Column-major 16 floats as a row-major numpy matrix.'
+    return numpy.array(model, numpy.float64).reshape(4, 4).T
+
+
+def test_world_matrices():
+    graph = scene.SceneGraph(capacity=2)
+    root = scene.SceneNode(graph)
+    arm = scene.SceneNode(graph, root)
+    hand = scene.SceneNode(graph, arm)
+    other = scene.SceneNode(graph)
+    assert graph.count == 4  # Grown.
+    assert graph.update() == 4
+
+    root.set_transform(((0, 1, 0), 0.0), (0, 0, -5))
+    arm.set_transform(((0, 0, 1), pi / 2), (1, 0, 0))
+    hand.set_transform(((0, 1, 0), 0.0), (2, 0, 0))
+    assert graph.update() == 3
+    expected = (matrix(root.local).dot(matrix(arm.local))
+                .dot(matrix(hand.local)))
+    assert numpy.allclose(matrix(hand.world), expected, atol=1e-6)
+    # The arm is turned a quarter, so the hand ends up on the y axis.
+    assert numpy.allclose(matrix(hand.world).dot((0, 0, 0, 1)),
+                          (1, -2, -5, 1), atol=1e-6)
+    assert numpy.allclose(matrix(other.world), numpy.identity(4))
+
+
+def test_only_moved_subtrees_update():
+    graph = scene.SceneGraph()
+    roots = [scene.SceneNode(graph) for _ in range(3)]
+    leaves = [scene.SceneNode(graph, root) for root in roots
+              for _ in range(4)]
+    graph.update()
+    assert graph.update() == 0
+
+    roots[1].set_transform(((0, 1, 0), 0.0), (0, 3, 0))
+    leaves[0].set_transform(((0, 1, 0), 0.0), (1, 0, 0))
+    assert graph.update() == 1 + 4 + 1
+    assert numpy.allclose(leaves[5].world[12:15], (0, 3, 0))
+    assert numpy.allclose(leaves[0].world[12:15], (1, 0, 0))
+    assert numpy.allclose(leaves[9].world[12:15], (0, 0, 0))
+
+
+class FakeMesh(object):
+    def __init__(self):
+        self.uploads = []
+
+    def update_instances(self, data):
+        self.uploads.append(numpy.array(data))
+
+
+def test_draws_one_instanced_handle_per_mesh():
+    graph = scene.SceneGraph()
+    cube, ball = FakeMesh(), FakeMesh()
+    root = scene.SceneNode(graph)
+    cubes = [scene.SceneNode(graph, root, cube) for _ in range(3)]
+    balls = [scene.SceneNode(graph, cubes[0], ball) for _ in range(2)]
+    cubes.append(scene.SceneNode(graph, root, cube))
+    root.set_transform(((0, 1, 0), 0.0), (0, 0, -5))
+
+    assert graph.get_render_handles() == [cube, ball]
+    assert len(cube.uploads) == 1
+    assert numpy.array_equal(
+            cube.uploads[0], graph.world[[node.index for node in cubes]])
+    assert numpy.array_equal(ball.uploads[0], graph.world[4:6])
+    # Nothing moved: drawn again without uploading.
+    assert graph.get_render_handles() == [cube, ball]
+    assert len(cube.uploads) == 1
+
+    balls[1].set_transform(((0, 1, 0), 0.0), (0, 1, 0))
+    graph.get_render_handles()
+    assert len(ball.uploads) == 2
+    assert numpy.allclose(ball.uploads[1][1, 12:15], (0, 1, -5))
@@ -0,0 +1,70 @@
+from __future__ import (print_function, division, absolute_import)
+
+
+import sys, os
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+sys.path.insert(0, myPath + '/../larch')
+
+import time
+
+from larch import scheduler
+
+
+def test_fixed_steps_and_alpha():
+    dts = []
+    s = scheduler.FixedStepScheduler(dts.append, 0.01)
+    assert abs(s.advance(0.025) - 0.5) < 1e-9
+    assert dts == [0.01, 0.01]
+    s.advance(0.004)
+    assert len(dts) == 2
+    s.advance(0.001)
+    assert len(dts) == 3
+    assert abs(s.alpha) < 1e-9
+
+
+def test_backlog_is_dropped():
+    dts = []
+    s = scheduler.FixedStepScheduler(dts.append, 0.01, max_steps=3)
+    s.advance(1.0)
+    assert len(dts) == 3
+    assert s.alpha < 1
+    assert abs(s.dropped - 0.97) < 1e-6
+
+
+def process_time():
+    if hasattr(time, 'process_time'):
+        return time.process_time()
+    return time.clock()
+
+
+def test_headless_cpu_and_tick_stability():
+    '''Run 60 fps frames over a 120 Hz simulation for a while. Real time on
+    a possibly loaded machine, so the bounds only catch gross failures such
+    as spinning or losing time; the exact stepping is tested above.'''
+    step = 1 / 120
+    tick_times = []
+
+    def tick(dt):
+        assert dt == step
+        tick_times.append(time.time())
+
+    s = scheduler.FixedStepScheduler(tick, step)
+    duration = 1.0
+    wall0, cpu0 = time.time(), process_time()
+    frames = scheduler.run_headless(s, duration, 1 / 60)
+    wall = time.time() - wall0
+    cpu = process_time() - cpu0
+
+    expected_ticks = wall / step
+    cpu_percent = 100 * cpu / wall
+    print('frames {} ticks {} (expected {:.1f}) cpu {:.1f}%'.format(
+        frames, s.ticks, expected_ticks, cpu_percent))
+
+    # Time is either simulated or, after a stall, dropped; never lost.
+    simulated = s.ticks + s.dropped / step
+    assert abs(simulated - expected_ticks) <= 0.1 * expected_ticks + 3
+    assert frames >= duration * 60 / 2
+    # Two ticks per frame, the loop sleeps the rest of the time. A busy
+    # loop would be near 100%.
+    assert cpu_percent < 90
@@ -0,0 +1,98 @@
+from __future__ import (print_function, division, absolute_import)
+
+
+import sys, os
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+sys.path.insert(0, myPath + '/../larch')
+
+import random
+
+from larch import spatial
+
+
+def ortho_box():
+    'Clip matrix of an orthographic box from -1 to 1 on every axis.'
+    return [1, 0, 0, 0,
+            0, 1, 0, 0,
+            0, 0, 1, 0,
+            0, 0, 0, 1]
+
+
+def test_frustum_sphere():
+    frustum = spatial.Frustum.from_matrix(ortho_box())
+    assert frustum.intersects_sphere((0, 0, 0), 0.1)
+    assert frustum.intersects_sphere((1.5, 0, 0), 0.6)
+    assert not frustum.intersects_sphere((1.5, 0, 0), 0.4)
+    assert not frustum.intersects_sphere((0, 0, -3), 1)
+
+
+def test_frustum_box():
+    frustum = spatial.Frustum.from_matrix(ortho_box())
+    assert frustum.classify_box((0, 0, 0), 0.5) == spatial.INSIDE
+    assert frustum.classify_box((1, 0, 0), 0.5) == spatial.INTERSECTING
+    assert frustum.classify_box((3, 0, 0), 0.5) == spatial.OUTSIDE
+
+
+def shifted_box(dx):
+    'ortho_box() moved by dx along x.'
+    m = ortho_box()
+    m[12] = -dx
+    return m
+
+
+def test_frustum_union():
+    union = spatial.FrustumUnion([
+            spatial.Frustum.from_matrix(shifted_box(-1)),
+            spatial.Frustum.from_matrix(shifted_box(1))])
+    assert union.intersects_sphere((-1.5, 0, 0), 0.1)
+    assert union.intersects_sphere((1.5, 0, 0), 0.1)
+    assert not union.intersects_sphere((2.5, 0, 0), 0.1)
+    assert union.classify_box((-1, 0, 0), 0.5) == spatial.INSIDE
+    # Straddles both halves without fitting in either.
+    assert union.classify_box((0, 0, 0), 1.5) == spatial.INTERSECTING
+    assert union.classify_box((0, 3, 0), 0.5) == spatial.OUTSIDE
+
+
+def test_octree_query_matches_brute_force():
+    random.seed(3)
+    octree = spatial.LooseOctree(half_size=8.0, max_depth=4)
+    bounds = {}
+    for i in range(500):
+        center = tuple(random.uniform(-10, 10) for _ in range(3))
+        radius = random.uniform(0.01, 1.0)
+        bounds[i] = (center, radius)
+        octree.insert(i, center, radius)
+    assert len(octree) == 500
+
+    frustum = spatial.Frustum.from_matrix(ortho_box())
+
+    def brute_force():
+        return set(i for i, (c, r) in bounds.items()
+                   if frustum.intersects_sphere(c, r))
+
+    assert set(octree.query(frustum)) == brute_force()
+
+    # Move everything a bit, some move a lot.
+    for i, (center, radius) in bounds.items():
+        step = 5.0 if i % 10 == 0 else 0.2
+        center = tuple(c + random.uniform(-step, step) for c in center)
+        bounds[i] = (center, radius)
+        octree.update(i, center, radius)
+    assert set(octree.query(frustum)) == brute_force()
+
+    for i in range(0, 500, 2):
+        octree.remove(i)
+        del bounds[i]
+    assert set(octree.query(frustum)) == brute_force()
+
+
+def test_octree_visits_few_nodes_for_small_frustum():
+    octree = spatial.LooseOctree(half_size=64.0, max_depth=6)
+    for x in range(-60, 60, 4):
+        for z in range(-60, 60, 4):
+            octree.insert((x, z), (x, 0.0, z), 0.5)
+    result = octree.query(spatial.Frustum.from_matrix(ortho_box()))
+    assert len(result) == 1
+    # There are over 2000 nodes.
+    assert octree.nodes_visited < 100
@@ -0,0 +1,178 @@
+from __future__ import (print_function, division, absolute_import)
+
+
+import sys, os
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+sys.path.insert(0, myPath + '/../larch')
+
+import json
+
+import pytest
+
+from larch import timing
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert timing.percentile(values, 0.5) == 50
+    assert timing.percentile(values, 0.99) == 99
+    assert timing.percentile(values, 1.0) == 100
+    assert timing.percentile([7], 0.99) == 7
+
+
+def test_summarize():
+    summary = timing.summarize([0.003, 0.001, 0.002])
+    assert summary == {'min': 1.0, 'median': 2.0, 'p99': 3.0}
+
+
+class FakeGame(object):
+    'Stands in for a game built on HeadlessInterface.'
+    frames = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, t, value, traceback):
+        pass
+
+    def frame(self, clock):
+        FakeGame.frames += 1
+        return 0.25, 0.5, FakeGame.frames / 1000
+
+
+def test_bench():
+    result = timing.bench(FakeGame, 20, warmup=5)
+    assert FakeGame.frames == 25
+    assert result['frames'] == 20
+    assert result['tick']['median'] == 250
+    assert result['submit']['min'] == 6
+    assert result['total']['min'] == 756
+    json.dumps(result)
+
+
+def test_ring_buffer():
+    ring = timing.RingBuffer(3)
+    assert ring.to_list() == []
+    for i in range(5):
+        ring.append(i)
+    assert len(ring) == 3
+    assert ring.to_list() == [2, 3, 4]
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeUniverse(object):
+    def __init__(self, clock):
+        self.clock = clock
+
+    def render_prelude(self, eye):
+        self.clock.now += 0.002
+
+
+class FakeInterface(object):
+    '''Has the parts of Interface that FrameProfiler wraps. Each part
+    advances the clock by a known amount.'''
+    def __init__(self, clock):
+        self.clock = clock
+        self.scheduler = None
+        self.universe = FakeUniverse(clock)
+
+    def tick(self, dt):
+        self.clock.now += 0.001
+
+    def _draw(self):
+        self.universe.render_prelude('center')
+        timing.render.draw_handles([])
+        self._postprocess()
+
+    def _postprocess(self):
+        self.clock.now += 0.004
+        # Counts for postprocess, not for draw_handles.
+        timing.render.draw_handles([])
+
+
+def test_frame_profiler(monkeypatch, tmpdir):
+    clock = FakeClock()
+
+    def draw_handles(handles):
+        clock.now += 0.003
+    monkeypatch.setattr(timing.render, 'draw_handles', draw_handles)
+
+    interface = FakeInterface(clock)
+    profiler = timing.FrameProfiler(capacity=4, gpu=False, clock=clock)
+    profiler.attach(interface)
+    for _ in range(6):
+        interface.tick(1 / 120)
+        interface._draw()
+    profiler.detach()
+    assert 'tick' not in vars(interface)
+    assert timing.render.draw_handles is draw_handles
+
+    frames = profiler.frames()
+    assert [f['frame'] for f in frames] == [2, 3, 4, 5]
+    frame = frames[-1]
+    assert frame['tick_cpu'] == pytest.approx(1)
+    assert frame['render_prelude_cpu'] == pytest.approx(2)
+    assert frame['draw_handles_cpu'] == pytest.approx(3)
+    assert frame['postprocess_cpu'] == pytest.approx(7)
+    assert frame['frame_cpu'] == pytest.approx(12)
+    assert frame['draw_handles_gpu'] is None
+    assert profiler.summary()['postprocess_cpu']['median'] == \
+        pytest.approx(7)
+
+    path = str(tmpdir.join('frames.json'))
+    profiler.dump(path)
+    with open(path) as f:
+        assert len(json.load(f)['frames']) == 4
+    path = str(tmpdir.join('frames.csv'))
+    profiler.dump(path)
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert lines[0].startswith('frame,frame_cpu,tick_cpu,tick_gpu')
+    assert len(lines) == 5
+
+
+def test_frame_profiler_gpu(monkeypatch):
+    'GPU times are read back once available, or latency frames later.'
+    queries = iter(range(1, 1000))
+    available = set()
+    # Each timestamp is 1 microsecond after the previous one.
+    stamps = {}
+    gpu_time = iter(range(0, 10 ** 6, 1000))
+
+    def query_counter(query, target):
+        stamps[query] = next(gpu_time)
+    monkeypatch.setattr(timing, 'glGenQueries',
+                        lambda n: [next(queries) for _ in range(n)])
+    monkeypatch.setattr(timing, 'glQueryCounter', query_counter)
+    monkeypatch.setattr(timing, 'glGetQueryObjectiv',
+                        lambda query, pname: query in available)
+    monkeypatch.setattr(timing, 'glGetQueryObjectui64v',
+                        lambda query, pname: stamps[query])
+    monkeypatch.setattr(timing.render, 'draw_handles', lambda handles: None)
+
+    clock = FakeClock()
+    interface = FakeInterface(clock)
+    profiler = timing.FrameProfiler(gpu=True, latency=2, clock=clock)
+    profiler.attach(interface)
+    interface._draw()
+    interface._draw()
+    assert profiler.frames() == []
+    interface._draw()  # Three in flight, the first is read.
+    assert len(profiler.frames()) == 1
+    available.update(range(1000))
+    interface._draw()
+    profiler.detach()
+    frames = profiler.frames()
+    assert len(frames) == 4
+    assert frames[0]['tick_gpu'] is None
+    for frame in frames:
+        assert frame['render_prelude_gpu'] == pytest.approx(0.001)
+        assert frame['postprocess_gpu'] == pytest.approx(0.001)
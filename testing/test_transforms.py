@@ -0,0 +1,134 @@
+from __future__ import (print_function, division, absolute_import)
+
+
+import sys, os
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+sys.path.insert(0, myPath + '/../larch')
+
+from math import pi
+
+import pytest
+numpy = pytest.importorskip('numpy')
+
+from larch import transforms
+
+
+class Owner(object):
+    store_slot = None
+
+
+def test_add_and_views():
+    store = transforms.TransformStore(capacity=2)
+    owners = [Owner() for _ in range(5)]
+    for i, owner in enumerate(owners):
+        store.add(owner, ((0, 1, 0), i * 0.5), (i, 0, -3))
+    assert store.count == 5
+    assert owners[3].store_slot == 3
+    assert store.get_translation(3) == (3.0, 0.0, -3.0)
+    assert store.get_rotation(2) == ((0.0, 1.0, 0.0), 1.0)
+
+    data = store.instance_data()
+    assert data.dtype == numpy.float32
+    assert data.shape == (5, transforms.TransformStore.STRIDE)
+    assert data.flags['C_CONTIGUOUS']
+    assert list(store.instance_data([1, 3])[:, 4]) == [1.0, 3.0]
+
+
+def test_remove_moves_last_row():
+    store = transforms.TransformStore()
+    owners = [Owner() for _ in range(3)]
+    for i, owner in enumerate(owners):
+        store.add(owner, ((0, 1, 0), 0.0), (i, 0, 0))
+    store.remove(owners[0].store_slot)
+    assert store.count == 2
+    assert owners[2].store_slot == 0
+    assert store.get_translation(0) == (2.0, 0.0, 0.0)
+    assert store.owners == [owners[2], owners[1]]
+
+
+def test_tick():
+    store = transforms.TransformStore()
+    a, b = Owner(), Owner()
+    store.add(a, ((0, 1, 0), 0.0), (0, 0, 0), angular_velocity=1.0)
+    store.add(b, ((0, 1, 0), 0.0), (0, 0, 0))
+    store.tick(0.5)
+    assert store.get_rotation(a.store_slot)[1] == pytest.approx(0.5)
+    assert store.get_rotation(b.store_slot)[1] == 0.0
+    # Angles wrap around to keep float32 precision.
+    store.tick(2 * pi)
+    assert store.get_rotation(a.store_slot)[1] == pytest.approx(0.5, abs=1e-5)
+
+
+def test_interpolation():
+    store = transforms.TransformStore()
+    a = Owner()
+    store.add(a, ((0, 1, 0), 0.0), (0, 0, 0), angular_velocity=1.0)
+    store.save_previous()
+    store.set_translation(a.store_slot, (2, 0, 0))
+    store.tick(0.5)
+    rotation, translation = store.get_interpolated(a.store_slot, 0.5)
+    assert rotation[1] == pytest.approx(0.25)
+    assert translation == pytest.approx((1.0, 0.0, 0.0))
+    # alpha 1 is the live data itself.
+    assert store.instance_data(alpha=1.0).base is store.instances
+
+    # Across the wrap at 2 pi, the short way around.
+    store.set_rotation(a.store_slot, ((0, 1, 0), 2 * pi - 0.1))
+    store.save_previous()
+    store.tick(0.2)
+    rotation, _ = store.get_interpolated(a.store_slot, 0.5)
+    assert rotation[1] == pytest.approx(2 * pi, abs=1e-4)
+
+
+def test_lerp_transform():
+    previous = ((0, 1, 0), 1.0), (0, 0, 0)
+    current = ((0, 1, 0), 2.0), (4, 0, -2)
+    rotation, translation = transforms.lerp_transform(previous, current, 0.25)
+    assert rotation == ((0, 1, 0), 1.25)
+    assert translation == (1.0, 0.0, -0.5)
+
+
+def test_matrix_stack():
+    stack = transforms.MatrixStack(capacity=2)
+    translate = numpy.identity(4)
+    translate[:3, 3] = (1, 2, 3)
+    scale = numpy.diag([2.0, 2.0, 2.0, 1.0])
+    # Column-major, as mat4x4.to_c_array() has it.
+    stack.push(list(translate.T.ravel()))
+    stack.push(scale.T.astype(numpy.float32))
+    assert stack.depth == 2
+    assert len(stack.levels) == 4  # Grown.
+    assert numpy.allclose(stack.top, translate.dot(scale).T.ravel())
+    # The point (1, 1, 1) is scaled, then translated.
+    point = stack.levels[2].T.dot((1, 1, 1, 1))
+    assert list(point) == [3, 4, 5, 1]
+    stack.pop()
+    assert numpy.allclose(stack.top, translate.T.ravel())
+    stack.pop()
+    assert numpy.allclose(stack.top, numpy.identity(4).ravel())
+    with pytest.raises(AssertionError):
+        stack.pop()
+
+
+def test_model_matrix():
+    # A quarter turn about z, then a translation, column-major.
+    model = transforms.model_matrix(((0, 0, 2), pi / 2), (1, 2, 3))
+    m = numpy.array(model).reshape(4, 4).T
+    assert numpy.allclose(m.dot((1, 0, 0, 1)), (1, 1, 3, 1))
+    assert numpy.allclose(m.dot((0, 0, 1, 0)), (0, 0, 1, 0))
+
+    rows = numpy.array([[0, 1, 0, 0.5, 1, 2, 3],
+                        [1, 1, 0, -2.0, 0, 0, -5],
+                        [0, 0, 0, 1.0, 4, 5, 6]], numpy.float32)
+    models = transforms.model_matrices(rows)
+    assert models.dtype == numpy.float32
+    assert models.shape == (3, 16)
+    for row, model in zip(rows, models):
+        expected = transforms.model_matrix(
+                (tuple(row[0:3]), row[3]), tuple(row[4:7]))
+        assert numpy.allclose(model, expected, atol=1e-6)
+
+    store = transforms.TransformStore()
+    store.add(Owner(), ((1, 1, 0), -2.0), (0, 0, -5))
+    assert numpy.allclose(store.model_data(), models[1:2], atol=1e-6)
@@ -9,6 +9,7 @@ sys.path.insert(0, myPath + '/../larch')
 from glm import mat4x4
 
 from larch import universe
+from testing.fakes import DK1Info
 
 
 def test_modelviewinit():
@@ -29,3 +30,40 @@ def test_modelpushpop():
     u.pop()
     assert u.modelview.equals(mat4x4.identity())
     assert u.matstack == []
+
+
+class UniformRecorder(object):
+    def __init__(self):
+        self.uniforms = {}
+
+    def set_uniform(self, name, thing):
+        self.uniforms[name] = thing
+
+
+def test_hmd_projection_cache():
+    u = universe.Universe()
+    u.hmdinfo = DK1Info()
+    u.program = UniformRecorder()
+    computed = []
+    compute = u._compute_hmd_projection
+
+    def counting_compute(eye, znear, zfar):
+        computed.append(eye)
+        return compute(eye, znear, zfar)
+    u._compute_hmd_projection = counting_compute
+
+    for _ in range(3):
+        u.setup_hmd_persp('left', 0.01, 100)
+        u.setup_hmd_persp('right', 0.01, 100)
+    assert computed == ['left', 'right']
+    assert u.program.uniforms['eye_ipd'] == (-0.032,)
+
+    u.setup_hmd_persp('left', 0.01, 50)
+    assert computed == ['left', 'right', 'left']
+    u.hmdinfo.InterpupillaryDistance = 0.07
+    u.setup_hmd_persp('left', 0.01, 50)
+    assert computed == ['left', 'right', 'left', 'left']
+    assert u.program.uniforms['eye_ipd'] == (0.035,)
+    u.invalidate_projections()
+    u.setup_hmd_persp('left', 0.01, 50)
+    assert len(computed) == 5
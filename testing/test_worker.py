@@ -0,0 +1,75 @@
+from __future__ import (print_function, division, absolute_import)
+
+
+import sys, os
+myPath = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, myPath + '/../')
+sys.path.insert(0, myPath + '/../larch')
+
+import time
+from array import array
+
+from larch import worker
+
+
+STRIDE = 7
+ROWS = 500
+
+
+class SlowSimulation(object):
+    '''Every float of a snapshot holds the tick count, so a torn snapshot
+    shows up as mixed values. Each tick takes 30 ms.'''
+    def __init__(self):
+        self.ticks = 0
+
+    def tick(self, dt):
+        time.sleep(0.03)
+        self.ticks += 1
+
+    def get_transforms(self):
+        return [float(self.ticks)] * (ROWS * STRIDE)
+
+
+def test_publish_and_read():
+    shared = worker.SharedSnapshots(2, 3)
+    out = array('f', [0.0] * 6)
+    assert shared.read(out) is None
+    shared.publish([1, 2, 3], 1)
+    assert shared.read(out) == (1, 1)
+    assert list(out[:3]) == [1, 2, 3]
+    assert shared.read(out, last_ticks=1) is None
+    shared.publish([4, 5, 6, 7, 8, 9], 2)
+    assert shared.read(out, last_ticks=1) == (2, 2)
+    assert list(out) == [4, 5, 6, 7, 8, 9]
+
+
+def test_render_rate_with_slow_tick():
+    '''A 100 Hz render loop stays steady while the simulation crawls. Real
+    time on a possibly loaded machine, so the bounds only catch reads that
+    wait for the 30 ms ticks.'''
+    out = array('f', [0.0] * (ROWS * STRIDE))
+    frame_interval = 0.01
+    intervals = []
+    snapshots = 0
+    with worker.SimulationWorker(SlowSimulation, ROWS, STRIDE, 1 / 60) as w:
+        last = time.time()
+        deadline = last + 1.0
+        while time.time() < deadline:
+            count = w.read(out)
+            if count is not None:
+                snapshots += 1
+                assert count == ROWS
+                # Never torn.
+                assert min(out) == max(out)
+            time.sleep(max(0.0, frame_interval - (time.time() - last)))
+            now = time.time()
+            intervals.append(now - last)
+            last = now
+
+    intervals.sort()
+    median = intervals[len(intervals) // 2]
+    print('frames {} snapshots {} median {:.2f} ms max {:.2f} ms'.format(
+        len(intervals), snapshots, median * 1000, intervals[-1] * 1000))
+    assert len(intervals) >= 40
+    assert median < 0.025
+    assert snapshots > 5